@@ -1,12 +1,17 @@
 from setuptools import setup, find_packages
 
-requirements = ['requests', 'click', 'twilio', 'cacheout', 'urllib3']
+requirements = ['requests', 'click', 'twilio', 'urllib3']
 
 setup(
     name="slotinfo",
     install_requires=requirements,
     version=1.3,
-    packages=find_packages(),
+    extras_require={
+        'async': ['aiohttp'],
+        'streaming': ['ijson'],
+        'history': ['numpy']
+    },
+    packages=find_packages(exclude=["tests"]),
     entry_points={
         'console_scripts': ['slotinfo=slot_info.check_available_slots:main']
     },
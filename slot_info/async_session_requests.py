@@ -0,0 +1,163 @@
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+
+from slot_info.coalesce import AsyncSingleFlight
+from slot_info.session_requests import SessionRequest, ConditionalCache, request_seconds, response_bytes, \
+    responses, request_errors, not_modified
+
+
+class AsyncSessionRequest:
+    """
+    asyncio counterpart of SessionRequest, get() returns the parsed JSON and raises requests.HTTPError
+    so callers can handle errors the same way for both clients.
+
+    Connections are kept alive in a pool of pool_size, at most limit_per_host requests are sent to a
+    single host at the same time and 429/5xx responses are retried with exponential backoff. An optional
+    RateLimiter is applied to every attempt.
+    """
+    retry_statuses = frozenset([429, 500, 502, 503, 504])
+
+    def __init__(self, headers=None,
+                 max_retries=3,
+                 backoff_factor=0.1,
+                 pool_size=100,
+                 limit_per_host=10,
+                 timeout=30,
+                 rate_limiter=None,
+                 coalesce_ttl=2.0,
+                 recorder=None):
+        self.headers = SessionRequest.default_headers if headers is None else headers
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.pool_size = pool_size
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self.recorder = recorder
+        self.conditional_cache = ConditionalCache()
+        self.single_flight = AsyncSingleFlight(ttl=coalesce_ttl)
+        self._session = None
+        self._host_semaphores = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    @property
+    def session(self):
+        # created lazily so that the session is bound to the running event loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(headers=self.headers,
+                                                  connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def get_raw(self, url, **kwargs):
+        """
+        Returns the (body, digest) of the response without parsing it, like SessionRequest.get_raw
+        """
+        key = self.conditional_cache.key(url, kwargs.get('params'))
+        return await self.single_flight.do(key, lambda: self._get_raw(key, url, **kwargs))
+
+    async def _get_raw(self, key, url, **kwargs):
+        headers = self.conditional_cache.headers(key)
+        if headers:
+            headers.update(kwargs.get('headers') or {})
+            kwargs['headers'] = headers
+        status, body, response_headers = await self._send("GET", url, **kwargs)
+        if status == 304:
+            not_modified.inc()
+            return self.conditional_cache.cached(key)
+        if status >= 400:
+            raise _http_error("GET", url, status, body)
+        return self.conditional_cache.store(key, body, response_headers.get("ETag"),
+                                            response_headers.get("Last-Modified"))
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def request(self, method, url, **kwargs):
+        status, body, _ = await self._send(method, url, **kwargs)
+        if status >= 400:
+            raise _http_error(method, url, status, body)
+        return _parse_json(body)
+
+    async def _send(self, method, url, **kwargs):
+        semaphore = self._host_semaphore(url)
+        limit = self.rate_limiter is not None and self.rate_limiter.applies_to(url)
+        attempt = 0
+        while True:
+            if limit:
+                wait = self.rate_limiter.reserve()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    async with self.session.request(method, url, **kwargs) as response:
+                        body = await response.read()
+                        status = response.status
+                        response_headers = response.headers
+                        retry_after = response_headers.get("Retry-After")
+                    request_seconds.observe(time.perf_counter() - started)
+                    responses.labels(status=status).inc()
+                    response_bytes.observe(len(body))
+                    if self.recorder is not None and method == "GET" and status == 200:
+                        self.recorder.record(url, kwargs.get('params'), status, body)
+                    if limit:
+                        self.rate_limiter.record(status, retry_after)
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    request_errors.inc()
+                    if attempt >= self.max_retries:
+                        raise
+                    status = None
+            if status is not None and status not in self.retry_statuses:
+                break
+            if attempt >= self.max_retries:
+                break
+            await asyncio.sleep(self._backoff(attempt, retry_after if status is not None else None))
+            attempt += 1
+        return status, body, response_headers
+
+    def _host_semaphore(self, url):
+        host = urlsplit(url).netloc
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._host_semaphores[host] = asyncio.Semaphore(self.limit_per_host)
+        return semaphore
+
+    def _backoff(self, attempt, retry_after):
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return self.backoff_factor * (2 ** attempt)
+
+
+def _parse_json(body):
+    return json.loads(body.decode("utf-8")) if body else None
+
+
+def _http_error(method, url, status, body):
+    response = requests.Response()
+    response.status_code = status
+    response._content = body
+    response.url = url
+    return requests.HTTPError(str(status) + " Error for " + method + " " + url, response=response)
@@ -0,0 +1,72 @@
+import math
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(values, q):
+    """
+    Nearest rank percentile of values, q between 0 and 1
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered), max(1, math.ceil(q * len(ordered)))) - 1]
+
+
+# modules a one-shot check should never import, they are only needed by some commands or options
+heavy_modules = ("twilio", "aiohttp", "ijson", "asyncio", "http.server", "tracemalloc", "numpy")
+
+
+def cold_start(runs=5):
+    """
+    Starts fresh interpreters running slotinfo --help and returns the p50/p99 wall time, the time of a bare
+    interpreter start to compare with and the heavy modules imported by the CLI module
+    """
+    def timed(args):
+        durations = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            subprocess.run([sys.executable] + args, check=True, stdout=subprocess.DEVNULL)
+            durations.append(time.perf_counter() - started)
+        return durations
+
+    durations = timed(["-m", "slot_info.check_available_slots", "--help"])
+    baseline = timed(["-c", "pass"])
+    imported = subprocess.run([sys.executable, "-c", "import sys, slot_info.check_available_slots; "
+                               "print(','.join(name for name in " + repr(heavy_modules) + " if name in sys.modules))"],
+                              check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout.strip()
+    return {
+        "startup_p50": round(percentile(durations, 0.5), 4),
+        "startup_p99": round(percentile(durations, 0.99), 4),
+        "interpreter_p50": round(percentile(baseline, 0.5), 4),
+        "heavy_modules": imported or "none"
+    }
+
+
+def run_cycles(check, targets, cycles, workers):
+    """
+    Checks every target once per cycle on a pool of workers, like watch does, and returns the throughput,
+    the p50/p99 duration of a cycle and the peak memory allocated while running one extra traced cycle.
+    The timed cycles are not traced, tracemalloc slows allocations down.
+    """
+    durations = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="benchmark") as executor:
+        for _ in range(cycles):
+            started = time.perf_counter()
+            list(executor.map(check, targets))
+            durations.append(time.perf_counter() - started)
+        tracemalloc.start()
+        try:
+            list(executor.map(check, targets))
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {
+        "targets_per_second": round(len(targets) * cycles / sum(durations), 1),
+        "cycle_p50": round(percentile(durations, 0.5), 4),
+        "cycle_p99": round(percentile(durations, 0.99), 4),
+        "peak_memory_mb": round(peak_memory / 1024 / 1024, 2)
+    }
@@ -1,19 +1,54 @@
-import time
-from datetime import datetime
+import contextlib
+import itertools
+import json
+import os
+from urllib.parse import urlsplit
 
 import click
 import requests
 
 from slot_info.cowin_api import *
-from slot_info.session_requests import SessionRequest
-from slot_info.telegram import send_telegram_message
-from slot_info.whatsapp import send_whatsapp_message
-from cacheout import Cache
-from slot_info.constants import vaccine_types, dose_numbers, age_filter
+from slot_info.session_requests import SessionRequest, ConditionalCache, ChangeTracker
+from slot_info.diff import SnapshotStore, describe_session, session_key
+from slot_info.dedup import create_dedup_store
+from slot_info.dispatch import Dispatcher
+from slot_info.rate_limiter import RateLimiter, RateLimitExceeded
+from slot_info.directory import Directory
+from slot_info.models import sessions_from_centers, sessions_from_find_by
+from slot_info.pincodes import PincodeMap
+from slot_info.watch import load_targets, plan_targets, WatchTarget, MergedTarget, FanoutTarget, WindowTarget, \
+    Watcher, AsyncWatcher
+from slot_info.schedule import AdaptiveSchedule, FixedSchedule, parse_quiet_hours, run_every
+from slot_info.options import check_options
+from slot_info.metrics import metrics, serve as serve_metrics, stats_line, log_stats_every
 
-# cache ttl is of 1 hr, this is to avoid sending multiple notifications
-cache = Cache(ttl=3600)
-session_requests = SessionRequest()
+# ttl is of 1 hr, this is to avoid sending multiple notifications, also across restarts and processes
+dedup_store = create_dedup_store(ttl=3600)
+# shared by every CoWIN call made from this process
+rate_limiter = RateLimiter(requests_per_5_minutes)
+session_requests = SessionRequest(rate_limiter=rate_limiter)
+# digest of the last response processed by every target, unchanged responses are not parsed again
+response_digests = ChangeTracker()
+# states and districts, cached on disk for name lookups
+directory = Directory(session_requests)
+# districts of the pin codes seen in responses, used to merge pin code watches into district requests
+pincode_map = PincodeMap()
+# parse calendar responses incrementally with ijson instead of loading the whole document
+stream_responses = False
+# last seen capacities of every poll target, notifications are sent only for newly opened sessions
+snapshots = SnapshotStore()
+# HistoryRecorder keeping the capacity changes of every session parsed, when enabled
+history = None
+
+check_seconds = metrics.histogram("check_seconds", "Duration of a whole check, fetch and processing")
+process_seconds = metrics.histogram("check_process_seconds",
+                                    "Time spent parsing, filtering and diffing a changed response")
+parse_seconds = metrics.histogram("response_parse_seconds", "Time spent decoding a whole response with json")
+notified_sessions = metrics.counter("notified_sessions_total", "Newly opened sessions notified")
+duplicate_sessions = metrics.counter("duplicate_sessions_total",
+                                     "Newly opened sessions not notified because they were sent recently")
+send_seconds = metrics.histogram("notification_send_seconds", "Latency of sending a notification by channel")
+send_errors = metrics.counter("notification_errors_total", "Notifications that could not be sent by channel")
 
 
 @click.group()
@@ -25,83 +60,114 @@ def main():
 
 
 @main.command(name="pincode-wise")
-@click.option("-pin", "--pin_code",
-              type=str,
-              required=True,
-              help="Pin code of your area to search for appointments")
-@click.option("-d", "--date",
-              type=str,
-              required=True,
-              help="Date for which appointments are to be checked")
-@click.option("-af", "--age_filter",
-              type=click.Choice(age_filter),
-              multiple=True,
-              required=False,
-              default=[],
-              help="Filter only 18 plus or 45 plus appointments")
-@click.option("-n", "--notify_on",
-              type=click.Choice(['whatsapp', 'telegram']),
-              required=True,
-              help="Receive notification on whatsapp/telegram")
-@click.option("-vt", "--vaccine_type",
-              type=click.Choice(vaccine_types, case_sensitive=False),
-              required=False,
-              multiple=True,
-              default=[],
-              help="Vaccine type for which appointments are to be checked")
-@click.option("-dn", "--dose_number",
-              type=click.Choice(dose_numbers),
-              required=False,
-              multiple=True,
-              default=[],
-              help="Dose number for which appointments are to be checked")
-def pincode_wise(pin_code, date, age_filter, notify_on, vaccine_type, dose_number):
+@check_options("pincode", date_range=True)
+def pincode_wise(**options):
     """
-    get pin code wise available slots on a specific date in a given pin.
+    get pin code wise available slots on a specific date, or range of dates, in a given pin.
     """
-    print("Checking for available slots in pin code " + str(pin_code) + ", for date " + str(date) +
-          ",for min_age: " + str(age_filter))
-    check_pincode_wise_slots(pin_code, date, age_filter, notify_on, vaccine_type, dose_number)
+    check_once(options)
 
 
 @main.command(name="district-wise")
-@click.option("-dId", "--district_id",
-              type=str,
-              required=True,
-              help="ID of the district, if you do no know the district ID run get-district-id command")
-@click.option("-d", "--date",
-              type=str,
-              required=True,
-              help="Date for which appointments are to be checked")
-@click.option("-af", "--age_filter",
-              type=click.Choice(age_filter),
-              multiple=True,
-              required=False,
-              default=[],
-              help="Filter only 18 plus or 45 plus appointments")
-@click.option("-n", "--notify_on",
-              type=click.Choice(['whatsapp', 'telegram']),
-              required=True,
-              help="Receive notification on whatsapp/telegram")
-@click.option("-vt", "--vaccine_type",
-              type=click.Choice(vaccine_types, case_sensitive=False),
-              required=False,
-              multiple=True,
-              default=[],
-              help="Vaccine type for which appointments are to be checked")
-@click.option("-dn", "--dose_number",
-              type=click.Choice(dose_numbers),
-              required=False,
-              multiple=True,
-              default=[],
-              help="Dose number for which appointments are to be checked")
-def district_wise(district_id, date, age_filter, notify_on, vaccine_type, dose_number):
+@check_options("district", date_range=True)
+def district_wise(**options):
     """
-    get district wise available slots on a specific date in a given district.
+    get district wise available slots on a specific date, or range of dates, in a given district.
     """
-    print("Checking for available slots in district " + str(district_id) + ", for date " + str(
-        date) + ",for min_age: " + str(age_filter))
-    check_district_wise_slots(district_id, date, age_filter, notify_on, vaccine_type, dose_number)
+    check_once(options)
+
+
+@main.command(name="pincode-wise-next7days")
+@check_options("pincode")
+def pincode_wise_next7days(**options):
+    """
+    get pin code wise available slots for next 7 days from the specified date in a given pin.
+    """
+    check_once(options, next7days=True)
+
+
+@main.command(name="district-wise-next7days")
+@check_options("district")
+def district_wise_next7days(**options):
+    """
+    get district wise available slots for next 7 days from the specified date in a given district.
+    """
+    check_once(options, next7days=True)
+
+
+@main.command(name="continuously-for-district")
+@check_options("district", date_range=True, interval=True)
+def continuously_for_district(**options):
+    """
+    Continuously check for available slots in district for a specific date, or range of dates, after every
+    x interval seconds and notify on whatsapp/telegram
+    """
+    check_continuously(options)
+
+
+@main.command(name="continuously-for-district-next7days")
+@check_options("district", interval=True)
+def continuously_for_district_next7days(**options):
+    """
+    Continuously check for available slots in district for next 7 days after every x interval seconds
+    and notify on whatsapp/telegram
+    """
+    check_continuously(options, next7days=True)
+
+
+@main.command(name="continuously-for-pincode")
+@check_options("pincode", date_range=True, interval=True)
+def continuously_for_pincode(**options):
+    """
+    Continuously check for available slots in pin code for a specific date, or range of dates, after every
+    x interval seconds and notify on whatsapp/telegram
+    """
+    check_continuously(options)
+
+
+@main.command(name="continuously-for-pincode-next7days")
+@check_options("pincode", interval=True)
+def continuously_for_pincode_next7days(**options):
+    """
+    Continuously check for available slots in pin code for next 7 days after every x interval seconds
+    and notify on whatsapp/telegram
+    """
+    check_continuously(options, next7days=True)
+
+
+def command_targets(options, next7days=False):
+    """
+    Builds the watch target of a check command from its options, the same model the watch command reads
+    from its targets file, and plans the requests needed to check it
+    """
+    values = {name: value for name, value in options.items() if value is not None}
+    values['next7days'] = next7days
+    try:
+        target = WatchTarget.from_dict(values, resolve_district=resolve_district_id, require_interval=False)
+    except ValueError as value_error:
+        raise click.UsageError(str(value_error))
+    print("Checking for available slots in " + target.name + ", for min_age: " + str(target.age_filter))
+    # a single pin code is never merged into a district request, so the pin code directory is not needed
+    return plan_targets([target], lambda pin_code: None)
+
+
+def check_once(options, next7days=False):
+    try:
+        for target in command_targets(options, next7days):
+            check_target(target)
+    finally:
+        # sent before the interpreter shuts down, no new sender threads can be started after that
+        dispatcher.close()
+
+
+def check_continuously(options, next7days=False):
+    targets = command_targets(options, next7days)
+    # like in watch, a memoized response never outlives half a poll interval
+    session_requests.single_flight.ttl = options['interval'] / 2.0
+    try:
+        run_every(options['interval'], lambda: [check_target(target) for target in targets])
+    finally:
+        dispatcher.close()
 
 
 @main.command(name="get-state-id")
@@ -113,19 +179,11 @@ def get_state_id(state_name):
     """
     Get's the ID of the state name
     """
-    url = BASE_API + get_all_states
     try:
-        response_data = session_requests.get(url)
-        states = response_data['states']
-        state_id = None
-        for state in states:
-            if state_name == state['state_name']:
-                state_id = state['state_id']
-                break
-        if state_id is None:
-            print("Provide proper name of the state")
-        else:
-            print("State ID is : ", state_id)
+        state = directory.find_state(state_name)
+        print("State ID is : ", state['state_id'])
+    except LookupError as lookup_error:
+        print(str(lookup_error))
     except requests.HTTPError as http_error:
         print_error_message(http_error)
 
@@ -133,8 +191,8 @@ def get_state_id(state_name):
 @main.command(name="get-district-id")
 @click.option("-sId", "--state_id",
               type=str,
-              required=True,
-              help="ID of the state, if you do not know the state ID run get-state-id command")
+              required=False,
+              help="ID of the state, only needed when the district name is used in several states")
 @click.option("-dn", "--district_name",
               type=str,
               required=True,
@@ -143,419 +201,871 @@ def get_district_id(state_id, district_name):
     """
     Get's the ID of the district name
     """
-    url = BASE_API + get_all_districts.format(state_id)
     try:
-        response_data = session_requests.get(url)
-        districts = response_data['districts']
-        district_id = None
-        for district in districts:
-            if district_name == district['district_name']:
-                district_id = district['district_id']
-                break
-        if district_id is None:
-            print("Provide proper name of the district")
-        else:
-            print("District ID is : ", district_id)
+        district = directory.find_district(district_name, state_id)
+        print("District ID is : ", district['district_id'])
+    except LookupError as lookup_error:
+        print(str(lookup_error))
     except requests.HTTPError as http_error:
         print_error_message(http_error)
 
 
-@main.command(name="continuously-for-district")
-@click.option("-dId", "--district_id",
-              type=str,
+@main.command(name="refresh-directory")
+def refresh_directory():
+    """
+    Fetch all the states and districts again for the name lookups
+    """
+    try:
+        directory.refresh()
+        print("Saved the states and districts to " + directory.path)
+    except requests.HTTPError as http_error:
+        print_error_message(http_error)
+
+
+@main.command(name="watch")
+@click.option("-t", "--targets_file",
+              type=click.Path(exists=True, dir_okay=False),
               required=True,
-              help="Provide district Id to check for appointments")
-@click.option("-d", "--date",
+              help="JSON file with the districts/pin codes to watch, each with its own filters and interval")
+@click.option("-w", "--workers",
+              type=click.IntRange(min=1),
+              required=False,
+              default=8,
+              help="Maximum number of targets checked at the same time")
+@click.option("--use_async",
+              is_flag=True,
+              default=False,
+              help="Fetch with asyncio and aiohttp instead of a thread pool, requires aiohttp to be installed")
+@click.option("-rl", "--rate_limit",
+              type=click.IntRange(min=1),
+              required=False,
+              default=requests_per_5_minutes,
+              help="Maximum number of CoWIN requests to send in 5 minutes")
+@click.option("--streaming",
+              is_flag=True,
+              default=False,
+              help="Parse responses incrementally to use less memory, requires ijson to be installed")
+@click.option("--adaptive",
+              is_flag=True,
+              default=False,
+              help="Poll targets whose slots change often faster and quiet ones slower, within their "
+                   "min_interval and max_interval")
+@click.option("--quiet_hours",
               type=str,
-              required=True,
-              help="Date for which appointments are to be checked")
-@click.option("-af", "--age_filter",
-              type=click.Choice(age_filter),
-              multiple=True,
               required=False,
-              default=[],
-              help="Filter only 18 plus or 45 plus appointments")
-@click.option("-i", "--interval",
-              type=int,
-              required=True,
-              help="Interval in seconds")
-@click.option("-n", "--notify_on",
-              type=click.Choice(['whatsapp', 'telegram']),
-              required=True,
-              help="Receive notification on whatsapp/telegram")
-@click.option("-vt", "--vaccine_type",
-              type=click.Choice(vaccine_types, case_sensitive=False),
+              default=None,
+              help="Local hours during which adaptive intervals are doubled, for example: 22-7")
+@click.option("--metrics_port",
+              type=click.IntRange(min=1, max=65535),
               required=False,
-              multiple=True,
-              default=[],
-              help="Vaccine type for which appointments are to be checked")
-@click.option("-dn", "--dose_number",
-              type=click.Choice(dose_numbers),
+              default=None,
+              help="Serve Prometheus metrics on http://127.0.0.1:<port>/metrics")
+@click.option("--stats_interval",
+              type=click.IntRange(min=0),
               required=False,
-              multiple=True,
-              default=[],
-              help="Dose number for which appointments are to be checked")
-def continuously_for_district(district_id, date, age_filter, interval, notify_on, vaccine_type, dose_number):
+              default=0,
+              help="Print a stats line every x seconds, 0 to disable")
+@click.option("--record",
+              type=click.Path(file_okay=False),
+              required=False,
+              default=None,
+              help="Save every CoWIN response to this directory, to be replayed with replay-server")
+@click.option("--history",
+              "history_directory",
+              type=click.Path(file_okay=False),
+              required=False,
+              default=None,
+              help="Save the capacity changes of every session to this directory, to be queried with history")
+@click.option("--activity_profile",
+              type=click.Path(exists=True, dir_okay=False),
+              required=False,
+              default=None,
+              help="JSON exported by history --export, with --adaptive poll faster in the hours when slots "
+                   "usually open")
+@click.option("--shard",
+              type=str,
+              required=False,
+              default=None,
+              help="Only watch the targets of shard <index>/<count>, targets are split by district and pin code")
+@click.option("--coordinator",
+              type=str,
+              required=False,
+              default=None,
+              help="URL of the coordinator whose dedup store and rate budget are shared with the other shards")
+def watch(targets_file, workers, use_async, rate_limit, streaming, adaptive, quiet_hours, metrics_port,
+          stats_interval, record, history_directory, activity_profile, shard, coordinator):
     """
-    Continuously check for available slots in district for a specific date after every x interval seconds
-    and notify on whatsapp/telegram
+    Continuously check many districts and pin codes from a single process, sharing one connection pool
     """
-    print("Checking for available slots in district " + str(district_id) + ", for date " + str(
-        date) + ",for min_age: " + str(age_filter))
-    while True:
-        check_district_wise_slots(district_id, date, age_filter, notify_on, vaccine_type, dose_number)
-        time.sleep(interval)
+    global stream_responses, dedup_store, rate_limiter, history
+    if streaming:
+        try:
+            import slot_info.streaming
+        except ImportError as import_error:
+            raise click.UsageError("--streaming requires ijson, install it with: pip install slotinfo[streaming] (" +
+                                   str(import_error) + ")")
+    stream_responses = streaming
+    if use_async:
+        try:
+            from slot_info.async_session_requests import AsyncSessionRequest
+        except ImportError as import_error:
+            raise click.UsageError("--use_async requires aiohttp, install it with: pip install slotinfo[async] (" +
+                                   str(import_error) + ")")
+    try:
+        quiet_hours = parse_quiet_hours(quiet_hours) if quiet_hours else None
+    except ValueError as value_error:
+        raise click.BadParameter(str(value_error), param_hint="--quiet_hours")
+    interval_factors = None
+    if activity_profile is not None or history_directory is not None:
+        from slot_info.history import HistoryRecorder, load_interval_factors
+    if activity_profile is not None:
+        if not adaptive:
+            raise click.BadParameter("only applies with --adaptive", param_hint="--activity_profile")
+        try:
+            interval_factors = load_interval_factors(activity_profile)
+        except ValueError as value_error:
+            raise click.BadParameter(str(value_error), param_hint="--activity_profile")
+    if history_directory is not None:
+        history = HistoryRecorder(history_directory)
+    if shard is not None or coordinator is not None:
+        from slot_info.shard import parse_shard, shard_targets, CoordinatedDedupStore, CoordinatedRateLimiter
+    try:
+        shard = parse_shard(shard) if shard is not None else None
+    except ValueError as value_error:
+        raise click.BadParameter(str(value_error), param_hint="--shard")
+    if coordinator is not None:
+        dedup_store = CoordinatedDedupStore(coordinator)
+        rate_limiter = session_requests.rate_limiter = CoordinatedRateLimiter(
+            coordinator, rate_limit, shards=shard[1] if shard is not None else 1)
+    else:
+        rate_limiter.set_budget(rate_limit)
+    try:
+        targets = load_targets(targets_file, resolve_district_id)
+    except ValueError as value_error:
+        raise click.UsageError("Invalid targets file " + targets_file + ": " + str(value_error))
+    if shard is not None:
+        targets = shard_targets(targets, shard)
+        print("Shard " + str(shard[0]) + "/" + str(shard[1]) + " has " + str(len(targets)) + " targets")
+        if not targets:
+            return
+    planned = plan_targets(targets, district_for_pincode)
+    print("Watching " + str(len(targets)) + " targets with " + str(len(planned)) + " requests per round and " +
+          str(workers) + " workers")
+    targets = planned
+    shortest_interval = min(target.min_interval if adaptive else target.interval for target in targets)
+    # a request that cannot be sent before the target is due again is shed instead of queued
+    rate_limiter.max_wait = shortest_interval
+    # identical requests of targets polled close together are served once, well within a poll interval
+    coalesce_ttl = shortest_interval / 2.0
+    schedule = AdaptiveSchedule(rate_limiter, quiet_hours=quiet_hours, interval_factors=interval_factors) \
+        if adaptive else FixedSchedule()
+    if metrics_port is not None:
+        serve_metrics(metrics_port)
+        print("Serving metrics on http://127.0.0.1:" + str(metrics_port) + "/metrics")
+    if stats_interval:
+        log_stats_every(stats_interval)
+    recorder = None
+    if record:
+        from slot_info.replay import ResponseRecorder
+        recorder = ResponseRecorder(record)
+    single_flight = None
+    try:
+        if use_async:
+            import asyncio
+            rate_limiter.hosts = frozenset([urlsplit(BASE_API).netloc])
+            client = AsyncSessionRequest(pool_size=workers, limit_per_host=workers, rate_limiter=rate_limiter,
+                                         coalesce_ttl=coalesce_ttl, recorder=recorder)
+            single_flight = client.single_flight
+            asyncio.run(AsyncWatcher(targets, async_check_target, client, max_concurrency=workers,
+                                     schedule=schedule).run())
+        else:
+            session_requests.set_pool_size(workers)
+            session_requests.recorder = recorder
+            session_requests.single_flight.ttl = coalesce_ttl
+            single_flight = session_requests.single_flight
+            Watcher(targets, check_target, max_workers=workers, schedule=schedule).run()
+    finally:
+        dispatcher.close()
+        print("Rate limiter stats: " + str(rate_limiter.stats()))
+        if single_flight is not None:
+            print("Coalesced request stats: " + str(single_flight.stats()))
+        if adaptive:
+            print("Adaptive schedule stats: " + str(schedule.stats()))
+        if history is not None:
+            history.flush()
+            print("Saved " + str(history.rows) + " session observations to " + history_directory)
+        print(stats_line())
 
 
-@main.command(name="continuously-for-district-next7days")
-@click.option("-dId", "--district_id",
-              type=str,
+@main.command(name="history")
+@click.option("-d", "--directory",
+              type=click.Path(exists=True, file_okay=False),
               required=True,
-              help="Provide district Id to check for appointments")
-@click.option("-d", "--date",
+              help="Directory the history was saved to with watch --history")
+@click.option("--from", "from_date",
               type=str,
-              required=True,
-              help="Date for which appointments are to be checked for next 7 days")
-@click.option("-af", "--age_filter",
-              type=click.Choice(age_filter),
-              multiple=True,
               required=False,
-              default=[],
-              help="Filter only 18 plus or 45 plus appointments")
-@click.option("-i", "--interval",
-              type=int,
-              required=True,
-              help="Interval in seconds")
-@click.option("-n", "--notify_on",
-              type=click.Choice(['whatsapp', 'telegram']),
-              required=True,
-              help="Receive notification on whatsapp/telegram")
-@click.option("-vt", "--vaccine_type",
-              type=click.Choice(vaccine_types, case_sensitive=False),
+              default=None,
+              help="First day of observations to read, DD-MM-YYYY")
+@click.option("--to", "to_date",
+              type=str,
               required=False,
-              multiple=True,
-              default=[],
-              help="Vaccine type for which appointments are to be checked")
-@click.option("-dn", "--dose_number",
-              type=click.Choice(dose_numbers),
+              default=None,
+              help="Last day of observations to read, DD-MM-YYYY")
+@click.option("--top",
+              type=click.IntRange(min=1),
               required=False,
-              multiple=True,
-              default=[],
-              help="Dose number for which appointments are to be checked")
-def continuously_for_district_next7days(district_id, date, age_filter, interval, notify_on, vaccine_type, dose_number):
+              default=10,
+              help="Number of centers with the most openings to show")
+@click.option("--export",
+              type=click.Path(dir_okay=False),
+              required=False,
+              default=None,
+              help="Save the summary as JSON, to be passed to watch --activity_profile")
+def history_summary(directory, from_date, to_date, top, export):
     """
-    Continuously check for available slots in district for next 7 days after every x interval seconds
-    and notify on whatsapp/telegram
+    Summarise when slots open per center, weekday and hour from the saved history, requires numpy
     """
-    print("Checking for available slots in district " + str(district_id) + ", for next 7 days starting from date:  "
-          + str(date) + ",for min_age: " + str(age_filter))
-    while True:
-        check_district_wise_slots_next7days(district_id, date, age_filter, notify_on, vaccine_type, dose_number)
-        time.sleep(interval)
+    from slot_info.dates import parse_date
+    from slot_info.history import load_history, summarise, weekdays
+    try:
+        from_date = parse_date(from_date) if from_date else None
+        to_date = parse_date(to_date) if to_date else None
+    except ValueError as value_error:
+        raise click.UsageError(str(value_error))
+    data, centers, vaccines = load_history(directory, from_date, to_date)
+    summary = summarise(data, centers, vaccines, top=top)
+    print("Observations: " + str(summary['observations']) + ", sessions first seen: " + str(summary['first_seen']) +
+          ", openings: " + str(summary['openings']))
+    print("Openings per weekday: " + ", ".join(day + " " + str(summary['by_weekday'][day]) for day in weekdays))
+    print("Openings per hour: " + ", ".join(str(hour) + "h " + str(count)
+                                            for hour, count in enumerate(summary['by_hour']) if count))
+    print("Openings per vaccine: " + ", ".join(vaccine + " " + str(count)
+                                               for vaccine, count in summary['by_vaccine'].items()))
+    for center in summary['centers']:
+        print("Name: " + str(center['name']) + ", PinCode: " + str(center['pincode']) + ", Openings: " +
+              str(center['openings']) + ", Doses: " + str(center['doses']))
+    if export:
+        with open(export, "w") as export_file:
+            json.dump(summary, export_file, indent=2)
+        print("Saved the summary to " + export)
 
 
-@main.command(name="continuously-for-pincode")
-@click.option("-pin", "--pin_code",
+@main.command(name="coordinator")
+@click.option("-p", "--port",
+              type=click.IntRange(min=1, max=65535),
+              required=False,
+              default=8378,
+              help="Port to serve the coordinator on")
+@click.option("--host",
               type=str,
+              required=False,
+              default="127.0.0.1",
+              help="Address to serve the coordinator on, 0.0.0.0 to accept shards of other hosts")
+@click.option("-rl", "--rate_limit",
+              type=click.IntRange(min=1),
+              required=False,
+              default=requests_per_5_minutes,
+              help="Maximum number of CoWIN requests all the shards together send in 5 minutes")
+def coordinator(port, host, rate_limit):
+    """
+    Serve the dedup store and the rate budget shared by the shards of watch
+    """
+    from slot_info.shard import Coordinator
+    server = Coordinator(dedup_store, RateLimiter(rate_limit), port=port, host=host)
+    print("Serving the coordinator on " + server.url)
+    try:
+        server.serve_forever()
+    finally:
+        print("Rate limiter stats: " + str(server.rate_limiter.stats()))
+
+
+@main.command(name="shard")
+@click.option("-t", "--targets_file",
+              type=click.Path(exists=True, dir_okay=False),
               required=True,
-              help="Pin code of your area to search for appointments")
-@click.option("-d", "--date",
+              help="JSON file with the districts/pin codes to watch, each with its own filters and interval")
+@click.option("-n", "--processes",
+              type=click.IntRange(min=1),
+              required=False,
+              default=os.cpu_count() or 1,
+              help="Number of watch processes to start on this host, one per core by default")
+@click.option("--shards",
+              type=click.IntRange(min=1),
+              required=False,
+              default=None,
+              help="Total number of shards over all the hosts, the number of processes by default")
+@click.option("--first_shard",
+              type=click.IntRange(min=0),
+              required=False,
+              default=0,
+              help="Index of the first shard run on this host")
+@click.option("--coordinator",
+              "coordinator_url",
               type=str,
-              required=True,
-              help="Date for which appointments are to be checked")
-@click.option("-af", "--age_filter",
-              type=click.Choice(age_filter),
-              multiple=True,
               required=False,
-              default=[],
-              help="Filter only 18 plus or 45 plus appointments")
-@click.option("-i", "--interval",
-              type=int,
-              required=True,
-              help="Interval in seconds to check for available slots")
-@click.option("-n", "--notify_on",
-              type=click.Choice(['whatsapp', 'telegram']),
-              required=True,
-              help="Receive notification on whatsapp/telegram")
-@click.option("-vt", "--vaccine_type",
-              type=click.Choice(vaccine_types, case_sensitive=False),
+              default=None,
+              help="URL of a coordinator started with the coordinator command, one is started here by default")
+@click.option("-w", "--workers",
+              type=click.IntRange(min=1),
               required=False,
-              multiple=True,
-              default=[],
-              help="Vaccine type for which appointments are to be checked")
-@click.option("-dn", "--dose_number",
-              type=click.Choice(dose_numbers),
+              default=8,
+              help="Maximum number of targets checked at the same time by every process")
+@click.option("-rl", "--rate_limit",
+              type=click.IntRange(min=1),
               required=False,
-              multiple=True,
-              default=[],
-              help="Dose number for which appointments are to be checked")
-def continuously_for_pincode(pin_code, date, age_filter, interval, notify_on, vaccine_type, dose_number):
+              default=requests_per_5_minutes,
+              help="Maximum number of CoWIN requests all the shards together send in 5 minutes")
+@click.option("--adaptive",
+              is_flag=True,
+              default=False,
+              help="Pass --adaptive to every watch process")
+def shard(targets_file, processes, shards, first_shard, coordinator_url, workers, rate_limit, adaptive):
     """
-    Continuously check for available slots in pin code for a specific date after every x interval seconds
-    and notify on whatsapp/telegram
+    Split the watch targets by location over several processes, sharing one dedup store and rate budget
     """
-    print("Checking for available slots in pin code " + str(pin_code) + ", for date " + str(date) +
-          ",for min_age: " + str(age_filter))
-    while True:
-        check_pincode_wise_slots(pin_code, date, age_filter, notify_on, vaccine_type, dose_number)
-        time.sleep(interval)
+    import subprocess
+    import sys
+    shards = processes if shards is None else shards
+    if first_shard + processes > shards:
+        raise click.UsageError("--first_shard and --processes go past the last of the " + str(shards) + " shards")
+    server = None
+    if coordinator_url is None:
+        from slot_info.shard import Coordinator
+        server = Coordinator(dedup_store, RateLimiter(rate_limit)).start()
+        coordinator_url = server.url
+    print("Starting shards " + str(first_shard) + " to " + str(first_shard + processes - 1) + " of " + str(shards) +
+          " with the coordinator on " + coordinator_url)
+    children = [subprocess.Popen([sys.executable, "-m", "slot_info.check_available_slots", "watch",
+                                  "--targets_file", targets_file, "--workers", str(workers),
+                                  "--rate_limit", str(rate_limit), "--shard", str(index) + "/" + str(shards),
+                                  "--coordinator", coordinator_url] + (["--adaptive"] if adaptive else []))
+                for index in range(first_shard, first_shard + processes)]
+    try:
+        for child in children:
+            child.wait()
+    except KeyboardInterrupt:
+        # the shards got the interrupt too, let them print their stats
+        for child in children:
+            child.wait()
+    finally:
+        if server is not None:
+            print("Coordinator rate limiter stats: " + str(server.rate_limiter.stats()))
 
 
-@main.command(name="continuously-for-pincode-next7days")
-@click.option("-pin", "--pin_code",
-              type=str,
-              required=True,
-              help="Pin code of your area to search for appointments")
-@click.option("-d", "--date",
-              type=str,
-              required=True,
-              help="Date for which appointments are to be checked for next 7 days")
-@click.option("-af", "--age_filter",
-              type=click.Choice(age_filter),
-              multiple=True,
+@main.command(name="daemon")
+@click.option("-p", "--port",
+              type=click.IntRange(min=1, max=65535),
               required=False,
-              default=[],
-              help="Filter only 18 plus or 45 plus appointments")
-@click.option("-i", "--interval",
-              type=int,
-              required=True,
-              help="Interval in seconds to check for available slots")
-@click.option("-n", "--notify_on",
-              type=click.Choice(['whatsapp', 'telegram']),
-              required=True,
-              help="Receive notification on whatsapp/telegram")
-@click.option("-vt", "--vaccine_type",
-              type=click.Choice(vaccine_types, case_sensitive=False),
+              default=8377,
+              help="Serve the API on http://127.0.0.1:<port>")
+@click.option("--socket",
+              "socket_path",
+              type=click.Path(dir_okay=False),
               required=False,
-              multiple=True,
-              default=[],
-              help="Vaccine_type for which appointments are to be checked")
-@click.option("-dn", "--dose_number",
-              type=click.Choice(dose_numbers),
+              default=None,
+              help="Serve the API on this Unix socket instead of a port")
+@click.option("-w", "--workers",
+              type=click.IntRange(min=1),
               required=False,
-              multiple=True,
-              default=[],
-              help="Dose number for which appointments are to be checked")
-def continuously_for_pincode_next7days(pin_code, date, age_filter, interval, notify_on, vaccine_type, dose_number):
+              default=8,
+              help="Maximum number of targets checked at the same time")
+@click.option("-rl", "--rate_limit",
+              type=click.IntRange(min=1),
+              required=False,
+              default=requests_per_5_minutes,
+              help="Maximum number of CoWIN requests to send in 5 minutes")
+def daemon(port, socket_path, workers, rate_limit):
     """
-    Continuously check for available slots in pin code for next 7 days after every x interval seconds
-    and notify on whatsapp/telegram
+    Keep watching in the background, watches and subscribers are added and removed through a local HTTP API
     """
-    print("Checking for available slots in pin code " + str(pin_code) + ", for next 7 days starting from date " + str(
-        date) + ",for min_age: " + str(age_filter))
-    while True:
-        check_pincode_wise_slots_next7days(pin_code, date, age_filter, notify_on, vaccine_type, dose_number)
-        time.sleep(interval)
+    from slot_info.daemon import Daemon, serve as serve_daemon
+    rate_limiter.set_budget(rate_limit)
+    session_requests.set_pool_size(workers)
+    # watches of a location already share one request, and a watch added later may poll faster than any
+    # TTL picked now, so concurrent identical requests are still coalesced but responses are not memoized
+    session_requests.single_flight.ttl = 0
+    watcher = Watcher([], check_target, max_workers=workers, keep_running=True)
+    registry = Daemon(watcher, lookup_district_id, retire=retire_targets)
+    registry.load()
+    serve_daemon(registry, port=port, socket_path=socket_path)
+    print("Serving the daemon API on " + (socket_path if socket_path is not None else
+                                          "http://127.0.0.1:" + str(port)) + " with " +
+          str(len(registry.watches)) + " watches")
+    try:
+        watcher.run()
+    finally:
+        dispatcher.close()
+        print(stats_line())
 
 
-@main.command(name="pincode-wise-next7days")
-@click.option("-pin", "--pin_code",
-              type=str,
-              required=True,
-              help="Pin code of your area to search for appointments")
-@click.option("-d", "--date",
-              type=str,
-              required=True,
-              help="Date for which appointments are to be checked for next 7 days")
-@click.option("-af", "--age_filter",
-              type=click.Choice(age_filter),
-              multiple=True,
+@main.command(name="replay-notifications")
+def replay_notifications():
+    """
+    Send again the notifications that could not be delivered earlier
+    """
+    count = dispatcher.replay()
+    dispatcher.close()
+    print("Replayed " + str(count) + " notifications from " + dispatcher.spool_path)
+
+
+@main.command(name="replay-server")
+@click.option("-r", "--recordings",
+              type=click.Path(exists=True, file_okay=False),
               required=False,
-              default=[],
-              help="Filter only 18 plus or 45 plus appointments")
-@click.option("-n", "--notify_on",
-              type=click.Choice(['whatsapp', 'telegram']),
-              required=True,
-              help="Receive notification on whatsapp/telegram")
-@click.option("-vt", "--vaccine_type",
-              type=click.Choice(vaccine_types, case_sensitive=False),
+              default=None,
+              help="Directory of responses saved by watch --record, synthetic districts are served when not given")
+@click.option("-s", "--sessions",
+              type=click.IntRange(min=1),
               required=False,
-              multiple=True,
-              default=[],
-              help="Vaccine type for which appointments are to be checked")
-@click.option("-dn", "--dose_number",
-              type=click.Choice(dose_numbers),
+              default=1000,
+              help="Number of sessions of every synthetic district")
+@click.option("-p", "--port",
+              type=click.IntRange(min=1, max=65535),
               required=False,
-              multiple=True,
-              default=[],
-              help="Dose number for which appointments are to be checked")
-def pincode_wise_next7days(pin_code, date, age_filter, notify_on, vaccine_type, dose_number):
+              default=8765,
+              help="Port to listen on")
+@click.option("--latency",
+              type=click.FloatRange(min=0),
+              required=False,
+              default=0.0,
+              help="Seconds every response is delayed by")
+@click.option("--jitter",
+              type=click.FloatRange(min=0),
+              required=False,
+              default=0.0,
+              help="Up to this many seconds are randomly added to the latency")
+@click.option("--error_rate",
+              type=click.FloatRange(min=0, max=1),
+              required=False,
+              default=0.0,
+              help="Fraction of the requests answered with --error_status")
+@click.option("--error_status",
+              type=int,
+              required=False,
+              default=503,
+              help="Status code of the injected errors")
+@click.option("--messaging_port",
+              type=click.IntRange(min=1, max=65535),
+              required=False,
+              default=None,
+              help="Also accept Telegram and WhatsApp messages on this port instead of sending them")
+def replay_server(recordings, sessions, port, latency, jitter, error_rate, error_status, messaging_port):
     """
-    Check for available slots in pin code for next 7 days from the date provided
+    Serve recorded or synthetic CoWIN responses locally, point slotinfo to it with SLOTINFO_COWIN_API
     """
-    print("Checking for available slots in pin code " + str(pin_code) + ", for next 7 days starting from date "
-          + str(date) + ",for min_age: " + str(age_filter))
-    check_pincode_wise_slots_next7days(pin_code, date, age_filter, notify_on, vaccine_type, dose_number)
+    from slot_info.replay import RecordedResponses, SyntheticCalendar, ReplayServer, MessagingServer
+    responder = RecordedResponses(recordings) if recordings else SyntheticCalendar(sessions)
+    server = ReplayServer(responder, port=port, latency=latency, jitter=jitter, error_rate=error_rate,
+                          error_status=error_status)
+    messaging = None
+    if messaging_port is not None:
+        messaging = MessagingServer(port=messaging_port, latency=latency).start()
+        print("Accepting messages on " + messaging.url + ", run slotinfo with SLOTINFO_TELEGRAM_API=" +
+              messaging.url + " and SLOTINFO_TWILIO_API=" + messaging.url)
+    print("Serving on " + server.url + ", run slotinfo with SLOTINFO_COWIN_API=" + server.url)
+    try:
+        server.serve_forever()
+    finally:
+        print("Served " + str(server.requests) + " requests, " + str(server.errors) + " injected errors")
+        if messaging is not None:
+            print("Accepted " + str(len(messaging.messages)) + " messages")
 
 
-@main.command(name="district-wise-next7days")
-@click.option("-dId", "--district_id",
-              type=str,
-              required=True,
-              help="ID of the district, if you do no know the district ID run get-district-id command")
-@click.option("-d", "--date",
-              type=str,
-              required=True,
-              help="Date for which appointments are to be checked for next 7 days")
-@click.option("-af", "--age_filter",
-              type=click.Choice(age_filter),
+@main.command(name="benchmark")
+@click.option("-s", "--sessions",
+              type=click.IntRange(min=1),
               multiple=True,
+              default=[10, 100, 1000, 10000],
+              help="Number of sessions of every synthetic district, can be given several times")
+@click.option("-t", "--targets",
+              type=click.IntRange(min=1),
               required=False,
-              default=[],
-              help="Filter only 18 plus or 45 plus appointments")
-@click.option("-n", "--notify_on",
-              type=click.Choice(['whatsapp', 'telegram']),
-              required=True,
-              help="Receive notification on whatsapp/telegram")
-@click.option("-vt", "--vaccine_type",
-              type=click.Choice(vaccine_types, case_sensitive=False),
+              default=20,
+              help="Number of districts checked in every cycle")
+@click.option("-c", "--cycles",
+              type=click.IntRange(min=1),
               required=False,
-              multiple=True,
-              default=[],
-              help="Vaccine type for which appointments are to be checked")
-@click.option("-dn", "--dose_number",
-              type=click.Choice(dose_numbers),
+              default=10,
+              help="Number of timed cycles")
+@click.option("-w", "--workers",
+              type=click.IntRange(min=1),
               required=False,
-              multiple=True,
-              default=[],
-              help="Dose number for which appointments are to be checked")
-def district_wise_next7days(district_id, date, age_filter, notify_on, vaccine_type, dose_number):
+              default=8,
+              help="Maximum number of targets checked at the same time")
+@click.option("--latency",
+              type=click.FloatRange(min=0),
+              required=False,
+              default=0.0,
+              help="Seconds every response of the local server is delayed by")
+@click.option("--error_rate",
+              type=click.FloatRange(min=0, max=1),
+              required=False,
+              default=0.0,
+              help="Fraction of the requests answered with an error")
+@click.option("--startup_runs",
+              type=click.IntRange(min=0),
+              required=False,
+              default=5,
+              help="Number of fresh processes started to measure the cold start time, 0 to skip")
+def benchmark(sessions, targets, cycles, workers, latency, error_rate, startup_runs):
     """
-    Check for available slots in district for next 7 days from the date provided
+    Measure the cold start time and the check path against a local server with synthetic districts, nothing
+    is sent or saved
     """
-    print("Checking for available slots in district " + str(district_id) + ", for next 7 days starting from date "
-          + str(date) + ",for min_age: " + str(age_filter))
-    check_district_wise_slots_next7days(district_id, date, age_filter, notify_on, vaccine_type, dose_number)
+    global BASE_API, dedup_store, pincode_map, snapshots
+    from slot_info.benchmark import run_cycles, cold_start
+    if startup_runs:
+        print("Cold start, " + ", ".join(key + ": " + str(value) for key, value in cold_start(startup_runs).items()))
+    from slot_info.replay import SyntheticCalendar, ReplayServer
+    original_api = BASE_API
+    # notifications, dedup entries and learned pin codes of made up districts must not leave the process
+    dedup_store = create_dedup_store("memory", ttl=3600)
+    pincode_map = PincodeMap(path="")
+    dispatcher.send = lambda message, notify_on, recipient=None: None
+    rate_limiter.set_budget(10 ** 9)
+    session_requests.set_pool_size(workers)
+    session_requests.single_flight.ttl = 0
+    try:
+        for size in sessions:
+            server = ReplayServer(SyntheticCalendar(size), latency=latency, error_rate=error_rate).start()
+            BASE_API = server.url
+            snapshots = SnapshotStore()
+            watch_targets = [WatchTarget("10-05-2021", 1, "telegram", district_id=str(index), next7days=True)
+                             for index in range(targets)]
+            # the sessions found are printed like in any check, that output is not what is measured here
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                result = run_cycles(check_target, watch_targets, cycles, workers)
+            server.stop()
+            print("Sessions per district: " + str(size) + ", " + ", ".join(
+                key + ": " + str(value) for key, value in result.items()))
+    finally:
+        BASE_API = original_api
 
 
-def check_pincode_wise_slots(pin_code, date, age_filter, notify_on, vaccine_types, dose_number):
-    validate_inputs(date)
-    url = BASE_API + find_by_pin
-    params = {
-        "pincode": pin_code,
-        "date": date
-    }
+def check_target(target):
+    """
+    Checks a watch target and returns whether its matching sessions changed since the last check
+    """
+    url, params, _, _ = target_request(target)
     try:
-        response_data = session_requests.get(url=url, params=params)
-        if len(response_data['sessions']) > 0:
-            create_message_from_session(response_data['sessions'], age_filter, notify_on, vaccine_types, dose_number)
-        else:
-            print("No slots are available for pincode: ", pin_code)
+        with check_seconds.time():
+            # unchanged responses are not parsed and filtered again
+            body, digest = session_requests.get_raw(url=url, params=params)
+            if response_digests.is_changed(target, digest):
+                with process_seconds.time():
+                    return process_target_response(target, body)
     except requests.HTTPError as http_error:
         print_error_message(http_error)
+    except RateLimitExceeded as rate_limit_exceeded:
+        print("Skipped " + target.name + ": " + str(rate_limit_exceeded))
+    return False
 
 
-def check_pincode_wise_slots_next7days(pin_code, date, age_filter, notify_on, vaccine_types, dose_number):
-    validate_inputs(date)
-    url = BASE_API + calendar_by_pin
+def target_request(target):
+    """
+    Returns the url, params, response processor and empty response message for a watch target
+    """
+    if target.district_id is not None:
+        params = {"district_id": target.district_id, "date": target.date}
+        if target.next7days:
+            return BASE_API + calendar_by_district, params, process_centers_response, \
+                "There are no centers available for this district"
+        return BASE_API + find_by_district, params, process_sessions_response, \
+            "No slots are available for district: " + str(target.district_id)
+    params = {"pincode": target.pin_code, "date": target.date}
+    if target.next7days:
+        return BASE_API + calendar_by_pin, params, process_centers_response, \
+            "There are no centers available for this pin code"
+    return BASE_API + find_by_pin, params, process_sessions_response, \
+        "No slots are available for pincode: " + str(target.pin_code)
+
 
-    params = {
-        "pincode": pin_code,
-        "date": date
-    }
+async def async_check_target(client, target):
+    """
+    Same as check_target but fetches with an AsyncSessionRequest, the blocking filter and notify step
+    is run on the default executor so that other fetches keep going meanwhile.
+    """
+    url, params, _, _ = target_request(target)
+    import asyncio
+    loop = asyncio.get_running_loop()
+    started = loop.time()
     try:
-        response_data = session_requests.get(url=url, params=params)
-        if len(response_data['centers']) > 0:
-            for center in response_data['centers']:
-                for session in center['sessions']:
-                    session['pincode'] = center['pincode']
-                    session['name'] = center['name']
-                    sessions = [session]
-                    create_message_from_session(sessions, age_filter, notify_on, vaccine_types, dose_number)
-        else:
-            print("There are no centers available for this pin code")
+        body, digest = await client.get_raw(url, params=params)
     except requests.HTTPError as http_error:
         print_error_message(http_error)
+        return False
+    except RateLimitExceeded as rate_limit_exceeded:
+        print("Skipped " + target.name + ": " + str(rate_limit_exceeded))
+        return False
+    try:
+        if not response_digests.is_changed(target, digest):
+            return False
+        return await loop.run_in_executor(None, timed_process_target_response, target, body)
+    finally:
+        check_seconds.observe(loop.time() - started)
 
 
-def check_district_wise_slots(district_id, date, age_filter, notify_on, vaccine_types, dose_number):
-    validate_inputs(date)
-    url = BASE_API + find_by_district
-    params = {
-        "district_id": district_id,
-        "date": date
-    }
+def timed_process_target_response(target, body):
+    with process_seconds.time():
+        return process_target_response(target, body)
 
-    try:
-        response_data = session_requests.get(url=url, params=params)
-        if len(response_data['sessions']) > 0:
-            create_message_from_session(response_data['sessions'], age_filter, notify_on, vaccine_types, dose_number)
-        else:
-            print("No slots are available for district: ", district_id)
-    except requests.HTTPError as http_error:
-        print_error_message(http_error)
 
+def process_target_response(target, body):
+    if isinstance(target, MergedTarget):
+        return process_merged_response(target, body)
+    if isinstance(target, WindowTarget):
+        return process_window_response(target, body)
+    if isinstance(target, FanoutTarget):
+        return process_fanout_response(target, body)
+    url, params, process, empty_message = target_request(target)
+    return process(body, scope_for(url, params, target.session_filter), empty_message, target.session_filter,
+                   target.notify_on, target.recipient)
 
-def check_district_wise_slots_next7days(district_id, date, age_filter, notify_on, vaccine_types, dose_number):
-    validate_inputs(date)
-    url = BASE_API + calendar_by_district
-    params = {
-        "district_id": district_id,
-        "date": date
-    }
 
-    try:
-        response_data = session_requests.get(url=url, params=params)
-        if len(response_data['centers']) > 0:
-            for center in response_data['centers']:
-                for session in center['sessions']:
-                    session['pincode'] = center['pincode']
-                    session['name'] = center['name']
-                    sessions = [session]
-                    create_message_from_session(sessions, age_filter, notify_on, vaccine_types, dose_number)
-        else:
-            print("There are no centers available for this district")
-    except requests.HTTPError as http_error:
-        print_error_message(http_error)
+def process_merged_response(merged, body):
+    """
+    Fans the sessions of a district response out to the pin code targets merged into it, every member
+    keeps the same snapshot scope as if it had been checked on its own
+    """
+    by_pincode = {}
+    for session in response_sessions(body, merged.next7days) or ():
+        by_pincode.setdefault(str(session.pincode), []).append(session)
+    changed = False
+    for member in merged.members:
+        url, params, _, _ = target_request(member)
+        if isinstance(member, FanoutTarget):
+            changed |= notify_groups(url, params, member.index, by_pincode.get(member.pin_code, []))
+            continue
+        scope = scope_for(url, params, member.session_filter)
+        changed |= notify_changes(scope, by_pincode.get(member.pin_code, []), member.session_filter,
+                                  member.notify_on, member.recipient)
+    return changed
+
+
+def process_fanout_response(fanout, body):
+    url, params, _, empty_message = target_request(fanout)
+    sessions = response_sessions(body, fanout.next7days)
+    if sessions is None:
+        # diffed all the same, sessions open before are notified again when they come back
+        print(empty_message)
+    return notify_groups(url, params, fanout.index, sessions or ())
+
+
+def process_window_response(window, body):
+    """
+    Fans the sessions of a 7 day calendar window out to the date range targets overlapping it, each member
+    filters them down to its own dates and is diffed separately for every window
+    """
+    url, params, _, empty_message = target_request(window)
+    sessions = response_sessions(body, True)
+    if sessions is None:
+        print(empty_message)
+    return notify_groups(url, params, window.index, sessions or ())
+
+
+def process_sessions_response(body, scope, empty_message, session_filter, notify_on, recipient=None):
+    sessions = response_sessions(body, False, session_filter)
+    if sessions is None:
+        print(empty_message)
+    return notify_changes(scope, sessions or (), session_filter, notify_on, recipient)
+
+
+def process_centers_response(body, scope, empty_message, session_filter, notify_on, recipient=None):
+    sessions = response_sessions(body, True, session_filter)
+    if sessions is None:
+        print(empty_message)
+    return notify_changes(scope, sessions or (), session_filter, notify_on, recipient)
+
+
+def response_sessions(body, calendar, session_filter=None):
+    """
+    Returns the sessions of a calendarBy* or findBy* response, or None when it has no centers/sessions.
+    The district of every center is learned on the way.
+    """
+    items = iter_response_items(body, 'centers' if calendar else 'sessions')
+    first = next(items, None)
+    if first is None:
+        return None
+    items = itertools.chain([first], items)
+    if history is not None:
+        # the history keeps the centers of every fee type
+        sessions = list(pincode_map.learn(sessions_from_centers(items) if calendar else sessions_from_find_by(items)))
+        history.record(sessions)
+        return sessions
+    sessions = sessions_from_centers(items, session_filter) if calendar else sessions_from_find_by(items)
+    return pincode_map.learn(sessions)
+
+
+def iter_response_items(body, name):
+    if stream_responses:
+        from slot_info.streaming import iter_items
+        return iter(iter_items(body, name + '.item'))
+    with parse_seconds.time():
+        data = json.loads(body)
+    return iter(data[name])
+
+
+def scope_for(url, params, session_filter):
+    """
+    Snapshot scope of a poll, the same location watched with different filters is diffed separately
+    """
+    return ConditionalCache.key(url, params) + "|" + repr(session_filter.key)
+
+
+def target_scopes(target):
+    """
+    Snapshot scopes a planned target diffs its sessions in
+    """
+    if isinstance(target, MergedTarget):
+        return [scope for member in target.members for scope in target_scopes(member)]
+    url, params, _, _ = target_request(target)
+    if isinstance(target, (FanoutTarget, WindowTarget)):
+        return [scope_for(url, params, session_filter) for session_filter in target.index.filters]
+    return [scope_for(url, params, target.session_filter)]
+
+
+def retire_targets(retired, planned):
+    """
+    Forgets the response digests of the retired targets, replaced by the planned ones, and the snapshots of
+    the scopes none of the planned targets diffs in
+    """
+    for target in retired:
+        response_digests.forget(target)
+    kept = set(scope for target in planned for scope in target_scopes(target))
+    for scope in set(scope for target in retired for scope in target_scopes(target)) - kept:
+        snapshots.forget(scope)
+
+
+def notify_groups(url, params, index, sessions):
+    """
+    Matches the sessions of one response against every group of a SubscriberIndex, each group is diffed in
+    the scope it would have on its own and notified to all its members
+    """
+    changed = False
+    for session_filter, members, matched in index.partition(sessions):
+        subscribers = list(dict.fromkeys((member.notify_on, member.recipient) for member in members))
+        changed |= notify_subscribers(scope_for(url, params, session_filter), matched, session_filter, subscribers)
+    return changed
 
 
-def is_slot_available(session, dose_number):
-    is_available = False
-    if session['available_capacity'] > 0:
-        if not dose_number or \
-                ("1" in dose_number and session['available_capacity_dose1'] > 0) or \
-                ("2" in dose_number and session['available_capacity_dose2'] > 0):
-            is_available = True
-    return is_available
-
-
-def create_message_from_session(sessions, age_filter, notify_on, vaccine_types, dose_number):
-    message = ""
-    for session in sessions:
-        if is_slot_available(session, dose_number) and \
-                (not age_filter or str(session['min_age_limit']) in age_filter) and \
-                (not vaccine_types or session['vaccine'].lower() in vaccine_types):
-            print("Name: " + str(session['name']) + ", PinCode: " + str(session['pincode']) + ", Available: " + str(
-                session['available_capacity']) + ", Date :" + str(session['date']))
-            if cache.get(str(session['pincode']) + session['name'] + str(session['date'])) is None:
-                cache.set(str(session['pincode']) + session['name'] + str(session['date']), 1)
-                message = message + "Name : " + str(session['name']) + "\n"
-                message = message + "Pincode: " + str(session['pincode']) + "\n"
-                message = message + "Vaccine Type: " + str(session['vaccine']) + "\n"
-                message = message + "Total Available Capacity: " + str(session['available_capacity']) + "\n"
-                if "1" in dose_number or session['available_capacity_dose1'] > 0:
-                    message = message + "Available Capacity Dose1: " + str(session['available_capacity_dose1']) + "\n"
-                if "2" in dose_number or session['available_capacity_dose2'] > 0:
-                    message = message + "Available Capacity Dose2: " + str(session['available_capacity_dose2']) + "\n"
-                message = message + "Min Age: " + str(session['min_age_limit']) + "\n"
-                message = message + "Date: " + str(session['date']) + "\n"
-                send_message(message, notify_on)
-                message = "\n\n"
+def notify_changes(scope, sessions, session_filter, notify_on, recipient=None):
+    return notify_subscribers(scope, session_filter.filter(sessions), session_filter, [(notify_on, recipient)])
+
+
+def notify_subscribers(scope, matched, session_filter, subscribers):
+    """
+    Diffs the matching sessions against the previous poll of the same scope, only newly opened sessions
+    are notified, to every (notify_on, recipient) of subscribers, and only the changes are logged.
+    """
+    delta = snapshots.diff(scope, matched)
+    if not delta:
+        return False
+    for session, previous_capacity in delta.closed:
+        print("Closed " + describe_session(session) + ", Was available: " + str(previous_capacity))
+    for session, previous_capacity in delta.increased + delta.decreased:
+        print("Changed " + describe_session(session) + ", Available: " + str(previous_capacity) + " -> " +
+              str(session.available_capacity))
+    opened = []
+    for session in delta.opened:
+        print("Name: " + str(session.name) + ", PinCode: " + str(session.pincode) + ", Available: " + str(
+            session.available_capacity) + ", Date :" + str(session.date))
+        opened.append((session_key(session), create_message_from_session(session, session_filter)))
+    for notify_on, recipient in subscribers:
+        notify_sessions(opened, notify_on, recipient)
+    return True
+
+
+def create_message_from_session(session, session_filter):
+    message = "Name : " + str(session.name) + "\n"
+    message = message + "Pincode: " + str(session.pincode) + "\n"
+    message = message + "Vaccine Type: " + str(session.vaccine) + "\n"
+    message = message + "Total Available Capacity: " + str(session.available_capacity) + "\n"
+    if session_filter.dose1 or session.available_capacity_dose1 > 0:
+        message = message + "Available Capacity Dose1: " + str(session.available_capacity_dose1) + "\n"
+    if session_filter.dose2 or session.available_capacity_dose2 > 0:
+        message = message + "Available Capacity Dose2: " + str(session.available_capacity_dose2) + "\n"
+    message = message + "Min Age: " + str(session.min_age_limit) + "\n"
+    message = message + "Date: " + str(session.date) + "\n"
     return message
 
 
-def send_message(message, notify_on):
-    if notify_on == "whatsapp":
-        send_whatsapp_message(message)
-    elif notify_on == "telegram":
-        send_telegram_message(message)
+def notify_sessions(opened, notify_on, recipient=None):
+    """
+    Sends the (session key, message) pairs of opened on notify_on, to recipient or else to the recipient
+    configured in the env variables. Every channel and recipient has its own dedup scope, so a session is
+    sent once to each of them.
+    """
+    parts = []
+    dedup_scope = notify_on + ":" + ("" if recipient is None else str(recipient)) + "|"
+    for key, message in opened:
+        if not dedup_store.add(dedup_scope + key):
+            duplicate_sessions.inc()
+        else:
+            notified_sessions.inc()
+            parts.append(message)
+    # all the new sessions of this poll are sent together, in as few messages as the channel allows
+    return dispatcher.dispatch(parts, notify_on, recipient)
+
+
+def send_message(message, notify_on, recipient=None):
+    try:
+        with send_seconds.labels(channel=notify_on).time():
+            # notifier backends are imported on first use, twilio is slow to import and only whatsapp needs it
+            if notify_on == "whatsapp":
+                from slot_info.whatsapp import send_whatsapp_message
+                failures = send_whatsapp_message(message, recipient)
+            elif notify_on == "telegram":
+                from slot_info.telegram import send_telegram_message
+                failures = send_telegram_message(message, recipient)
+            else:
+                failures = []
+    except Exception:
+        send_errors.labels(channel=notify_on).inc()
+        raise
+    for failed in failures:
+        # only the recipients that failed are spooled, the others already got the message
+        send_errors.labels(channel=notify_on).inc()
+        print("Failed to send notification on " + notify_on + " to " + failed.recipient + ": " + str(failed.error))
+    return failures
+
+
+# notifications are sent from a background thread so that polling is never blocked on them
+dispatcher = Dispatcher(send_message)
+
+
+def lookup_district_id(district):
+    """
+    Returns the district id for a district id or name, names are looked up in the local directory. Raises
+    LookupError for an unknown name or when the directory cannot be fetched.
+    """
+    district = str(district).strip()
+    if district.isdigit():
+        return district
+    try:
+        return str(directory.find_district(district)['district_id'])
+    except requests.RequestException as request_error:
+        raise LookupError("Could not fetch the districts to look up " + district + ": " + repr(request_error))
+
+
+def resolve_district_id(district):
+    try:
+        return lookup_district_id(district)
+    except LookupError as lookup_error:
+        raise click.BadParameter(str(lookup_error), param_hint="district")
 
 
-def validate_inputs(date):
+def district_for_pincode(pin_code):
+    """
+    Returns the district id of a pin code seen in an earlier response, or None when it is not known
+    """
+    district_name = pincode_map.district_name(pin_code)
+    if district_name is None:
+        return None
     try:
-        datetime.strptime(date, "%d-%m-%Y")
-    except ValueError:
-        raise ValueError("Date should be provided in DD-MM-YYYY format, for example: 10-05-2021")
+        return directory.find_district(district_name, exact=True)['district_id']
+    except (LookupError, requests.RequestException):
+        return None
 
 
 def print_error_message(http_error):
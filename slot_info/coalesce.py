@@ -0,0 +1,129 @@
+import threading
+import time
+
+from slot_info.metrics import metrics
+
+coalesced_calls = metrics.counter("coalesced_calls_total",
+                                  "Calls served from a recent result (hit) or a call already in flight (shared)")
+
+
+class SingleFlight:
+    """
+    Deduplicates identical calls. Callers asking for a key that is already being fetched wait for that
+    fetch and share its result, and results are memoized for ttl seconds, which should be shorter than
+    the poll interval so that every poll still sees fresh data. Expired results are dropped when they are
+    looked up and, for the keys that are not asked for again, at most every ttl seconds.
+    """
+
+    def __init__(self, ttl=2.0, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self._memo = {}
+        self._in_flight = {}
+        self._pruned_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            memo = self._cached(key)
+            if memo is not None:
+                self.hits += 1
+                coalesced_calls.labels(result="hit").inc()
+                return memo[1]
+            call = self._in_flight.get(key)
+            if call is None:
+                call = self._in_flight[key] = _Call()
+                self.misses += 1
+                owner = True
+            else:
+                self.shared += 1
+                coalesced_calls.labels(result="shared").inc()
+                owner = False
+        if not owner:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                if call.error is None and self.ttl > 0:
+                    self._remember(key, call.result)
+            call.done.set()
+        return call.result
+
+    def _cached(self, key):
+        memo = self._memo.get(key)
+        if memo is not None and memo[0] <= time.monotonic():
+            # a response body is not kept past its ttl
+            del self._memo[key]
+            return None
+        return memo
+
+    def _remember(self, key, result):
+        now = time.monotonic()
+        if len(self._memo) >= self.max_size or now - self._pruned_at >= self.ttl:
+            self._memo = {k: memo for k, memo in self._memo.items() if memo[0] > now}
+            self._pruned_at = now
+        self._memo[key] = (now + self.ttl, result)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "shared": self.shared}
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class AsyncSingleFlight(SingleFlight):
+    """
+    asyncio flavour of SingleFlight, fn is a coroutine function
+    """
+
+    async def do(self, key, fn):
+        # imported here, asyncio is only needed with --use_async and slows down the start of every command
+        import asyncio
+        memo = self._cached(key)
+        if memo is not None:
+            self.hits += 1
+            coalesced_calls.labels(result="hit").inc()
+            return memo[1]
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.shared += 1
+            coalesced_calls.labels(result="shared").inc()
+            return await asyncio.shield(future)
+        self.misses += 1
+        future = self._in_flight[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as error:
+            future.set_exception(error)
+            # retrieve it so that an exception nobody else waited for is not logged as never retrieved
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            if self.ttl > 0:
+                self._remember(key, result)
+            return result
+        finally:
+            del self._in_flight[key]
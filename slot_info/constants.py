@@ -1,3 +1,9 @@
+import os
+
 vaccine_types = ["covishield", "covaxin"]
 dose_numbers = ["1", "2"]
 age_filter = ["18", "45"]
+fee_types = ["free", "paid"]
+
+# directory where state that has to survive restarts is kept
+state_dir = os.getenv('SLOTINFO_HOME', os.path.join(os.path.expanduser("~"), ".slotinfo"))
@@ -1,4 +1,10 @@
-BASE_API = "https://cdn-api.co-vin.in/api/"
+import os
+
+# SLOTINFO_COWIN_API points the tool to a stand-in server, like the one of slotinfo replay-server
+BASE_API = os.getenv('SLOTINFO_COWIN_API', "https://cdn-api.co-vin.in/api/")
+
+# the public api allows 100 calls per 5 minutes per IP
+requests_per_5_minutes = 100
 
 # appointment api's
 
@@ -0,0 +1,281 @@
+import json
+import os
+import socket
+import socketserver
+import threading
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from slot_info.constants import state_dir
+from slot_info.metrics import metrics
+from slot_info.watch import WatchTarget, notify_channels, plan_targets
+
+
+class Subscriber:
+    """
+    Someone to notify: a channel and, optionally, the chat id or mobile number to send to instead of the one
+    configured in the env variables
+    """
+
+    def __init__(self, subscriber_id, notify_on, recipient=None, name=None):
+        if notify_on not in notify_channels:
+            raise ValueError("notify_on should be one of " + str(notify_channels))
+        self.id = subscriber_id
+        self.notify_on = notify_on
+        self.recipient = recipient
+        self.name = name
+
+    def to_dict(self):
+        return {"id": self.id, "notify_on": self.notify_on, "recipient": self.recipient, "name": self.name}
+
+    @classmethod
+    def from_dict(cls, data):
+        recipient = data.get('recipient')
+        return cls(str(data.get('id') or _new_id()), data.get('notify_on'),
+                   None if recipient is None else str(recipient), data.get('name'))
+
+
+def _new_id():
+    return uuid.uuid4().hex[:12]
+
+
+class Daemon:
+    """
+    Watches and subscribers of a long running process, added and removed at runtime. The watches of a location
+    are planned together into the requests they need and added to the shared watcher, so watches of the same
+    location fetch once and all of them use the same pool, schedule and dedup store. A watch of a subscriber
+    notifies that subscriber and is removed along with it. The registry is saved to path after every change
+    and loaded again on start. resolve_district turns district names into ids and raises ValueError or
+    LookupError for the ones it cannot resolve. retire is called with the planned targets of a location and
+    the ones replacing them, to forget the state kept for the targets that are no longer polled.
+    """
+
+    def __init__(self, watcher, resolve_district=None, path=None, retire=None):
+        self.watcher = watcher
+        self.resolve_district = resolve_district
+        self.retire = retire
+        self.path = os.path.join(state_dir, "daemon.json") if path is None else path
+        self.watches = {}
+        self.subscribers = {}
+        self._targets = {}
+        self._keys = {}
+        self._planned = {}
+        self._lock = threading.RLock()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path) as state_file:
+            state = json.load(state_file)
+        with self._lock:
+            for data in state.get('subscribers', []):
+                try:
+                    self.add_subscriber(data, save=False)
+                except ValueError as value_error:
+                    print("Skipping saved subscriber " + str(data.get('id')) + ": " + str(value_error))
+            for data in state.get('watches', []):
+                try:
+                    self.add_watch(data, save=False)
+                except ValueError as value_error:
+                    print("Skipping saved watch " + str(data.get('id')) + ": " + str(value_error))
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            state = {"subscribers": [subscriber.to_dict() for subscriber in self.subscribers.values()],
+                     "watches": list(self.watches.values())}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as state_file:
+            json.dump(state, state_file, indent=2)
+        os.replace(temporary_path, self.path)
+
+    def add_subscriber(self, data, save=True):
+        subscriber = Subscriber.from_dict(data)
+        with self._lock:
+            if subscriber.id in self.subscribers:
+                raise ValueError("Subscriber " + subscriber.id + " already exists")
+            self.subscribers[subscriber.id] = subscriber
+        if save:
+            self.save()
+        return subscriber.to_dict()
+
+    def remove_subscriber(self, subscriber_id):
+        with self._lock:
+            if self.subscribers.pop(subscriber_id, None) is None:
+                return False
+            for watch_id, watch in list(self.watches.items()):
+                if watch.get('subscriber') == subscriber_id:
+                    self._remove_watch(watch_id)
+        self.save()
+        return True
+
+    def add_watch(self, data, save=True):
+        """
+        Starts a watch from the same fields as a target of a targets file. With a subscriber id the watch
+        notifies that subscriber, otherwise it needs its own notify_on.
+        """
+        watch = dict(data)
+        watch['id'] = str(watch.get('id') or _new_id())
+        with self._lock:
+            if watch['id'] in self.watches:
+                raise ValueError("Watch " + watch['id'] + " already exists")
+            defaults = {}
+            subscriber_id = watch.get('subscriber')
+            if subscriber_id is not None:
+                subscriber = self.subscribers.get(str(subscriber_id))
+                if subscriber is None:
+                    raise ValueError("Unknown subscriber " + str(subscriber_id))
+                watch['subscriber'] = subscriber.id
+                defaults = {"notify_on": subscriber.notify_on, "recipient": subscriber.recipient}
+            fields = {name: value for name, value in watch.items() if name not in ('id', 'subscriber')}
+            try:
+                target = WatchTarget.from_dict(fields, defaults, self.resolve_district)
+            except LookupError as lookup_error:
+                raise ValueError(str(lookup_error.args[0] if lookup_error.args else lookup_error))
+            self._targets[watch['id']] = target
+            self.watches[watch['id']] = watch
+            self._plan(_location(target))
+        print("Watching " + target.name + " as " + watch['id'])
+        if save:
+            self.save()
+        return watch
+
+    def remove_watch(self, watch_id):
+        with self._lock:
+            removed = self._remove_watch(watch_id)
+        if removed:
+            self.save()
+        return removed
+
+    def _remove_watch(self, watch_id):
+        if self.watches.pop(watch_id, None) is None:
+            return False
+        self._plan(_location(self._targets.pop(watch_id)))
+        return True
+
+    def _plan(self, location):
+        # the requests of a location are planned again whenever one of its watches is added or removed
+        for key in self._keys.pop(location, []):
+            self.watcher.remove(key)
+        retired = self._planned.pop(location, [])
+        members = [target for target in self._targets.values() if _location(target) == location]
+        planned = plan_targets(members, lambda pin_code: None) if members else []
+        if planned:
+            self._planned[location] = planned
+            self._keys[location] = [self.watcher.add(target) for target in planned]
+        if retired and self.retire is not None:
+            self.retire(retired, planned)
+
+    def list_watches(self):
+        with self._lock:
+            return list(self.watches.values())
+
+    def list_subscribers(self):
+        with self._lock:
+            return [subscriber.to_dict() for subscriber in self.subscribers.values()]
+
+
+def _location(target):
+    # date range targets of a location share their 7 day windows whatever their dates
+    if target.to_date is not None:
+        return target.district_id, target.pin_code
+    return target.district_id, target.pin_code, target.date, target.next7days
+
+
+class UnixHTTPServer(ThreadingHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        # HTTPServer.server_bind expects a (host, port) address
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def serve(daemon, port=None, host="127.0.0.1", socket_path=None):
+    """
+    Serves the API of daemon from a daemon thread, on http://host:port or on the Unix socket at socket_path:
+
+        GET /watches, POST /watches, DELETE /watches/<id>
+        GET /subscribers, POST /subscribers, DELETE /subscribers/<id>
+        GET /metrics
+
+    Bodies are JSON, errors are answered with {"error": ...}, invalid requests with 400 and unexpected
+    failures with 500. Returns the server.
+    """
+    routes = {
+        "watches": ("watch", daemon.list_watches, daemon.add_watch, daemon.remove_watch),
+        "subscribers": ("subscriber", daemon.list_subscribers, daemon.add_subscriber, daemon.remove_subscriber)
+    }
+
+    class DaemonHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self._handle(self._get)
+
+        def do_POST(self):
+            self._handle(self._post)
+
+        def do_DELETE(self):
+            self._handle(self._delete)
+
+        def _handle(self, handler):
+            try:
+                handler(self._path())
+            except ValueError as value_error:
+                self._json(400, {"error": str(value_error)})
+            except Exception as error:
+                # the client always gets an answer, the handler thread would otherwise close the connection
+                self._json(500, {"error": repr(error)})
+
+        def _get(self, path):
+            if path == ["metrics"]:
+                self._send(200, metrics.render().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8")
+            elif len(path) == 1 and path[0] in routes:
+                self._json(200, routes[path[0]][1]())
+            else:
+                self._json(404, {"error": "Not found"})
+
+        def _post(self, path):
+            if len(path) != 1 or path[0] not in routes:
+                self._json(404, {"error": "Not found"})
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            data = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(data, dict):
+                raise ValueError("The body should be a JSON object")
+            self._json(201, routes[path[0]][2](data))
+
+        def _delete(self, path):
+            if len(path) != 2 or path[0] not in routes:
+                self._json(404, {"error": "Not found"})
+            elif routes[path[0]][3](path[1]):
+                self._json(200, {"deleted": path[1]})
+            else:
+                self._json(404, {"error": "Unknown " + routes[path[0]][0] + " " + path[1]})
+
+        def _path(self):
+            return [part for part in self.path.split("?")[0].split("/") if part]
+
+        def _json(self, status, data):
+            self._send(status, json.dumps(data).encode("utf-8"), "application/json")
+
+        def _send(self, status, body, content_type):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, DaemonHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), DaemonHandler)
+    threading.Thread(target=server.serve_forever, name="daemon-api", daemon=True).start()
+    return server
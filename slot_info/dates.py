@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+
+date_format = "%d-%m-%Y"
+# calendarBy* calls return the 7 days starting at the requested date
+window_days = 7
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(str(value), date_format).date()
+    except ValueError:
+        raise ValueError("Date should be provided in DD-MM-YYYY format, for example: 10-05-2021")
+
+
+def format_date(value):
+    return value.strftime(date_format)
+
+
+def date_range(from_date, to_date):
+    """
+    Returns every date from from_date to to_date, both included, in the DD-MM-YYYY format of CoWIN sessions
+    """
+    start, end = parse_date(from_date), parse_date(to_date)
+    if end < start:
+        raise ValueError("The to date should not be before the from date")
+    return [format_date(start + timedelta(days=day)) for day in range((end - start).days + 1)]
+
+
+def plan_windows(ranges):
+    """
+    Covers the (from_date, to_date) ranges with as few 7 day calendar windows as possible. Overlapping and
+    adjacent ranges are joined first, so ranges shared by several targets are fetched once. Returns the
+    start dates of the windows, each window covering the start date and the 6 days after it.
+    """
+    spans = sorted((parse_date(start), parse_date(end)) for start, end in ranges)
+    windows = []
+    joined_start, joined_end = None, None
+    for start, end in spans + [(None, None)]:
+        if joined_end is not None and start is not None and start <= joined_end + timedelta(days=1):
+            joined_end = max(joined_end, end)
+            continue
+        if joined_start is not None:
+            day = joined_start
+            while day <= joined_end:
+                windows.append(format_date(day))
+                day += timedelta(days=window_days)
+        joined_start, joined_end = start, end
+    return windows
+
+
+def window_dates(window_start):
+    return date_range(window_start, format_date(parse_date(window_start) + timedelta(days=window_days - 1)))
@@ -0,0 +1,117 @@
+import os
+import sqlite3
+import threading
+import time
+
+from slot_info.constants import state_dir
+
+
+class MemoryDedupStore:
+    """
+    In process dedup store, add() returns True only the first time a key is seen within ttl seconds
+    """
+
+    def __init__(self, ttl=3600, max_size=100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._expires_at = {}
+        self._lock = threading.Lock()
+
+    def add(self, key):
+        now = time.time()
+        with self._lock:
+            expires_at = self._expires_at.get(key)
+            if expires_at is not None and expires_at > now:
+                return False
+            # re-inserting keeps the dict ordered by expiry, so the oldest keys are evicted first
+            self._expires_at.pop(key, None)
+            self._expires_at[key] = now + self.ttl
+            while len(self._expires_at) > self.max_size:
+                del self._expires_at[next(iter(self._expires_at))]
+            return True
+
+    def __contains__(self, key):
+        with self._lock:
+            expires_at = self._expires_at.get(key)
+        return expires_at is not None and expires_at > time.time()
+
+    def clear(self):
+        with self._lock:
+            self._expires_at.clear()
+
+
+class SqliteDedupStore:
+    """
+    Dedup store kept in a SQLite database, so it survives restarts and can be shared by several watcher
+    processes on the same host. The check and the insert are a single statement, so two processes never
+    both see a key as new. Expired keys are evicted, and the oldest ones once there are more than max_size.
+    """
+    evict_every = 500
+
+    def __init__(self, path=None, ttl=3600, max_size=100000):
+        self.path = os.path.join(state_dir, "dedup.sqlite3") if path is None else path
+        self.ttl = ttl
+        self.max_size = max_size
+        self._connection = None
+        self._lock = threading.Lock()
+        self._adds = 0
+
+    @property
+    def connection(self):
+        # opened lazily, commands that never notify do not need the state directory
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS seen (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS seen_expires_at ON seen (expires_at)")
+            self._connection = connection
+        return self._connection
+
+    def add(self, key):
+        now = time.time()
+        with self._lock:
+            cursor = self.connection.execute(
+                "INSERT INTO seen (key, expires_at) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET expires_at = excluded.expires_at WHERE seen.expires_at <= ?",
+                (key, now + self.ttl, now))
+            added = cursor.rowcount == 1
+            self._adds += 1
+            if self._adds % self.evict_every == 0:
+                self._evict(now)
+        return added
+
+    def __contains__(self, key):
+        with self._lock:
+            row = self.connection.execute("SELECT 1 FROM seen WHERE key = ? AND expires_at > ?",
+                                          (key, time.time())).fetchone()
+        return row is not None
+
+    def clear(self):
+        with self._lock:
+            self.connection.execute("DELETE FROM seen")
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _evict(self, now):
+        self.connection.execute("DELETE FROM seen WHERE expires_at <= ?", (now,))
+        self.connection.execute("DELETE FROM seen WHERE key IN (SELECT key FROM seen ORDER BY expires_at DESC "
+                                "LIMIT -1 OFFSET ?)", (self.max_size,))
+
+
+def create_dedup_store(backend=None, ttl=3600):
+    """
+    Returns the dedup store for backend, "memory" or "sqlite" optionally followed by ":<path>",
+    it defaults to the SLOTINFO_DEDUP env variable and then to sqlite in the state directory
+    """
+    backend = backend or os.getenv('SLOTINFO_DEDUP', "sqlite")
+    name, _, path = backend.partition(":")
+    if name == "memory":
+        return MemoryDedupStore(ttl=ttl)
+    if name == "sqlite":
+        return SqliteDedupStore(path or None, ttl=ttl)
+    raise ValueError("Unknown dedup backend '" + backend + "', use memory or sqlite[:<path>]")
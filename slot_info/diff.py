@@ -0,0 +1,66 @@
+import threading
+
+
+def session_key(session):
+    if session.session_id is not None:
+        return session.session_id
+    return str(session.pincode) + session.name + str(session.date)
+
+
+def describe_session(session):
+    return "Name: " + str(session.name) + ", PinCode: " + str(session.pincode) + ", Date :" + str(session.date)
+
+
+class SessionDelta:
+    """
+    Changes between two polls of the same scope. opened holds the matching sessions that were not
+    available in the previous poll, increased, decreased and closed hold (session, previous capacity), for
+    closed sessions the session is the one seen in the previous poll.
+    """
+
+    def __init__(self):
+        self.opened = []
+        self.closed = []
+        self.increased = []
+        self.decreased = []
+
+    def __bool__(self):
+        return bool(self.opened or self.closed or self.increased or self.decreased)
+
+    def __len__(self):
+        return len(self.opened) + len(self.closed) + len(self.increased) + len(self.decreased)
+
+
+class SnapshotStore:
+    """
+    Keeps the matching sessions of the last poll of every scope, a scope being one poll target (endpoint,
+    location, date and filters), and diffs every new poll against it.
+    """
+
+    def __init__(self):
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def diff(self, scope, sessions):
+        current = {session_key(session): session for session in sessions}
+        with self._lock:
+            previous = self._snapshots.get(scope, {})
+            self._snapshots[scope] = current
+
+        delta = SessionDelta()
+        for key, session in current.items():
+            seen = previous.get(key)
+            if seen is None:
+                delta.opened.append(session)
+            elif session.available_capacity > seen.available_capacity:
+                delta.increased.append((session, seen.available_capacity))
+            elif session.available_capacity < seen.available_capacity:
+                delta.decreased.append((session, seen.available_capacity))
+        for key, session in previous.items():
+            if key not in current:
+                delta.closed.append((session, session.available_capacity))
+        return delta
+
+    def forget(self, scope):
+        with self._lock:
+            self._snapshots.pop(scope, None)
@@ -0,0 +1,141 @@
+import contextlib
+import difflib
+import json
+import os
+import re
+import threading
+import time
+
+import requests
+
+from slot_info.constants import state_dir
+from slot_info.cowin_api import BASE_API, get_all_states, get_all_districts
+
+
+def normalize(name):
+    return re.sub(r"\s+", " ", str(name)).strip().casefold()
+
+
+class Directory:
+    """
+    All states and districts fetched once and cached on disk for ttl seconds, names are looked up in memory
+    case insensitively, then by prefix and then by closest match. A stale cache is used when CoWIN cannot
+    be reached, so lookups keep working offline. A refresh, one call for the states and one for the districts of
+    every state, is sent as a burst of up to refresh_burst requests instead of being spread over the rate limit.
+    """
+
+    def __init__(self, session_requests, path=None, ttl=7 * 24 * 3600, refresh_burst=40):
+        self.session_requests = session_requests
+        self.path = os.path.join(state_dir, "directory.json") if path is None else path
+        self.ttl = ttl
+        self.refresh_burst = refresh_burst
+        self._data = None
+        self._states = None
+        self._districts = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """
+        Fetches all the states and districts again and saves them
+        """
+        print("Fetching all the states and districts, this is done once in " + str(round(self.ttl / 86400)) + " days")
+        rate_limiter = self.session_requests.rate_limiter
+        with rate_limiter.bursting(self.refresh_burst) if rate_limiter is not None else contextlib.nullcontext():
+            states = self.session_requests.get(BASE_API + get_all_states)['states']
+            data = {'fetched_at': time.time(), 'states': []}
+            for state in states:
+                districts = self.session_requests.get(BASE_API + get_all_districts.format(state['state_id']))[
+                    'districts']
+                data['states'].append({'state_id': state['state_id'],
+                                       'state_name': state['state_name'],
+                                       'districts': [{'district_id': district['district_id'],
+                                                      'district_name': district['district_name']}
+                                                     for district in districts]})
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as directory_file:
+            json.dump(data, directory_file)
+        os.replace(temporary_path, self.path)
+        self._index(data)
+
+    def find_state(self, state_name):
+        """
+        Returns the state matching state_name as a dict with state_id and state_name
+        """
+        self._load()
+        return self._find(self._states, state_name, "state")[0]
+
+    def find_district(self, district_name, state_id=None, exact=False):
+        """
+        Returns the district matching district_name as a dict with district_id, district_name, state_id
+        and state_name, state_id narrows the lookup when the same name is used in several states and
+        exact only accepts names that are the same ignoring case
+        """
+        self._load()
+        districts = self._districts
+        if state_id is not None:
+            districts = {name: [d for d in matches if str(d['state_id']) == str(state_id)]
+                         for name, matches in districts.items()}
+            districts = {name: matches for name, matches in districts.items() if matches}
+        matches = self._find(districts, district_name, "district", exact)
+        if len(matches) > 1:
+            raise LookupError("District " + str(district_name) + " is in several states, provide one of the state "
+                              "ids: " + ", ".join(str(d['state_id']) + " (" + d['state_name'] + ")" for d in matches))
+        return matches[0]
+
+    def _find(self, index, name, kind, exact=False):
+        key = normalize(name)
+        if key in index:
+            return index[key]
+        if exact:
+            raise LookupError("Provide proper name of the " + kind)
+        prefixed = [indexed for indexed in index if indexed.startswith(key)]
+        if len(prefixed) == 1:
+            return index[prefixed[0]]
+        candidates = prefixed or difflib.get_close_matches(key, list(index), n=5, cutoff=0.75)
+        if len(candidates) == 1:
+            return index[candidates[0]]
+        message = "Provide proper name of the " + kind
+        if candidates:
+            names = sorted(set(entry[kind + '_name'] for candidate in candidates for entry in index[candidate]))
+            message = message + ", did you mean: " + ", ".join(names)
+        raise LookupError(message)
+
+    def _load(self):
+        with self._lock:
+            if self._data is not None and not self._expired(self._data):
+                return
+            data = self._read()
+            if data is None or self._expired(data):
+                try:
+                    self.refresh()
+                    return
+                except requests.RequestException as error:
+                    if data is None:
+                        raise
+                    print("Could not refresh the state/district directory, using the cached one: " + repr(error))
+            self._index(data)
+
+    def _expired(self, data):
+        return time.time() - data.get('fetched_at', 0) > self.ttl
+
+    def _read(self):
+        try:
+            with open(self.path) as directory_file:
+                return json.load(directory_file)
+        except (OSError, ValueError):
+            return None
+
+    def _index(self, data):
+        states = {}
+        districts = {}
+        for state in data['states']:
+            states.setdefault(normalize(state['state_name']), []).append(
+                {'state_id': state['state_id'], 'state_name': state['state_name']})
+            for district in state['districts']:
+                districts.setdefault(normalize(district['district_name']), []).append(
+                    {'district_id': district['district_id'], 'district_name': district['district_name'],
+                     'state_id': state['state_id'], 'state_name': state['state_name']})
+        self._data = data
+        self._states = states
+        self._districts = districts
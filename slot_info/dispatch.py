@@ -0,0 +1,213 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+
+from slot_info.constants import state_dir
+
+# maximum length of a single message body accepted by each channel
+message_size_limits = {
+    "telegram": 4096,
+    "whatsapp": 1600
+}
+
+separator = "\n\n"
+
+# characters with a meaning in Telegram's Markdown, sent escaped with a backslash
+markdown_characters = "_*`["
+
+
+def escaped_length(text):
+    return len(text) + sum(text.count(character) for character in markdown_characters)
+
+
+# length of a message body as the channel counts it, after the notifier has escaped it
+message_lengths = {
+    "telegram": escaped_length
+}
+
+
+def chunk_messages(parts, limit, separator=separator, length=len):
+    """
+    Packs the parts, in order, into as few messages as possible without going over limit characters as
+    counted by length, a part that is longer than the limit on its own is split.
+    """
+    messages = []
+    current = ""
+    for part in parts:
+        while length(part) > limit:
+            if current:
+                messages.append(current)
+                current = ""
+            cut = limit
+            while length(part[:cut]) > limit:
+                # escaping at most doubles a character, so cutting half the excess never cuts too much
+                cut -= (length(part[:cut]) - limit + 1) // 2
+            messages.append(part[:cut])
+            part = part[cut:]
+        if not part:
+            continue
+        if not current:
+            current = part
+        elif length(current) + length(separator) + length(part) <= limit:
+            current = current + separator + part
+        else:
+            messages.append(current)
+            current = part
+    if current:
+        messages.append(current)
+    return messages
+
+
+class SendResult:
+    """
+    Outcome of sending a message to one recipient: the HTTP status, or the message status reported by the
+    provider, and the seconds it took including retries
+    """
+    __slots__ = ('recipient', 'ok', 'status', 'latency', 'error')
+
+    def __init__(self, recipient, ok, status=None, latency=0.0, error=None):
+        self.recipient = recipient
+        self.ok = ok
+        self.status = status
+        self.latency = latency
+        self.error = error
+
+    def __repr__(self):
+        return "SendResult(" + repr(self.recipient) + ", ok=" + str(self.ok) + ", status=" + str(self.status) + \
+            ", latency=" + str(round(self.latency, 3)) + (", error=" + repr(self.error) if self.error else "") + ")"
+
+
+class Dispatcher:
+    """
+    Sends notifications from a pool of background workers so that polling never waits for the messaging
+    provider. All the parts of a cycle are packed into the fewest messages the channel allows. Every message is
+    handed to send once, the notifiers retry on their own, and the recipients it could not be sent to are
+    appended to a dead letter spool file so they can be replayed later. send raises when nothing was sent, or
+    returns the SendResult of the recipients that failed.
+    """
+
+    def __init__(self, send, workers=2, close_timeout=10.0, spool_path=None):
+        self.send = send
+        self.workers = workers
+        self.close_timeout = close_timeout
+        self.spool_path = os.path.join(state_dir, "dead_letter.jsonl") if spool_path is None else spool_path
+        self._queue = queue.Queue()
+        self._threads = []
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def dispatch(self, parts, notify_on, recipient=None):
+        """
+        Queues the parts for recipient, None being the recipient configured in the env variables
+        """
+        messages = chunk_messages(parts, message_size_limits.get(notify_on, 4096),
+                                  length=message_lengths.get(notify_on, len))
+        for message in messages:
+            self.enqueue(message, notify_on, recipient)
+        return messages
+
+    def enqueue(self, message, notify_on, recipient=None):
+        self._start()
+        self._queue.put((message, notify_on, recipient))
+
+    def close(self, timeout=None):
+        """
+        Waits up to timeout seconds, close_timeout by default, for the queued messages to be sent. The messages
+        still queued or being sent after that are appended to the dead letter spool, returns how many were.
+        """
+        if not self._threads:
+            return 0
+        deadline = time.monotonic() + (self.close_timeout if timeout is None else timeout)
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._queue.all_tasks_done.wait(remaining)
+        with self._lock:
+            # a message being sent when the process exits may also reach its recipient
+            left = list(self._in_flight.values())
+            self._in_flight.clear()
+        while True:
+            try:
+                left.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            self._queue.task_done()
+        for message, notify_on, recipient in left:
+            self._spool(message, notify_on, recipient)
+        if left:
+            print("Saved " + str(len(left)) + " unsent notifications to " + self.spool_path)
+        return len(left)
+
+    def replay(self):
+        """
+        Queues every message of the dead letter spool again, returns how many messages were queued
+        """
+        with self._lock:
+            if not os.path.exists(self.spool_path):
+                return 0
+            replay_path = self.spool_path + ".replay"
+            os.replace(self.spool_path, replay_path)
+        count = 0
+        with open(replay_path) as spool:
+            for line in spool:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.enqueue(entry['message'], entry['notify_on'], entry.get('recipient'))
+                    count += 1
+        os.remove(replay_path)
+        return count
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name="dispatch-" + str(len(self._threads)), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        key = threading.get_ident()
+        while True:
+            item = self._queue.get()
+            with self._lock:
+                self._in_flight[key] = item
+            try:
+                failed = self._send(*item)
+                with self._lock:
+                    # once close gave up waiting the message is already in the spool
+                    owned = self._in_flight.pop(key, None) is not None
+                if owned:
+                    for recipient in failed:
+                        self._spool(item[0], item[1], recipient)
+            finally:
+                with self._lock:
+                    self._in_flight.pop(key, None)
+                self._queue.task_done()
+
+    def _send(self, message, notify_on, recipient):
+        """
+        Sends message once and returns the recipients it could not be sent to
+        """
+        try:
+            failures = self.send(message, notify_on, recipient)
+        except ValueError as error:
+            # missing configuration
+            print("Failed to send notification on " + str(notify_on) + ": " + str(error))
+            return [recipient]
+        except Exception as error:
+            print("Failed to send notification on " + str(notify_on) + ": " + repr(error))
+            return [recipient]
+        return [failed.recipient for failed in failures or ()]
+
+    def _spool(self, message, notify_on, recipient):
+        entry = json.dumps({"message": message, "notify_on": notify_on, "recipient": recipient,
+                            "failed_at": time.time()})
+        with self._lock:
+            os.makedirs(os.path.dirname(self.spool_path) or ".", exist_ok=True)
+            with open(self.spool_path, "a") as spool:
+                spool.write(entry + "\n")
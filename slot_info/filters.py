@@ -0,0 +1,165 @@
+from datetime import datetime
+from functools import lru_cache
+
+
+def _minutes(value, time_format):
+    parsed = datetime.strptime(value.strip().upper(), time_format)
+    return parsed.hour * 60 + parsed.minute
+
+
+def parse_time_window(window):
+    """
+    Parses a "HH:MM-HH:MM" (24 hour clock) window into minutes since midnight
+    """
+    try:
+        start, end = window.split("-")
+        start, end = _minutes(start, "%H:%M"), _minutes(end, "%H:%M")
+    except ValueError:
+        raise ValueError("Slot time should be provided in HH:MM-HH:MM format, for example: 09:00-13:00")
+    if start >= end:
+        raise ValueError("Slot time window should end after it starts")
+    return start, end
+
+
+@lru_cache(maxsize=1024)
+def _slot_window(slot):
+    # CoWIN slots look like "09:00AM-11:00AM", there are only a handful of distinct ones
+    start, end = slot.split("-")
+    return _minutes(start, "%I:%M%p"), _minutes(end, "%I:%M%p")
+
+
+class SessionFilter:
+    """
+    Filters compiled once into frozensets and int thresholds, so that matching a session is a handful of
+    dict lookups. An empty filter matches everything, min_capacity applies to the total capacity and to
+    the capacity of the requested doses and dates, when given, are the DD-MM-YYYY session dates to keep.
+    """
+    __slots__ = ('age_filter', 'vaccine_types', 'dose_number', 'fee_types', 'slot_time', 'min_capacity',
+                 'ages', 'vaccines', 'dose1', 'dose2', 'fees', 'window', 'dates', 'key')
+
+    def __init__(self, age_filter=(), vaccine_types=(), dose_number=(), fee_types=(), slot_time=None,
+                 min_capacity=1, dates=()):
+        self.age_filter = tuple(sorted(str(age) for age in age_filter))
+        self.vaccine_types = tuple(sorted(vaccine.lower() for vaccine in vaccine_types))
+        self.dose_number = tuple(sorted(str(dose) for dose in dose_number))
+        self.fee_types = tuple(sorted(fee.lower() for fee in fee_types))
+        self.slot_time = slot_time
+        self.min_capacity = max(1, int(min_capacity))
+
+        self.ages = frozenset(int(age) for age in self.age_filter)
+        self.vaccines = frozenset(vaccine.upper() for vaccine in self.vaccine_types)
+        self.dose1 = "1" in self.dose_number
+        self.dose2 = "2" in self.dose_number
+        self.fees = frozenset(fee.upper() for fee in self.fee_types)
+        self.window = parse_time_window(slot_time) if slot_time else None
+        self.dates = frozenset(dates)
+        self.key = (self.age_filter, self.vaccine_types, self.dose_number, self.fee_types, self.slot_time,
+                    self.min_capacity, tuple(sorted(self.dates)))
+
+    def __eq__(self, other):
+        return isinstance(other, SessionFilter) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return "SessionFilter" + repr(self.key)
+
+    def __call__(self, session):
+        min_capacity = self.min_capacity
+        if session.available_capacity < min_capacity:
+            return False
+        if (self.dose1 or self.dose2) and \
+                not ((self.dose1 and session.available_capacity_dose1 >= min_capacity) or
+                     (self.dose2 and session.available_capacity_dose2 >= min_capacity)):
+            return False
+        if self.dates and session.date not in self.dates:
+            return False
+        if self.ages and session.min_age_limit not in self.ages:
+            return False
+        if self.vaccines:
+            vaccine = session.vaccine
+            if vaccine not in self.vaccines and vaccine.upper() not in self.vaccines:
+                return False
+        if self.fees and str(session.center.fee_type).upper() not in self.fees:
+            return False
+        if self.window is not None and not self._in_window(session.slots):
+            return False
+        return True
+
+    def filter(self, sessions):
+        return filter(self, sessions)
+
+    def _in_window(self, slots):
+        start, end = self.window
+        for slot in slots:
+            try:
+                slot_start, slot_end = _slot_window(slot)
+            except ValueError:
+                continue
+            if slot_start < end and slot_end > start:
+                return True
+        return False
+
+
+class SubscriberIndex:
+    """
+    Subscribers (anything with a session_filter) grouped by identical filters, the groups being indexed by
+    age, vaccine and dose. The groups a session can match are found with a few dict lookups and set
+    intersections, and only those are checked with their whole filter.
+    """
+
+    def __init__(self, subscribers):
+        groups = {}
+        for subscriber in subscribers:
+            groups.setdefault(subscriber.session_filter, []).append(subscriber)
+        self.filters = list(groups)
+        self.groups = [groups[session_filter] for session_filter in self.filters]
+        everyone = frozenset(range(len(self.filters)))
+        self._ages = self._index(lambda session_filter: session_filter.ages, everyone)
+        self._vaccines = self._index(lambda session_filter: session_filter.vaccines, everyone)
+        self._any_age = frozenset(i for i in everyone if not self.filters[i].ages)
+        self._any_vaccine = frozenset(i for i in everyone if not self.filters[i].vaccines)
+        any_dose = frozenset(i for i in everyone if not (self.filters[i].dose1 or self.filters[i].dose2))
+        dose1 = frozenset(i for i in everyone if self.filters[i].dose1)
+        dose2 = frozenset(i for i in everyone if self.filters[i].dose2)
+        # keyed by whether the session has dose 1 and dose 2 capacity
+        self._doses = {(False, False): any_dose, (True, False): any_dose | dose1, (False, True): any_dose | dose2,
+                       (True, True): any_dose | dose1 | dose2}
+
+    def _index(self, values_of, everyone):
+        index = {}
+        for i in everyone:
+            for value in values_of(self.filters[i]):
+                index.setdefault(value, set()).add(i)
+        unconstrained = frozenset(i for i in everyone if not values_of(self.filters[i]))
+        return {value: frozenset(groups) | unconstrained for value, groups in index.items()}
+
+    def __len__(self):
+        return len(self.filters)
+
+    def match(self, session):
+        """
+        Indexes of the groups whose filter session matches
+        """
+        candidates = self._ages.get(session.min_age_limit, self._any_age)
+        if candidates:
+            vaccine = session.vaccine
+            vaccines = self._vaccines.get(vaccine)
+            if vaccines is None:
+                vaccines = self._vaccines.get(vaccine.upper(), self._any_vaccine)
+            candidates = candidates & vaccines & \
+                self._doses[(session.available_capacity_dose1 > 0, session.available_capacity_dose2 > 0)]
+        filters = self.filters
+        return [i for i in candidates if filters[i](session)]
+
+    def partition(self, sessions):
+        """
+        Splits sessions by the groups they match, returns (filter, subscribers, sessions) for every group,
+        including the groups without any matching session
+        """
+        matched = [[] for _ in self.filters]
+        for session in sessions:
+            for i in self.match(session):
+                matched[i].append(session)
+        return list(zip(self.filters, self.groups, matched))
@@ -0,0 +1,256 @@
+import array
+import atexit
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+
+# name and array typecode of every column, capacities above 65535 are stored as 65535
+columns = (
+    ("observed_at", "I"),   # unix time in seconds
+    ("center", "I"),        # code in the centers dictionary of the segment
+    ("vaccine", "B"),       # code in the vaccines dictionary of the segment
+    ("date", "I"),          # session date as YYYYMMDD
+    ("min_age", "B"),
+    ("capacity", "H"),
+    ("dose1", "H"),
+    ("dose2", "H"),
+    ("previous", "i")       # capacity at the previous observation, -1 the first time a session is seen
+)
+partition_format = "%Y-%m-%d"
+max_capacity = 65535
+
+
+def _session_date(value):
+    day, month, year = str(value).split("-")
+    return int(year) * 10000 + int(month) * 100 + int(day)
+
+
+class HistoryRecorder:
+    """
+    Appends an observation every time the capacity of a session changes, or the first time it is seen, to
+    time partitioned columnar files. Every local day is a partition directory and every recorder writes its own
+    segment in it, so several processes can record to the same directory:
+
+        <directory>/2021-05-10/<host>-<pid>-<start>/observed_at.bin, center.bin, ..., centers.jsonl, vaccines.jsonl
+
+    Columns are raw arrays of fixed size numbers, centers and vaccines are dictionary encoded, their values
+    being appended to the jsonl files of the segment before any row using them. Rows are buffered and written
+    every flush_rows rows or flush_interval seconds.
+    """
+
+    def __init__(self, directory, flush_rows=10000, flush_interval=60.0, clock=time.time):
+        self.directory = directory
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.rows = 0
+        self._writer = socket.gethostname() + "-" + str(os.getpid()) + "-" + str(int(clock()))
+        self._last = {}
+        self._lock = threading.Lock()
+        self._start_segment(None)
+        atexit.register(self.flush)
+
+    def _start_segment(self, partition):
+        self._partition = partition
+        self._buffers = {name: array.array(typecode) for name, typecode in columns}
+        self._centers = {}
+        self._vaccines = {}
+        self._new_centers = []
+        self._new_vaccines = []
+        self._flushed_at = self.clock()
+
+    def record(self, sessions):
+        now = self.clock()
+        observed_at = int(now)
+        partition = time.strftime(partition_format, time.localtime(now))
+        with self._lock:
+            if partition != self._partition:
+                self._flush_locked()
+                if self._partition is not None:
+                    self._forget_past(int(partition.replace("-", "")))
+                self._start_segment(partition)
+            buffers = self._buffers
+            for session in sessions:
+                capacity = session.available_capacity
+                key = (session.session_id, session.center.center_id, session.date)
+                previous = self._last.get(key)
+                if previous is not None and previous[0] == capacity:
+                    continue
+                session_date = _session_date(session.date)
+                self._last[key] = (capacity, session_date)
+                buffers["observed_at"].append(observed_at)
+                buffers["center"].append(self._code(self._centers, self._new_centers, session.center))
+                buffers["vaccine"].append(self._code(self._vaccines, self._new_vaccines, session.vaccine))
+                buffers["date"].append(session_date)
+                buffers["min_age"].append(min(session.min_age_limit, 255))
+                buffers["capacity"].append(min(capacity, max_capacity))
+                buffers["dose1"].append(min(session.available_capacity_dose1, max_capacity))
+                buffers["dose2"].append(min(session.available_capacity_dose2, max_capacity))
+                buffers["previous"].append(-1 if previous is None else min(previous[0], max_capacity))
+            rows = len(buffers["observed_at"])
+            if rows >= self.flush_rows or (rows and now - self._flushed_at >= self.flush_interval):
+                self._flush_locked()
+
+    @staticmethod
+    def _code(codes, new_values, value):
+        key = (value.center_id, value.name, value.pincode) if not isinstance(value, str) else value
+        code = codes.get(key)
+        if code is None:
+            code = codes[key] = len(codes)
+            new_values.append(key if isinstance(value, str) else
+                              {"center_id": value.center_id, "name": value.name, "pincode": value.pincode,
+                               "district_name": value.district_name})
+        return code
+
+    def _forget_past(self, today):
+        # sessions of past days never change again
+        self._last = {key: value for key, value in self._last.items() if value[1] >= today}
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        self._flushed_at = self.clock()
+        rows = len(self._buffers["observed_at"])
+        if not rows and not self._new_centers and not self._new_vaccines:
+            return
+        segment = os.path.join(self.directory, self._partition, self._writer)
+        os.makedirs(segment, exist_ok=True)
+        # dictionaries first, so that a row never refers to a value that was not written
+        for name, new_values in (("centers", self._new_centers), ("vaccines", self._new_vaccines)):
+            if new_values:
+                with open(os.path.join(segment, name + ".jsonl"), "a") as dictionary:
+                    dictionary.write("".join(json.dumps(value) + "\n" for value in new_values))
+                del new_values[:]
+        for name, buffer in self._buffers.items():
+            with open(os.path.join(segment, name + ".bin"), "ab") as column:
+                buffer.tofile(column)
+            del buffer[:]
+        self.rows += rows
+
+
+def _partitions(directory, from_date=None, to_date=None):
+    if not os.path.isdir(directory):
+        return []
+    partitions = []
+    for name in sorted(os.listdir(directory)):
+        try:
+            day = datetime.strptime(name, partition_format).date()
+        except ValueError:
+            continue
+        if (from_date is None or day >= from_date) and (to_date is None or day <= to_date):
+            partitions.append(os.path.join(directory, name))
+    return partitions
+
+
+def _read_dictionary(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as dictionary:
+        return [json.loads(line) for line in dictionary if line.strip()]
+
+
+def load_history(directory, from_date=None, to_date=None):
+    """
+    Reads the partitions of the days from from_date to to_date, both included, into one NumPy array per column.
+    The codes of every segment are mapped to dictionaries shared by the whole result, returns the columns, the
+    centers and the vaccines.
+    """
+    import numpy as np
+
+    centers, vaccines = [], []
+    center_codes, vaccine_codes = {}, {}
+    parts = {name: [] for name, _ in columns}
+    for partition in _partitions(directory, from_date, to_date):
+        for writer in sorted(os.listdir(partition)):
+            segment = os.path.join(partition, writer)
+            paths = {name: os.path.join(segment, name + ".bin") for name, _ in columns}
+            if not all(os.path.exists(path) for path in paths.values()):
+                continue
+            # a segment cut short while writing is read up to its last complete row
+            rows = min(os.path.getsize(paths[name]) // np.dtype(typecode).itemsize for name, typecode in columns)
+            if rows == 0:
+                continue
+            center_map = np.array([_global_code(centers, center_codes, value, (value['center_id'], value['name'],
+                                                                                value['pincode']))
+                                   for value in _read_dictionary(os.path.join(segment, "centers.jsonl"))],
+                                  dtype=np.uint32)
+            vaccine_map = np.array([_global_code(vaccines, vaccine_codes, value, value)
+                                    for value in _read_dictionary(os.path.join(segment, "vaccines.jsonl"))],
+                                   dtype=np.uint8)
+            for name, typecode in columns:
+                values = np.fromfile(paths[name], dtype=np.dtype(typecode), count=rows)
+                if name == "center":
+                    values = center_map[values]
+                elif name == "vaccine":
+                    values = vaccine_map[values]
+                parts[name].append(values)
+    data = {name: np.concatenate(values) if values else np.zeros(0, dtype=np.dtype(typecode))
+            for (name, typecode), values in zip(columns, parts.values())}
+    return data, centers, vaccines
+
+
+def _global_code(values, codes, value, key):
+    code = codes.get(key)
+    if code is None:
+        code = codes[key] = len(values)
+        values.append(value)
+    return code
+
+
+weekdays = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+def summarise(data, centers, vaccines, top=10, utc_offset=None):
+    """
+    Counts the openings, observations where a session goes from no capacity to some, per center, local weekday
+    and local hour with vectorised NumPy scans. The first observation of a session is not an opening, it cannot
+    be told apart from a session that was already open when the recorder started, those are only counted as
+    first_seen. interval_factors are, for every hour, the average number of openings per hour divided by the
+    openings of that hour and kept between 0.5 and 2, an adaptive watch multiplies its intervals by them to poll
+    faster when slots usually open.
+    """
+    import numpy as np
+
+    utc_offset = time.localtime().tm_gmtoff if utc_offset is None else utc_offset
+    opened = (data["capacity"] > 0) & (data["previous"] == 0)
+    local = data["observed_at"][opened].astype(np.int64) + utc_offset
+    hours = (local // 3600) % 24
+    # 1970-01-01 was a Thursday
+    days = (local // 86400 + 3) % 7
+    by_hour = np.bincount(hours, minlength=24)
+    by_weekday = np.bincount(days, minlength=7)
+    by_weekday_hour = np.bincount(days * 24 + hours, minlength=7 * 24).reshape(7, 24)
+    by_center = np.bincount(data["center"][opened], minlength=len(centers))
+    doses_by_center = np.bincount(data["center"][opened], weights=data["capacity"][opened], minlength=len(centers))
+    by_vaccine = np.bincount(data["vaccine"][opened], minlength=len(vaccines))
+    top_centers = np.argsort(-by_center, kind="stable")[:top]
+    mean = by_hour.sum() / 24.0
+    factors = np.clip(mean / np.maximum(by_hour, 1e-9), 0.5, 2.0) if mean else np.ones(24)
+    return {
+        "observations": int(len(data["capacity"])),
+        "openings": int(opened.sum()),
+        "first_seen": int((data["previous"] < 0).sum()),
+        "by_hour": by_hour.tolist(),
+        "by_weekday": dict(zip(weekdays, by_weekday.tolist())),
+        "by_weekday_hour": {weekday: row for weekday, row in zip(weekdays, by_weekday_hour.tolist())},
+        "by_vaccine": dict(zip(vaccines, by_vaccine.tolist())),
+        "centers": [dict(centers[index], openings=int(by_center[index]), doses=int(doses_by_center[index]))
+                    for index in top_centers if by_center[index]],
+        "interval_factors": [round(float(factor), 3) for factor in factors]
+    }
+
+
+def load_interval_factors(path):
+    """
+    Reads the interval_factors of a summary exported by the history command
+    """
+    with open(path) as profile:
+        factors = json.load(profile).get('interval_factors')
+    if not isinstance(factors, list) or len(factors) != 24:
+        raise ValueError("The activity profile should have 24 interval_factors, export it with the history command")
+    return [float(factor) for factor in factors]
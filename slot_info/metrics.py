@@ -0,0 +1,254 @@
+import bisect
+import threading
+import time
+
+# seconds, from a fast cached lookup up to a slow CoWIN response
+latency_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# bytes, from an empty findBy* response up to a large district calendar
+size_buckets = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class Counter:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Histogram:
+    """
+    Fixed bucket histogram, observing a value is a bisect and three additions under a lock
+    """
+    __slots__ = ('buckets', 'counts', 'count', 'sum', '_lock')
+
+    def __init__(self, buckets=latency_buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+    def quantile(self, q):
+        """
+        Estimates the q quantile by interpolating inside the bucket it falls in
+        """
+        with self._lock:
+            counts, count = list(self.counts), self.count
+        if count == 0:
+            return None
+        rank = q * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if bucket_count and seen + bucket_count >= rank:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+class _Timer:
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+
+class Family:
+    """
+    A named metric with its help text, every distinct set of label values is a separate child metric
+    """
+
+    def __init__(self, name, help_text, kind, factory):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self._factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels):
+        key = tuple(sorted(labels.items()))
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._children[key] = self._factory()
+        return child
+
+    # the unlabelled child, so a family without labels can be used directly
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def children(self):
+        with self._lock:
+            return list(self._children.items())
+
+
+class Registry:
+    """
+    Holds every metric of the process and renders them in the Prometheus text format
+    """
+
+    def __init__(self):
+        self._families = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text):
+        return self._family(name, help_text, "counter", Counter)
+
+    def histogram(self, name, help_text, buckets=latency_buckets):
+        return self._family(name, help_text, "histogram", lambda: Histogram(buckets))
+
+    def get(self, name):
+        return self._families.get(name)
+
+    def _family(self, name, help_text, kind, factory):
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = Family(name, help_text, kind, factory)
+            return family
+
+    def render(self):
+        lines = []
+        with self._lock:
+            families = sorted(self._families.values(), key=lambda family: family.name)
+        for family in families:
+            lines.append("# HELP " + family.name + " " + family.help_text)
+            lines.append("# TYPE " + family.name + " " + family.kind)
+            for labels, child in family.children():
+                if family.kind == "counter":
+                    lines.append(family.name + _labels(labels) + " " + _number(child.value))
+                    continue
+                with child._lock:
+                    counts, count, total = list(child.counts), child.count, child.sum
+                cumulative = 0
+                for bucket, bucket_count in zip(child.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bucket == float("inf") else _number(bucket)
+                    lines.append(family.name + "_bucket" + _labels(labels + (("le", le),)) + " " + str(cumulative))
+                lines.append(family.name + "_sum" + _labels(labels) + " " + _number(total))
+                lines.append(family.name + "_count" + _labels(labels) + " " + str(count))
+        return "\n".join(lines) + "\n"
+
+    def total(self, name):
+        """
+        Sum of a counter, or count of a histogram, over all its labels
+        """
+        family = self.get(name)
+        if family is None:
+            return 0
+        return sum(child.value if family.kind == "counter" else child.count for _, child in family.children())
+
+    def quantile(self, name, q):
+        family = self.get(name)
+        children = family.children() if family is not None else []
+        if len(children) != 1:
+            return None
+        return children[0][1].quantile(q)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(key + '="' + str(value).replace('"', '\\"') + '"' for key, value in labels) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# every metric of the process
+metrics = Registry()
+
+
+def serve(port, host="127.0.0.1", registry=metrics):
+    """
+    Serves the metrics on http://host:port/metrics from a daemon thread, returns the server
+    """
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def stats_line(registry=metrics):
+    """
+    One line summary of the request, cache, processing and notification metrics
+    """
+    fields = [("requests", registry.total("cowin_request_seconds")),
+              ("errors", registry.total("cowin_request_errors_total")),
+              ("request_p50", registry.quantile("cowin_request_seconds", 0.5)),
+              ("request_p99", registry.quantile("cowin_request_seconds", 0.99)),
+              ("not_modified", registry.total("cowin_not_modified_total")),
+              ("unchanged", registry.total("cowin_unchanged_responses_total")),
+              ("coalesced", registry.total("coalesced_calls_total")),
+              ("process_p99", registry.quantile("check_process_seconds", 0.99)),
+              ("notified", registry.total("notified_sessions_total")),
+              ("sends", registry.total("notification_send_seconds")),
+              ("send_errors", registry.total("notification_errors_total"))]
+    return "Stats: " + " ".join(key + "=" + (str(round(value, 4)) if isinstance(value, float) else str(value))
+                                for key, value in fields if value is not None)
+
+
+def log_stats_every(interval, registry=metrics):
+    """
+    Prints stats_line every interval seconds from a daemon thread
+    """
+    def run():
+        while True:
+            time.sleep(interval)
+            print(stats_line(registry))
+
+    thread = threading.Thread(target=run, name="stats", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,113 @@
+import sys
+
+
+class Center:
+    """
+    The fields of a CoWIN center used by this tool, shared by all the sessions of the center
+    """
+    __slots__ = ('center_id', 'name', 'pincode', 'district_name', 'fee_type')
+
+    def __init__(self, center_id, name, pincode, district_name=None, fee_type=None):
+        self.center_id = center_id
+        self.name = name
+        self.pincode = pincode
+        self.district_name = district_name
+        self.fee_type = fee_type
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('center_id'),
+                   data['name'],
+                   data['pincode'],
+                   data.get('district_name'),
+                   data.get('fee_type'))
+
+    def __repr__(self):
+        return "Center(" + str(self.center_id) + ", " + repr(self.name) + ", " + str(self.pincode) + ")"
+
+
+class Session:
+    """
+    A CoWIN session keeping only the fields that are filtered on or notified, the rest of the response
+    is dropped as soon as the session is parsed
+    """
+    __slots__ = ('session_id', 'center', 'date', 'available_capacity', 'available_capacity_dose1',
+                 'available_capacity_dose2', 'min_age_limit', 'vaccine', 'slots')
+
+    def __init__(self, session_id, center, date, available_capacity, available_capacity_dose1,
+                 available_capacity_dose2, min_age_limit, vaccine, slots=()):
+        self.session_id = session_id
+        self.center = center
+        self.date = date
+        self.available_capacity = available_capacity
+        self.available_capacity_dose1 = available_capacity_dose1
+        self.available_capacity_dose2 = available_capacity_dose2
+        self.min_age_limit = min_age_limit
+        self.vaccine = vaccine
+        self.slots = slots
+
+    @classmethod
+    def from_dict(cls, data, center):
+        return cls(data.get('session_id'),
+                   center,
+                   _intern(data['date']),
+                   int(data['available_capacity']),
+                   int(data.get('available_capacity_dose1', 0)),
+                   int(data.get('available_capacity_dose2', 0)),
+                   int(data['min_age_limit']),
+                   _intern(data['vaccine']),
+                   tuple(_slot_time(slot) for slot in data.get('slots') or ()))
+
+    @property
+    def name(self):
+        return self.center.name
+
+    @property
+    def pincode(self):
+        return self.center.pincode
+
+    @property
+    def fee_type(self):
+        return self.center.fee_type
+
+    def __repr__(self):
+        return "Session(" + repr(self.session_id) + ", " + repr(self.center) + ", " + str(self.date) + \
+            ", available=" + str(self.available_capacity) + ")"
+
+
+def _intern(value):
+    # dates, vaccine names and slot times repeat across thousands of sessions
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _slot_time(slot):
+    if isinstance(slot, dict):
+        slot = slot.get('time', "")
+    return _intern(slot)
+
+
+def sessions_from_centers(centers, session_filter=None):
+    """
+    Parses calendarBy* centers into sessions, centers that cannot match the filter are skipped without
+    looking at their sessions
+    """
+    fees = session_filter.fees if session_filter is not None else None
+    for data in centers:
+        if fees and str(data.get('fee_type')).upper() not in fees:
+            continue
+        center = Center.from_dict(data)
+        for session in data['sessions']:
+            yield Session.from_dict(session, center)
+
+
+def sessions_from_find_by(sessions):
+    """
+    Parses findBy* sessions, which carry the center fields inline, the centers are shared between sessions
+    """
+    centers = {}
+    for data in sessions:
+        key = data.get('center_id', (data['name'], data['pincode']))
+        center = centers.get(key)
+        if center is None:
+            center = centers[key] = Center.from_dict(data)
+        yield Session.from_dict(data, center)
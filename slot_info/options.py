@@ -0,0 +1,99 @@
+import click
+
+from slot_info.constants import vaccine_types, dose_numbers, age_filter, fee_types
+from slot_info.watch import notify_channels
+
+location_options = {
+    "district": click.option("-dId", "--district_id",
+                             type=str,
+                             required=True,
+                             help="ID or name of the district, if the name is not found run get-district-id command"),
+    "pincode": click.option("-pin", "--pin_code",
+                            type=str,
+                            required=True,
+                            help="Pin code of your area to search for appointments")
+}
+
+date_option = click.option("-d", "--date",
+                           type=str,
+                           required=True,
+                           help="Date for which appointments are to be checked")
+
+date_range_options = [
+    click.option("-d", "--date", "--from", "date",
+                 type=str,
+                 required=True,
+                 help="Date, or first date of the range, for which appointments are to be checked"),
+    click.option("-to", "--to_date", "--to", "to",
+                 type=str,
+                 required=False,
+                 default=None,
+                 help="Last date of the range, dates are checked 7 days per request")
+]
+
+interval_option = click.option("-i", "--interval",
+                               type=click.IntRange(min=1),
+                               required=True,
+                               help="Interval in seconds")
+
+notify_option = click.option("-n", "--notify_on",
+                             type=click.Choice(notify_channels),
+                             required=True,
+                             help="Receive notification on whatsapp/telegram")
+
+filter_options = [
+    click.option("-af", "--age_filter",
+                 type=click.Choice(age_filter),
+                 multiple=True,
+                 required=False,
+                 default=[],
+                 help="Filter only 18 plus or 45 plus appointments"),
+    click.option("-vt", "--vaccine_type",
+                 type=click.Choice(vaccine_types, case_sensitive=False),
+                 required=False,
+                 multiple=True,
+                 default=[],
+                 help="Vaccine type for which appointments are to be checked"),
+    click.option("-dn", "--dose_number",
+                 type=click.Choice(dose_numbers),
+                 required=False,
+                 multiple=True,
+                 default=[],
+                 help="Dose number for which appointments are to be checked"),
+    click.option("-ft", "--fee_type",
+                 type=click.Choice(fee_types, case_sensitive=False),
+                 required=False,
+                 multiple=True,
+                 default=[],
+                 help="Only free or paid centers"),
+    click.option("-st", "--slot_time",
+                 type=str,
+                 required=False,
+                 default=None,
+                 help="Only centers with a slot in this HH:MM-HH:MM window, for example: 09:00-13:00"),
+    click.option("-mc", "--min_capacity",
+                 type=click.IntRange(min=1),
+                 required=False,
+                 default=1,
+                 help="Minimum number of available doses")
+]
+
+
+def check_options(location, date_range=False, interval=False):
+    """
+    Options shared by the check commands: the district or pin code, the date (or range of dates), the interval
+    of the continuous commands, the notification channel and the session filters
+    """
+    options = [location_options[location]]
+    options.extend(date_range_options if date_range else [date_option])
+    if interval:
+        options.append(interval_option)
+    options.append(notify_option)
+    options.extend(filter_options)
+
+    def decorate(command):
+        for option in reversed(options):
+            command = option(command)
+        return command
+
+    return decorate
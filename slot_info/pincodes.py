@@ -0,0 +1,69 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+from slot_info.constants import state_dir
+
+
+class PincodeMap:
+    """
+    Pin code to district name mapping learned from the centers seen in CoWIN responses and saved on disk,
+    it lets pin code watches in the same district be served by a single district request. An empty path
+    keeps the mapping in memory only.
+    """
+
+    def __init__(self, path=None, save_interval=60):
+        self.path = os.path.join(state_dir, "pincodes.json") if path is None else path
+        self.save_interval = save_interval
+        self._districts = None
+        self._dirty = False
+        self._saved_at = 0
+        self._lock = threading.Lock()
+        atexit.register(self.save)
+
+    def learn(self, sessions):
+        """
+        Passes the sessions through, recording the district of every center on the way
+        """
+        districts = self._load()
+        last_center = None
+        for session in sessions:
+            center = session.center
+            if center is not last_center:
+                last_center = center
+                pincode = str(center.pincode)
+                if center.district_name and districts.get(pincode) != center.district_name:
+                    with self._lock:
+                        districts[pincode] = center.district_name
+                        self._dirty = True
+            yield session
+        if self._dirty and time.monotonic() - self._saved_at > self.save_interval:
+            self.save()
+
+    def district_name(self, pincode):
+        return self._load().get(str(pincode))
+
+    def save(self):
+        with self._lock:
+            if not self._dirty or not self.path:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            temporary_path = self.path + ".tmp"
+            with open(temporary_path, "w") as pincodes_file:
+                json.dump(self._districts, pincodes_file)
+            os.replace(temporary_path, self.path)
+            self._dirty = False
+            self._saved_at = time.monotonic()
+
+    def _load(self):
+        if self._districts is None:
+            with self._lock:
+                if self._districts is None:
+                    try:
+                        with open(self.path) as pincodes_file:
+                            self._districts = json.load(pincodes_file)
+                    except (OSError, ValueError):
+                        self._districts = {}
+        return self._districts
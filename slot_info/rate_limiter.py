@@ -0,0 +1,125 @@
+import contextlib
+import threading
+import time
+from urllib.parse import urlsplit
+
+throttle_statuses = frozenset([403, 429])
+
+
+class RateLimitExceeded(Exception):
+    """
+    Raised when a request would have to wait longer than max_wait for its turn and is shed instead
+    """
+    pass
+
+
+class RateLimiter:
+    """
+    Token bucket limiting how many requests are sent in every 5 minutes window. Tokens are refilled one
+    at a time, so with a small burst the requests are spread evenly over the window instead of being sent
+    all at once at its start.
+
+    Every 403/429 response doubles the spacing between requests (up to max_slowdown times) and pauses the
+    bucket, every successful response brings the spacing back a little towards the configured budget.
+    """
+
+    def __init__(self, requests_per_5_minutes=100,
+                 burst=1,
+                 max_wait=None,
+                 max_slowdown=16,
+                 hosts=None):
+        self.burst = max(1, burst)
+        self.max_wait = max_wait
+        self.max_slowdown = max_slowdown
+        self.hosts = None if hosts is None else frozenset(hosts)
+        self.slowdown = 1.0
+        self.requests = 0
+        self.delayed = 0
+        self.shed = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+        # theoretical arrival time of the next request, the bucket is full when this is in the past
+        self._next_at = time.monotonic()
+        self.set_budget(requests_per_5_minutes)
+
+    def set_budget(self, requests_per_5_minutes):
+        if requests_per_5_minutes <= 0:
+            raise ValueError("requests_per_5_minutes should be greater than 0")
+        self.requests_per_5_minutes = requests_per_5_minutes
+
+    @property
+    def interval(self):
+        return 300.0 / self.requests_per_5_minutes * self.slowdown
+
+    @contextlib.contextmanager
+    def bursting(self, burst):
+        """
+        Lets up to burst requests, at most the 5 minutes budget, go out back to back while in the block, for a
+        batch of requests known to fit the budget. They still take their tokens, the requests sent after the
+        block wait until the budget has been refilled.
+        """
+        with self._lock:
+            previous = self.burst
+            self.burst = max(previous, min(int(burst), int(self.requests_per_5_minutes)))
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self.burst = previous
+
+    def applies_to(self, url):
+        return self.hosts is None or urlsplit(url).netloc in self.hosts
+
+    def reserve(self, max_wait=None):
+        """
+        Takes a token and returns how many seconds the caller has to wait before sending its request,
+        raises RateLimitExceeded if that would be longer than max_wait
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        with self._lock:
+            now = time.monotonic()
+            next_at = max(self._next_at, now)
+            interval = self.interval
+            wait = next_at - (self.burst - 1) * interval - now
+            if max_wait is not None and wait > max_wait:
+                self.shed += 1
+                raise RateLimitExceeded("Request shed, next slot is in " + str(round(wait, 2)) + " seconds")
+            self._next_at = next_at + interval
+            self.requests += 1
+            if wait > 0:
+                self.delayed += 1
+                return wait
+            return 0.0
+
+    def acquire(self, max_wait=None):
+        wait = self.reserve(max_wait)
+        if wait > 0:
+            time.sleep(wait)
+
+    def record(self, status_code, retry_after=None):
+        """
+        Feeds the status code of a response back into the limiter to adapt the request rate
+        """
+        with self._lock:
+            if status_code in throttle_statuses:
+                self.throttled += 1
+                self.slowdown = min(self.slowdown * 2, self.max_slowdown)
+                pause = self.interval
+                if retry_after is not None:
+                    try:
+                        pause = max(pause, float(retry_after))
+                    except ValueError:
+                        pass
+                self._next_at = max(self._next_at, time.monotonic() + pause)
+            elif status_code < 400 and self.slowdown > 1.0:
+                self.slowdown = max(1.0, self.slowdown * 0.9)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "delayed": self.delayed,
+                "shed": self.shed,
+                "throttled": self.throttled,
+                "requests_per_5_minutes": round(self.requests_per_5_minutes / self.slowdown, 2)
+            }
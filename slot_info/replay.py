@@ -0,0 +1,314 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from datetime import timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl, parse_qs
+
+from slot_info.dates import parse_date, format_date
+
+
+def request_key(path, params=None):
+    """
+    Key of a request, the path and its query params in a stable order
+    """
+    params = sorted((str(k), str(v)) for k, v in (params or {}).items())
+    return path + ("?" + "&".join(k + "=" + v for k, v in params) if params else "")
+
+
+class ResponseRecorder:
+    """
+    Saves every response to a JSON file of directory, one file per url and params, so that a session
+    against the live API can be replayed offline later with ReplayServer
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, url, params, status, body):
+        key = request_key(urlsplit(url).path, params)
+        entry = {"key": key, "url": url, "params": params or {}, "status": status,
+                 "body": body.decode("utf-8", "replace"), "recorded_at": time.time()}
+        path = os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+        temporary_path = path + ".tmp." + str(threading.get_ident())
+        with open(temporary_path, "w") as recording:
+            json.dump(entry, recording)
+        os.replace(temporary_path, path)
+
+
+class RecordedResponses:
+    """
+    Answers requests with the responses saved by ResponseRecorder, matching on path and query params
+    """
+
+    def __init__(self, directory):
+        self.responses = {}
+        for name in os.listdir(directory):
+            if name.endswith(".json"):
+                with open(os.path.join(directory, name)) as recording:
+                    entry = json.load(recording)
+                self.responses[entry['key']] = (entry['status'], entry['body'].encode("utf-8"))
+
+    def __call__(self, path, params):
+        return self.responses.get(request_key(path, params))
+
+
+class SyntheticCalendar:
+    """
+    Answers calendarBy* requests with a made up 7 day calendar of about the given number of sessions and
+    findBy* requests with the sessions of the requested date. Every request of a url gets the next of
+    variants bodies, which only differ in capacities, so that consecutive polls always see changes.
+    """
+
+    def __init__(self, sessions, variants=2, seed=0):
+        self.variants = variants
+        self.seed = seed
+        self.sessions = sessions
+        self._bodies = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, path, params):
+        key = request_key(path, params)
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        variant = count % self.variants
+        date = params.get('date', "10-05-2021")
+        calendar = "calendar" in path
+        key = (calendar, date, variant)
+        body = self._bodies.get(key)
+        if body is None:
+            centers = synthetic_centers(self.sessions, date, random.Random(self.seed + variant))
+            if calendar:
+                data = {"centers": centers}
+            else:
+                data = {"sessions": [dict(session, **_center_fields(center)) for center in centers
+                                     for session in center['sessions'] if session['date'] == date]}
+            body = self._bodies[key] = json.dumps(data).encode("utf-8")
+        return 200, body
+
+
+def _center_fields(center):
+    return {name: value for name, value in center.items() if name != 'sessions'}
+
+
+def synthetic_centers(sessions, date, rng):
+    """
+    Centers of a made up district with sessions spread over the 7 days starting at date
+    """
+    start = parse_date(date)
+    dates = [format_date(start + timedelta(days=day)) for day in range(7)]
+    centers = []
+    for index in range((sessions + 6) // 7):
+        center_sessions = []
+        for day in range(min(7, sessions - index * 7)):
+            dose1 = rng.choice([0, 0, 0, 2, 10])
+            dose2 = rng.choice([0, 0, 5])
+            center_sessions.append({
+                "session_id": "s-" + str(index) + "-" + str(day),
+                "date": dates[day],
+                "available_capacity": dose1 + dose2,
+                "available_capacity_dose1": dose1,
+                "available_capacity_dose2": dose2,
+                "min_age_limit": rng.choice([18, 45]),
+                "vaccine": rng.choice(["COVISHIELD", "COVAXIN"]),
+                "slots": ["09:00AM-11:00AM", "11:00AM-01:00PM", "01:00PM-03:00PM", "03:00PM-06:00PM"]
+            })
+        centers.append({"center_id": index, "name": "Center " + str(index), "address": "Road " + str(index),
+                        "state_name": "State", "district_name": "District", "block_name": "Block",
+                        "pincode": 400000 + index % 500, "lat": 19, "long": 72, "from": "09:00:00",
+                        "to": "18:00:00", "fee_type": rng.choice(["Free", "Paid"]), "sessions": center_sessions})
+    return centers
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 drops connections when many workers connect at once
+    request_queue_size = 128
+
+
+class ReplayServer:
+    """
+    Local stand-in for CoWIN serving the responses of responder, a callable taking the path and query
+    params and returning (status, body) or None for a 404. Every response is delayed by latency seconds
+    plus up to jitter seconds, and error_rate of the requests are answered with error_status instead.
+    """
+
+    def __init__(self, responder, port=0, host="127.0.0.1", latency=0.0, jitter=0.0, error_rate=0.0,
+                 error_status=503, seed=None):
+        self.responder = responder
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://" + host + ":" + str(port) + "/api/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="replay", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        server = self
+
+        class ReplayHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body = server._respond(self.path)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return ReplayHandler
+
+    def _respond(self, raw_path):
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+            failed = self.error_rate > 0 and self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if delay > 0:
+            time.sleep(delay)
+        if failed:
+            return self.error_status, b'{"errorCode":"INJECTED","error":"Injected error"}'
+        parts = urlsplit(raw_path)
+        response = self.responder(parts.path, dict(parse_qsl(parts.query)))
+        if response is None:
+            return 404, b'{"errorCode":"NOT_RECORDED","error":"No recorded response"}'
+        return response
+
+
+class MessagingServer:
+    """
+    Local stand-in for the Telegram Bot API and the Twilio Messages API, point the notifiers to it with
+    SLOTINFO_TELEGRAM_API and SLOTINFO_TWILIO_API. Every message accepted is kept in messages as (channel,
+    recipient, text). Every response is delayed by latency seconds, error_rate of the messages are answered
+    with a 429 asking to retry after retry_after seconds and the recipients of refused are answered with a 400.
+    """
+
+    def __init__(self, port=0, host="127.0.0.1", latency=0.0, error_rate=0.0, retry_after=1, refused=(),
+                 seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.refused = frozenset(str(recipient) for recipient in refused)
+        self.messages = []
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), self._handler())
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://" + host + ":" + str(port)
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="messaging", daemon=True).start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def sent_to(self, recipient):
+        with self._lock:
+            return [text for _, sent_recipient, text in self.messages if sent_recipient == str(recipient)]
+
+    def _handler(self):
+        server = self
+
+        class MessagingHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                path = urlsplit(self.path).path
+                if path.endswith("/sendMessage"):
+                    data = json.loads(body or b"{}")
+                    status, answer = server._telegram(str(data.get('chat_id')), data.get('text'))
+                elif path.endswith("/Messages.json"):
+                    form = {name: values[0] for name, values in parse_qs(body.decode("utf-8")).items()}
+                    status, answer = server._twilio(form.get('From', ""), form.get('To', ""), form.get('Body'))
+                else:
+                    status, answer = 404, {"error": "Not found"}
+                answer = json.dumps(answer).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(answer)))
+                self.end_headers()
+                self.wfile.write(answer)
+
+            def log_message(self, *args):
+                pass
+
+        return MessagingHandler
+
+    def _accept(self, channel, recipient, text):
+        """
+        Returns None when the message is accepted, otherwise the status it is answered with
+        """
+        with self._lock:
+            self.requests += 1
+            failed = self.error_rate > 0 and self._random.random() < self.error_rate
+            if failed or recipient in self.refused:
+                self.errors += 1
+            elif text is not None:
+                self.messages.append((channel, recipient, text))
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if failed:
+            return 429
+        if recipient in self.refused or text is None:
+            return 400
+        return None
+
+    def _telegram(self, chat_id, text):
+        status = self._accept("telegram", chat_id, text)
+        if status == 429:
+            return 429, {"ok": False, "error_code": 429, "parameters": {"retry_after": self.retry_after},
+                         "description": "Too Many Requests: retry after " + str(self.retry_after)}
+        if status is not None:
+            return 400, {"ok": False, "error_code": 400, "description": "Bad Request: chat not found"}
+        return 200, {"ok": True, "result": {"chat": {"id": chat_id}, "text": text}}
+
+    def _twilio(self, from_number, to_number, text):
+        recipient = to_number[len("whatsapp:"):] if to_number.startswith("whatsapp:") else to_number
+        status = self._accept("whatsapp", recipient, text)
+        if status == 429:
+            return 429, {"code": 20429, "message": "Too Many Requests", "status": 429}
+        if status is not None:
+            return 400, {"code": 21211, "message": "Invalid 'To' Phone Number: " + to_number, "status": 400}
+        return 201, {"sid": "SM" + hashlib.md5((to_number + str(time.time())).encode("utf-8")).hexdigest(),
+                     "status": "queued", "from": from_number, "to": to_number, "body": text}
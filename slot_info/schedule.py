@@ -0,0 +1,146 @@
+import math
+import random
+import threading
+import time
+
+
+def parse_quiet_hours(quiet_hours):
+    """
+    Parses a "HH-HH" range of local hours, which may wrap around midnight like "22-7"
+    """
+    try:
+        start, end = (int(hour) for hour in quiet_hours.split("-"))
+    except ValueError:
+        raise ValueError("Quiet hours should be provided in HH-HH format, for example: 22-7")
+    if not (0 <= start < 24 and 0 <= end < 24):
+        raise ValueError("Quiet hours should be between 0 and 23")
+    return start, end
+
+
+class FixedSchedule:
+    """
+    Polls every target at its own interval. Each interval is jittered by a small fraction so that targets
+    started together drift apart instead of hitting CoWIN in synchronized bursts, the average rate stays
+    the configured one.
+    """
+
+    def __init__(self, jitter=0.1):
+        self.jitter = jitter
+
+    def first_delay(self, target):
+        return random.uniform(0, self.jitter * target.interval)
+
+    def next_interval(self, target):
+        return self._jittered(target.interval)
+
+    def record(self, target, changed):
+        pass
+
+    def stats(self):
+        return {}
+
+    def _jittered(self, interval):
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+class AdaptiveSchedule(FixedSchedule):
+    """
+    Moves the interval of every target between its min_interval and max_interval depending on how often
+    its sessions changed recently: a target whose slots keep opening and closing is polled faster, a quiet
+    one slows down towards max_interval. The change rate is an exponential moving average, so that a single
+    opening does not make a target fast forever.
+
+    During the quiet hours every interval is multiplied by quiet_factor, and interval_factors, 24 multipliers
+    one per local hour, make targets poll faster in the hours when slots usually open. When a rate limiter is given its
+    budget is shared between the targets in proportion to their change rate, so requests are spent where
+    openings happen instead of being shed by the limiter.
+    """
+
+    def __init__(self, rate_limiter=None, smoothing=0.2, quiet_hours=None, quiet_factor=2.0, jitter=0.1,
+                 clock=time.localtime, interval_factors=None):
+        super().__init__(jitter)
+        self.rate_limiter = rate_limiter
+        self.smoothing = smoothing
+        self.quiet_hours = quiet_hours
+        self.quiet_factor = quiet_factor
+        self.interval_factors = interval_factors
+        self.clock = clock
+        self._rates = {}
+        self._total_weight = 0.0
+        self._lock = threading.Lock()
+
+    def first_delay(self, target):
+        # every target takes its share of the budget from the start
+        self._rate(target)
+        return super().first_delay(target)
+
+    def next_interval(self, target):
+        low, high = target.min_interval, target.max_interval
+        rate = self._rate(target)
+        interval = high * (low / high) ** rate if high > low else low
+        if self._is_quiet():
+            interval *= self.quiet_factor
+        if self.interval_factors is not None:
+            interval *= self.interval_factors[self.clock().tm_hour]
+        if self.rate_limiter is not None:
+            with self._lock:
+                share = _weight(rate) / self._total_weight
+            # the rate limiter interval grows while CoWIN is throttling us
+            interval = max(interval, self.rate_limiter.interval / share)
+        return self._jittered(min(max(interval, low), high))
+
+    def record(self, target, changed):
+        with self._lock:
+            rate = self._rate_locked(target)
+            updated = rate + self.smoothing * ((1.0 if changed else 0.0) - rate)
+            self._rates[target] = updated
+            self._total_weight += _weight(updated) - _weight(rate)
+
+    def stats(self):
+        with self._lock:
+            rates = sorted(self._rates.values())
+        if not rates:
+            return {}
+        return {"targets": len(rates), "min_change_rate": round(rates[0], 3),
+                "max_change_rate": round(rates[-1], 3)}
+
+    def _rate(self, target):
+        with self._lock:
+            return self._rate_locked(target)
+
+    def _rate_locked(self, target):
+        rate = self._rates.get(target)
+        if rate is None:
+            # start at the configured interval, min_interval <= interval <= max_interval
+            low, high = target.min_interval, target.max_interval
+            rate = math.log(high / target.interval) / math.log(high / low) if high > low else 0.0
+            self._rates[target] = rate
+            self._total_weight += _weight(rate)
+        return rate
+
+    def _is_quiet(self):
+        if self.quiet_hours is None:
+            return False
+        start, end = self.quiet_hours
+        hour = self.clock().tm_hour
+        return start <= hour < end if start <= end else hour >= start or hour < end
+
+
+def _weight(rate):
+    # targets that never change still get a small share of the budget
+    return rate + 0.05
+
+
+def run_every(interval, check, jitter=0.0):
+    """
+    Calls check on a fixed-rate deadline, the time spent in check is not added to the period and missed
+    ticks are skipped instead of being run back to back
+    """
+    due_at = time.monotonic()
+    while True:
+        check()
+        due_at += interval * random.uniform(1 - jitter, 1 + jitter)
+        now = time.monotonic()
+        if due_at < now:
+            due_at = now + interval - ((now - due_at) % interval)
+        time.sleep(due_at - now)
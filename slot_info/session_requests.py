@@ -1,7 +1,99 @@
+import hashlib
+import threading
+import time
+
 import requests
 from urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
 
+from slot_info.coalesce import SingleFlight
+from slot_info.metrics import metrics, size_buckets
+
+request_seconds = metrics.histogram("cowin_request_seconds", "Latency of the requests sent to CoWIN")
+response_bytes = metrics.histogram("cowin_response_bytes", "Size of the CoWIN response bodies", size_buckets)
+responses = metrics.counter("cowin_responses_total", "CoWIN responses by status code")
+request_errors = metrics.counter("cowin_request_errors_total", "CoWIN requests that failed without a response")
+not_modified = metrics.counter("cowin_not_modified_total", "Conditional CoWIN requests answered with 304")
+unchanged_responses = metrics.counter("cowin_unchanged_responses_total",
+                                      "Responses skipped because their consumer already processed the same body")
+
+
+class ConditionalCache:
+    """
+    Remembers the validators (ETag/Last-Modified), the body and its digest of the last response received
+    for every url and params, so that conditional requests can be sent and a 304 answered from memory.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(url, params=None):
+        if not params:
+            return url
+        return url + "?" + "&".join(str(k) + "=" + str(v) for k, v in sorted(params.items()))
+
+    def headers(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        conditional_headers = {}
+        if entry is not None:
+            if entry['etag'] is not None:
+                conditional_headers['If-None-Match'] = entry['etag']
+            if entry['last_modified'] is not None:
+                conditional_headers['If-Modified-Since'] = entry['last_modified']
+        return conditional_headers
+
+    def cached(self, key):
+        """
+        Returns the (body, digest) stored for key, to be used when the server answers 304
+        """
+        with self._lock:
+            entry = self._entries[key]
+        return entry['body'], entry['digest']
+
+    def store(self, key, body, etag=None, last_modified=None):
+        """
+        Stores the new body and validators and returns (body, digest)
+        """
+        digest = hashlib.sha1(body).digest()
+        with self._lock:
+            if etag is None and last_modified is None:
+                # without validators the body is never needed again, only its digest
+                self._entries.pop(key, None)
+            else:
+                self._entries[key] = {'etag': etag, 'last_modified': last_modified, 'body': body, 'digest': digest}
+        return body, digest
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class ChangeTracker:
+    """
+    Remembers the digest of the last response processed by every consumer, so that each of them can skip
+    a response it has already seen, even when the same response is shared with other consumers.
+    """
+
+    def __init__(self):
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def is_changed(self, consumer, digest):
+        with self._lock:
+            previous = self._digests.get(consumer)
+            self._digests[consumer] = digest
+        if previous == digest:
+            unchanged_responses.inc()
+            return False
+        return True
+
+    def forget(self, consumer):
+        with self._lock:
+            self._digests.pop(consumer, None)
+
 
 class SessionRequest:
     default_headers = headers = {
@@ -12,19 +104,83 @@ class SessionRequest:
 
     def __init__(self, headers=None,
                  max_retries=3,
-                 backoff_factor=0.1):
+                 backoff_factor=0.1,
+                 pool_maxsize=10,
+                 rate_limiter=None,
+                 coalesce_ttl=2.0,
+                 recorder=None):
         session_headers = self.default_headers if headers is None else headers
 
-        retries = Retry(total=max_retries,
-                        backoff_factor=backoff_factor)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.rate_limiter = rate_limiter
+        # a slot_info.replay.ResponseRecorder saving every successful response
+        self.recorder = recorder
+        self.conditional_cache = ConditionalCache()
+        self.single_flight = SingleFlight(ttl=coalesce_ttl)
         self.session = requests.Session()
-        self.session.mount('https://', HTTPAdapter(max_retries=retries))
+        self.set_pool_size(pool_maxsize)
         self.session.headers = session_headers
 
+    def set_pool_size(self, pool_maxsize):
+        """
+        (Re)mounts the adapters so that up to pool_maxsize connections per host are kept alive,
+        this should be at least the number of threads sharing this session.
+        """
+        retries = Retry(total=self.max_retries,
+                        backoff_factor=self.backoff_factor)
+        adapter = HTTPAdapter(max_retries=retries, pool_maxsize=pool_maxsize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
     def get(self, url, **kwargs):
         try:
-            response = self.session.get(url, **kwargs)
+            response = self._get(url, **kwargs)
             response.raise_for_status()
             return response.json()
         except requests.HTTPError as http_error:
             raise http_error
+
+    def get_raw(self, url, **kwargs):
+        """
+        Returns the (body, digest) of the response without parsing it. Conditional headers are sent when
+        the server gave validators, a 304 is answered with the stored body and identical concurrent or
+        recent requests are served by a single call.
+        """
+        key = self.conditional_cache.key(url, kwargs.get('params'))
+        return self.single_flight.do(key, lambda: self._get_raw(key, url, **kwargs))
+
+    def _get_raw(self, key, url, **kwargs):
+        headers = self.conditional_cache.headers(key)
+        if headers:
+            headers.update(kwargs.get('headers') or {})
+            kwargs['headers'] = headers
+        try:
+            response = self._get(url, **kwargs)
+            if response.status_code == 304:
+                not_modified.inc()
+                return self.conditional_cache.cached(key)
+            response.raise_for_status()
+            return self.conditional_cache.store(key, response.content, response.headers.get("ETag"),
+                                                 response.headers.get("Last-Modified"))
+        except requests.HTTPError as http_error:
+            raise http_error
+
+    def _get(self, url, **kwargs):
+        limit = self.rate_limiter is not None and self.rate_limiter.applies_to(url)
+        if limit:
+            self.rate_limiter.acquire()
+        started = time.perf_counter()
+        try:
+            response = self.session.get(url, **kwargs)
+        except requests.RequestException:
+            request_errors.inc()
+            raise
+        request_seconds.observe(time.perf_counter() - started)
+        responses.labels(status=response.status_code).inc()
+        response_bytes.observe(len(response.content))
+        if self.recorder is not None and response.status_code == 200:
+            self.recorder.record(url, kwargs.get('params'), response.status_code, response.content)
+        if limit:
+            self.rate_limiter.record(response.status_code, response.headers.get("Retry-After"))
+        return response
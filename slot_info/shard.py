@@ -0,0 +1,212 @@
+import bisect
+import hashlib
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+from slot_info.dedup import MemoryDedupStore
+from slot_info.rate_limiter import RateLimiter, RateLimitExceeded, throttle_statuses
+
+
+def parse_shard(value):
+    """
+    Parses a "i/N" shard, i counting from 0
+    """
+    try:
+        index, _, count = value.partition("/")
+        index, count = int(index), int(count)
+    except ValueError:
+        raise ValueError("Shard should be provided as <index>/<count>, for example: 0/4")
+    if not 0 <= index < count:
+        raise ValueError("Shard index should be between 0 and " + str(count - 1))
+    return index, count
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring of count shards, each placed replicas times on the ring. A key belongs to the first
+    shard after its hash, so changing the number of shards only moves the keys of the added or removed ones.
+    """
+
+    def __init__(self, count, replicas=64):
+        self.count = count
+        points = sorted((_hash(str(shard) + "#" + str(replica)), shard)
+                        for shard in range(count) for replica in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, key):
+        index = bisect.bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._shards[index]
+
+
+def shard_key(target):
+    """
+    Targets are sharded by district and pin code targets by pin code, never by a district learned from earlier
+    responses, as every host learns its own and the same target has to land in the same shard on all of them
+    """
+    if target.district_id is not None:
+        return "district:" + str(target.district_id)
+    return "pincode:" + str(target.pin_code)
+
+
+def shard_targets(targets, shard):
+    index, count = shard
+    ring = HashRing(count)
+    return [target for target in targets if ring.shard_for(shard_key(target)) == index]
+
+
+class Coordinator:
+    """
+    Shared state of the workers of a sharded watch: the dedup store and the global rate budget, served over
+    HTTP so that workers on other hosts can use it too:
+
+        POST /dedup {"key": ...} -> {"added": true|false}
+        POST /reserve {"max_wait": ...} -> {"wait": seconds}, or 429 when the request has to be shed
+        POST /record {"status": ..., "retry_after": ...}
+        GET /stats
+    """
+
+    def __init__(self, dedup_store, rate_limiter, port=0, host="127.0.0.1"):
+        self.dedup_store = dedup_store
+        self.rate_limiter = rate_limiter
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://" + host + ":" + str(port)
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="coordinator", daemon=True).start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        coordinator = self
+
+        class CoordinatorHandler(BaseHTTPRequestHandler):
+            # workers keep their connection open between calls, the small responses are not delayed by Nagle
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                if self.path == "/stats":
+                    self._json(200, coordinator.rate_limiter.stats())
+                else:
+                    self._json(404, {"error": "Not found"})
+
+            def do_POST(self):
+                data = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                if self.path == "/dedup":
+                    self._json(200, {"added": coordinator.dedup_store.add(data['key'])})
+                elif self.path == "/reserve":
+                    try:
+                        self._json(200, {"wait": coordinator.rate_limiter.reserve(data.get('max_wait'))})
+                    except RateLimitExceeded as rate_limit_exceeded:
+                        self._json(429, {"error": str(rate_limit_exceeded)})
+                elif self.path == "/record":
+                    coordinator.rate_limiter.record(data['status'], data.get('retry_after'))
+                    self._json(200, {})
+                else:
+                    self._json(404, {"error": "Not found"})
+
+            def _json(self, status, data):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return CoordinatorHandler
+
+
+class _CoordinatorClient:
+    def __init__(self, url, timeout=5):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def post(self, path, data):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session.post(self.url + path, json=data, timeout=self.timeout)
+
+
+class CoordinatedDedupStore:
+    """
+    Dedup store of a sharded worker, every key is added in the store of the coordinator. While the coordinator
+    cannot be reached keys are deduped in memory only, so notifications keep going out.
+    """
+
+    def __init__(self, url, ttl=3600):
+        self.client = _CoordinatorClient(url)
+        self.fallback = MemoryDedupStore(ttl=ttl)
+
+    def add(self, key):
+        try:
+            response = self.client.post("/dedup", {"key": key})
+            response.raise_for_status()
+        except requests.RequestException as error:
+            print("Coordinator unreachable, deduplicating locally: " + repr(error))
+            return self.fallback.add(key)
+        return response.json()['added']
+
+
+class CoordinatedRateLimiter(RateLimiter):
+    """
+    Rate limiter of a sharded worker taking its tokens from the global budget of the coordinator. The local
+    budget, the global one divided by the number of shards, is only used by the adaptive schedule and as a
+    fallback while the coordinator cannot be reached.
+    """
+
+    def __init__(self, url, requests_per_5_minutes=100, shards=1, **kwargs):
+        self.client = _CoordinatorClient(url)
+        super().__init__(requests_per_5_minutes / float(shards), **kwargs)
+
+    def reserve(self, max_wait=None):
+        max_wait = self.max_wait if max_wait is None else max_wait
+        try:
+            response = self.client.post("/reserve", {"max_wait": max_wait})
+        except requests.RequestException as error:
+            print("Coordinator unreachable, rate limiting locally: " + repr(error))
+            return super().reserve(max_wait)
+        with self._lock:
+            if response.status_code == 429:
+                self.shed += 1
+                raise RateLimitExceeded(response.json()['error'])
+            response.raise_for_status()
+            wait = response.json()['wait']
+            self.requests += 1
+            if wait > 0:
+                self.delayed += 1
+            return wait
+
+    def record(self, status_code, retry_after=None):
+        # only the responses that change the rate are forwarded, not every successful one
+        forward = status_code in throttle_statuses or (status_code < 400 and self.slowdown > 1.0)
+        super().record(status_code, retry_after)
+        if not forward:
+            return
+        try:
+            self.client.post("/record", {"status": status_code, "retry_after": retry_after})
+        except requests.RequestException:
+            pass
@@ -0,0 +1,11 @@
+import io
+
+import ijson
+
+
+def iter_items(body, prefix):
+    """
+    Incrementally parses the items of the array at prefix, for example "centers.item", one at a time
+    without building a dict tree for the whole document
+    """
+    return ijson.items(io.BytesIO(body), prefix, use_float=True)
@@ -1,18 +1,160 @@
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
 
+from slot_info.dispatch import SendResult, markdown_characters
+from slot_info.rate_limiter import RateLimiter
 
-def send_telegram_message(bot_message):
-    bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
-    bot_chat_id = os.getenv('TELEGRAM_BOT_CHAT_ID')
-    if bot_token is None or bot_chat_id is None:
-        raise ValueError("Please set TELEGRAM_BOT_TOKEN and TELEGRAM_BOT_CHAT_ID as env variables")
+telegram_api = os.getenv('SLOTINFO_TELEGRAM_API', "https://api.telegram.org")
 
-    bot_api = "https://api.telegram.org/bot{0}/sendMessage?chat_id={1}&parse_mode=Markdown&text={2}"
-    send_message = bot_api.format(bot_token, bot_chat_id, bot_message)
+
+def escape_markdown(text):
+    for character in markdown_characters:
+        text = text.replace(character, "\\" + character)
+    return text
+
+
+class TelegramNotifier:
+    """
+    Sends messages with the Bot API from a keep-alive connection pool, as JSON POST bodies with the Markdown
+    characters escaped. A message is sent to many chats concurrently within the limits Telegram sets for a bot:
+    messages_per_second overall, one message per second in a chat and 20 per minute in a group. A 429 answer
+    pauses all the sends of the bot for its retry_after seconds before the message is tried again.
+    """
+    # messages per 5 minutes in a chat, group and channel chat ids are negative
+    chat_rates = {False: 300, True: 100}
+
+    def __init__(self, token, chat_ids=(), api_url=None, max_workers=8, messages_per_second=30, timeout=10,
+                 max_retries=3):
+        self.token = token
+        self.chat_ids = [str(chat_id) for chat_id in chat_ids]
+        self.url = (telegram_api if api_url is None else api_url).rstrip("/") + "/bot" + token + "/sendMessage"
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.rate_limiter = RateLimiter(messages_per_second * 300, burst=messages_per_second)
+        self._chat_limiters = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        """
+        Notifier of TELEGRAM_BOT_TOKEN sending to the comma separated chat ids of TELEGRAM_BOT_CHAT_ID
+        """
+        bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
+        if bot_token is None:
+            raise ValueError("Please set TELEGRAM_BOT_TOKEN and TELEGRAM_BOT_CHAT_ID as env variables")
+        chat_ids = os.getenv('TELEGRAM_BOT_CHAT_ID', "").split(",")
+        return cls(bot_token, [chat_id.strip() for chat_id in chat_ids if chat_id.strip()], **kwargs)
+
+    def send(self, text, chat_id):
+        """
+        Sends text to one chat and returns its SendResult, 429 and 5xx answers are retried
+        """
+        chat_id = str(chat_id)
+        body = {"chat_id": chat_id, "parse_mode": "Markdown", "text": escape_markdown(text)}
+        started = time.perf_counter()
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            self._chat_limiter(chat_id).acquire()
+            status, error, retry_after = None, None, None
+            try:
+                response = self.session.post(self.url, json=body, timeout=self.timeout)
+                status = response.status_code
+                if response.ok:
+                    self.rate_limiter.record(status)
+                    return SendResult(chat_id, True, status, time.perf_counter() - started)
+                error, retry_after = _describe_error(response)
+                self.rate_limiter.record(status, retry_after)
+            except requests.RequestException as request_error:
+                error = repr(request_error)
+            retriable = status is None or status == 429 or status >= 500
+            if not retriable or attempt >= self.max_retries:
+                return SendResult(chat_id, False, status, time.perf_counter() - started, error)
+            if retry_after is None:
+                time.sleep(0.5 * (2 ** attempt))
+            attempt += 1
+
+    def broadcast(self, text, chat_ids=None):
+        """
+        Sends text to every chat of chat_ids, all the chats of the notifier by default, and returns the
+        SendResult of every chat in the same order
+        """
+        chat_ids = self.chat_ids if chat_ids is None else [str(chat_id) for chat_id in chat_ids]
+        if not chat_ids:
+            raise ValueError("Please set TELEGRAM_BOT_TOKEN and TELEGRAM_BOT_CHAT_ID as env variables")
+        if len(chat_ids) == 1:
+            return [self.send(text, chat_ids[0])]
+        futures = []
+        try:
+            for chat_id in chat_ids:
+                futures.append(self._pool().submit(self.send, text, chat_id))
+        except RuntimeError:
+            # no new threads can be started once the interpreter is shutting down, the rest is sent from here
+            return [future.result() for future in futures] + \
+                [self.send(text, chat_id) for chat_id in chat_ids[len(futures):]]
+        return [future.result() for future in futures]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+        self.session.close()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="telegram")
+            return self._executor
+
+    def _chat_limiter(self, chat_id):
+        with self._lock:
+            limiter = self._chat_limiters.get(chat_id)
+            if limiter is None:
+                limiter = self._chat_limiters[chat_id] = RateLimiter(self.chat_rates[chat_id.startswith("-")])
+            return limiter
+
+
+def _describe_error(response):
     try:
-        response = requests.get(send_message)
-        response.raise_for_status()
-    except requests.HTTPError as http_error:
-        print(http_error.response.content)
+        data = response.json()
+    except ValueError:
+        return response.text[:200], None
+    return data.get('description'), (data.get('parameters') or {}).get('retry_after')
+
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+
+def default_notifier():
+    global _notifier
+    with _notifier_lock:
+        if _notifier is None:
+            _notifier = TelegramNotifier.from_env()
+        return _notifier
+
+
+def send_telegram_message(bot_message, chat_id=None):
+    """
+    Sends the message to chat_id, or to every chat of TELEGRAM_BOT_CHAT_ID, and returns the results of the
+    chats it could not be sent to. When there is a single chat a failure is raised instead.
+    """
+    results = default_notifier().broadcast(bot_message, None if chat_id is None else [chat_id])
+    failed = [result for result in results if not result.ok]
+    if len(results) == 1 and failed:
+        if failed[0].status is not None and 400 <= failed[0].status < 500 and failed[0].status != 429:
+            # a wrong chat id or token, retrying will not help
+            raise ValueError("Telegram refused the message: " + str(failed[0].error))
+        raise requests.HTTPError("Telegram message not sent: " + str(failed[0].error))
+    return failed
+
@@ -0,0 +1,437 @@
+import heapq
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from slot_info.constants import vaccine_types, dose_numbers, age_filter, fee_types
+from slot_info.dates import parse_date, date_range, plan_windows, window_dates
+from slot_info.filters import SessionFilter, SubscriberIndex
+from slot_info.schedule import FixedSchedule
+
+notify_channels = ["whatsapp", "telegram"]
+
+
+class WatchTarget:
+    """
+    A single district or pin code to be polled, along with its own filters and interval. With a to_date
+    the target covers every date from date to to_date, and is checked with 7 day calendar windows. An adaptive
+    schedule moves the interval between min_interval (half of it by default) and max_interval (four
+    times it by default). Targets checked only once have no interval. The recipient, a chat id or a mobile
+    number, overrides the one configured in the env variables.
+    """
+
+    def __init__(self, date, interval, notify_on, district_id=None, pin_code=None, next7days=False,
+                 age_filter=(), vaccine_type=(), dose_number=(), fee_type=(), slot_time=None, min_capacity=1,
+                 min_interval=None, max_interval=None, to_date=None, recipient=None):
+        if (district_id is None) == (pin_code is None):
+            raise ValueError("Provide exactly one of district_id or pin_code for a watch target")
+        if interval is not None:
+            min_interval = interval / 2.0 if min_interval is None else min_interval
+            max_interval = interval * 4.0 if max_interval is None else max_interval
+            if not 0 < min_interval <= interval <= max_interval:
+                raise ValueError("The interval of a watch target should be between its min_interval and "
+                                 "max_interval")
+        self.district_id = district_id
+        self.pin_code = pin_code
+        self.date = date
+        self.to_date = to_date
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.notify_on = notify_on
+        self.recipient = recipient
+        self.next7days = next7days
+        self.age_filter = tuple(age_filter)
+        self.vaccine_type = tuple(v.lower() for v in vaccine_type)
+        self.dose_number = tuple(dose_number)
+        dates = date_range(date, to_date) if to_date is not None else ()
+        self.session_filter = SessionFilter(age_filter, vaccine_type, dose_number, fee_type, slot_time, min_capacity,
+                                            dates)
+
+    @property
+    def name(self):
+        kind = "district " + str(self.district_id) if self.district_id is not None \
+            else "pin code " + str(self.pin_code)
+        if self.to_date is not None:
+            return kind + ", dates " + str(self.date) + " to " + str(self.to_date)
+        return kind + (" (next 7 days)" if self.next7days else "") + ", date " + str(self.date)
+
+    @classmethod
+    def from_dict(cls, data, defaults=None, resolve_district=None, require_interval=True):
+        if not isinstance(data, dict):
+            raise ValueError("Every watch target should be a JSON object")
+        values = dict(defaults or {})
+        values.update(data)
+        if 'from' in values:
+            values['date'] = values.pop('from')
+        district = values.get('district_id', values.get('district_name'))
+        if district is not None and resolve_district is not None:
+            values['district_id'] = resolve_district(district)
+        interval = _as_int(values.get('interval'), "interval")
+        if (interval is None and require_interval) or (interval is not None and interval <= 0):
+            raise ValueError("Every watch target needs a positive interval")
+        parse_date(values.get('date'))
+        to_date = values.get('to')
+        if to_date is not None:
+            date_range(values.get('date'), to_date)
+        notify_on = values.get('notify_on')
+        if notify_on not in notify_channels:
+            raise ValueError("notify_on should be one of " + str(notify_channels))
+        choices = {option: [str(value) for value in _as_list(values.get(option), option)]
+                   for option in ('age_filter', 'vaccine_type', 'dose_number', 'fee_type')}
+        _check_choices(choices['age_filter'], age_filter, "age_filter")
+        _check_choices([v.lower() for v in choices['vaccine_type']], vaccine_types, "vaccine_type")
+        _check_choices(choices['dose_number'], dose_numbers, "dose_number")
+        _check_choices([f.lower() for f in choices['fee_type']], fee_types, "fee_type")
+        slot_time = values.get('slot_time')
+        if slot_time is not None and not isinstance(slot_time, str):
+            raise ValueError("slot_time should be a string, for example: 09:00-12:00")
+        min_capacity = _as_int(values.get('min_capacity'), "min_capacity")
+        return cls(date=values.get('date'),
+                   interval=interval,
+                   notify_on=notify_on,
+                   district_id=_as_str(values.get('district_id')),
+                   pin_code=_as_str(values.get('pin_code')),
+                   next7days=bool(values.get('next7days', False)),
+                   age_filter=choices['age_filter'],
+                   vaccine_type=choices['vaccine_type'],
+                   dose_number=choices['dose_number'],
+                   fee_type=choices['fee_type'],
+                   slot_time=slot_time,
+                   min_capacity=1 if min_capacity is None else min_capacity,
+                   min_interval=_as_float(values.get('min_interval'), "min_interval"),
+                   max_interval=_as_float(values.get('max_interval'), "max_interval"),
+                   to_date=_as_str(to_date),
+                   recipient=_as_str(values.get('recipient')))
+
+
+def _as_str(value):
+    return None if value is None else str(value)
+
+
+def _as_int(value, option):
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(option + " should be a whole number, not " + repr(value))
+
+
+def _as_float(value, option):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(option + " should be a number, not " + repr(value))
+
+
+def _as_list(value, option):
+    if value is None:
+        return []
+    if not isinstance(value, (list, tuple)):
+        raise ValueError(option + " should be a list, for example: [" + json.dumps(str(value)) + "]")
+    return value
+
+
+def _check_choices(values, choices, option):
+    for value in values:
+        if str(value) not in choices:
+            raise ValueError("Invalid " + option + " '" + str(value) + "', choose from " + str(choices))
+
+
+def load_targets(path, resolve_district=None):
+    """
+    Reads watch targets from a JSON file. The file is either a list of targets or an object with a
+    "targets" list and optional "defaults" applied to every target, for example:
+
+        {"defaults": {"interval": 30, "notify_on": "telegram", "date": "10-05-2021"},
+         "targets": [{"district_id": 363, "next7days": true, "age_filter": ["18"]},
+                     {"pin_code": "411015", "dose_number": ["2"]}]}
+
+    resolve_district, when given, turns district names into ids.
+    """
+    with open(path) as targets_file:
+        data = json.load(targets_file)
+    defaults = {}
+    if isinstance(data, dict):
+        defaults = data.get('defaults', {})
+        data = data.get('targets', [])
+    return [WatchTarget.from_dict(target, defaults, resolve_district) for target in data]
+
+
+class MergedTarget:
+    """
+    Pin code targets of the same district, date and range, checked with a single district request whose
+    sessions are then fanned out to every member by pin code
+    """
+
+    def __init__(self, district_id, date, next7days, members):
+        self.district_id = district_id
+        self.pin_code = None
+        self.date = date
+        self.next7days = next7days
+        self.members = members
+        self.interval, self.min_interval, self.max_interval = _shared_intervals(members)
+
+    @property
+    def name(self):
+        return "district " + str(self.district_id) + (" (next 7 days)" if self.next7days else "") + ", date " + \
+            str(self.date) + " for pin codes " + ", ".join(sorted(set(member.pin_code for member in self.members)))
+
+
+class FanoutTarget:
+    """
+    Targets of the same location, date and range, usually of different subscribers, checked with a single
+    request. The sessions are matched once against the members grouped by identical filters, every group is
+    diffed once and notified to each of its members.
+    """
+
+    def __init__(self, district_id, pin_code, date, next7days, members):
+        self.district_id = district_id
+        self.pin_code = pin_code
+        self.date = date
+        self.next7days = next7days
+        self.members = members
+        self.index = SubscriberIndex(members)
+        self.interval, self.min_interval, self.max_interval = _shared_intervals(members)
+
+    @property
+    def name(self):
+        kind = "district " + str(self.district_id) if self.district_id is not None \
+            else "pin code " + str(self.pin_code)
+        return kind + (" (next 7 days)" if self.next7days else "") + ", date " + str(self.date) + " for " + \
+            str(len(self.members)) + " targets with " + str(len(self.index)) + " filters"
+
+
+class WindowTarget:
+    """
+    One 7 day calendar window of a district or pin code, shared by the date range targets of that location
+    overlapping it. Each member filters the sessions of the window down to its own dates.
+    """
+
+    def __init__(self, district_id, pin_code, date, members):
+        self.district_id = district_id
+        self.pin_code = pin_code
+        self.date = date
+        self.next7days = True
+        self.members = members
+        self.index = SubscriberIndex(members)
+        self.interval, self.min_interval, self.max_interval = _shared_intervals(members)
+
+    @property
+    def name(self):
+        kind = "district " + str(self.district_id) if self.district_id is not None \
+            else "pin code " + str(self.pin_code)
+        return kind + ", 7 days from " + str(self.date) + " for " + str(len(self.members)) + " date range targets"
+
+
+def _shared_intervals(members):
+    # a request shared by several targets is sent as often as the most frequent of them needs
+    if any(member.interval is None for member in members):
+        return None, None, None
+    interval = min(member.interval for member in members)
+    return interval, min(member.min_interval for member in members), \
+        max(interval, min(member.max_interval for member in members))
+
+
+def plan_windows_targets(targets):
+    """
+    Turns the date range targets into the fewest WindowTargets covering them, ranges of the same location are
+    planned together so that overlapping ranges share their windows
+    """
+    locations = {}
+    for target in targets:
+        locations.setdefault((target.district_id, target.pin_code), []).append(target)
+    planned = []
+    for (district_id, pin_code), ranged in locations.items():
+        for window in plan_windows([(target.date, target.to_date) for target in ranged]):
+            dates = frozenset(window_dates(window))
+            members = [target for target in ranged if dates & target.session_filter.dates]
+            planned.append(WindowTarget(district_id, pin_code, window, members))
+    return planned
+
+
+def plan_fanout_targets(targets):
+    """
+    Turns the targets of the same location, date and range into one FanoutTarget, lone targets are kept as
+    they are
+    """
+    locations = {}
+    for target in targets:
+        locations.setdefault((target.district_id, target.pin_code, target.date, target.next7days), []).append(target)
+    planned = []
+    for (district_id, pin_code, date, next7days), members in locations.items():
+        if len(members) > 1:
+            planned.append(FanoutTarget(district_id, pin_code, date, next7days, members))
+        else:
+            planned.extend(members)
+    return planned
+
+
+def plan_targets(targets, district_for_pincode):
+    """
+    Merges the pin code targets that district_for_pincode maps to the same district, date and range into
+    one MergedTarget, pin codes without a known district and lone pin codes are kept as they are. Targets
+    of the same location are fanned out from one request and date range targets are planned into 7 day
+    WindowTargets.
+    """
+    planned = plan_windows_targets([target for target in targets if target.to_date is not None])
+    groups = {}
+    for target in plan_fanout_targets([target for target in targets if target.to_date is None]):
+        district_id = district_for_pincode(target.pin_code) if target.pin_code is not None else None
+        if district_id is None:
+            planned.append(target)
+        else:
+            groups.setdefault((str(district_id), target.date, target.next7days), []).append(target)
+    for (district_id, date, next7days), members in groups.items():
+        if len(set(member.pin_code for member in members)) > 1:
+            planned.append(MergedTarget(district_id, date, next7days, members))
+        else:
+            planned.extend(members)
+    return planned
+
+
+class Watcher:
+    """
+    Polls many targets from one process. Each target keeps a fixed-rate deadline, checks are run on a
+    bounded thread pool and a target is never checked twice at the same time. The schedule decides the
+    interval of every target and is told whether each check saw a change.
+
+    Targets can be added and removed while the watcher runs, with keep_running it also waits for new
+    targets when it has none instead of returning.
+    """
+
+    def __init__(self, targets, check, max_workers=8, schedule=None, keep_running=False):
+        self.check = check
+        self.max_workers = max_workers
+        self.schedule = FixedSchedule() if schedule is None else schedule
+        self.keep_running = keep_running
+        self._targets = {}
+        self._due = []
+        self._keys = itertools.count()
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._wakeup = threading.Event()
+        for target in targets:
+            self.add(target)
+
+    @property
+    def targets(self):
+        with self._lock:
+            return list(self._targets.values())
+
+    def add(self, target):
+        """
+        Starts polling target and returns the key to remove it with
+        """
+        with self._lock:
+            key = next(self._keys)
+            self._targets[key] = target
+            heapq.heappush(self._due, (time.monotonic() + self.schedule.first_delay(target), key))
+        self._wakeup.set()
+        return key
+
+    def remove(self, key):
+        """
+        Stops polling the target added with key, a check already running is let to finish
+        """
+        with self._lock:
+            return self._targets.pop(key, None) is not None
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="watch") as executor:
+            while not self._stopped.is_set():
+                target = None
+                with self._lock:
+                    if not self._due and not self.keep_running:
+                        return
+                    delay = self._due[0][0] - time.monotonic() if self._due else None
+                    if delay is not None and delay <= 0:
+                        due_at, key = heapq.heappop(self._due)
+                        # removed targets are dropped when they come due
+                        target = self._targets.get(key)
+                if delay is None or delay > 0:
+                    self._wakeup.wait(delay)
+                    self._wakeup.clear()
+                    continue
+                if target is None:
+                    continue
+                self._submit(executor, key, target)
+                interval = self.schedule.next_interval(target)
+                next_due = due_at + interval
+                # skip missed ticks instead of bursting to catch up after a slow check
+                now = time.monotonic()
+                if next_due < now:
+                    next_due = now + interval - ((now - due_at) % interval)
+                with self._lock:
+                    heapq.heappush(self._due, (next_due, key))
+
+    def _submit(self, executor, key, target):
+        with self._lock:
+            if key in self._in_flight:
+                print("Skipping " + target.name + ", previous check is still running")
+                return
+            self._in_flight.add(key)
+        future = executor.submit(self.check, target)
+        future.add_done_callback(lambda f: self._done(key, target, f))
+
+    def _done(self, key, target, future):
+        with self._lock:
+            self._in_flight.discard(key)
+        error = future.exception()
+        if error is not None:
+            print("Check failed for " + target.name + ": " + repr(error))
+        else:
+            self.schedule.record(target, bool(future.result()))
+
+
+class AsyncWatcher:
+    """
+    asyncio flavour of Watcher, every target runs in its own task on a fixed-rate deadline and all of
+    them share one AsyncSessionRequest, at most max_concurrency checks are running at any time.
+    """
+
+    def __init__(self, targets, check, client, max_concurrency=8, schedule=None):
+        self.targets = targets
+        self.check = check
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.schedule = FixedSchedule() if schedule is None else schedule
+
+    async def run(self):
+        # imported here, asyncio is only needed with --use_async and slows down the start of every command
+        import asyncio
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        try:
+            await asyncio.gather(*[self._watch(target, semaphore) for target in self.targets])
+        finally:
+            await self.client.close()
+
+    async def _watch(self, target, semaphore):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        due_at = loop.time() + self.schedule.first_delay(target)
+        await asyncio.sleep(due_at - loop.time())
+        while True:
+            async with semaphore:
+                try:
+                    changed = await self.check(self.client, target)
+                except Exception as error:
+                    print("Check failed for " + target.name + ": " + repr(error))
+                else:
+                    self.schedule.record(target, bool(changed))
+            interval = self.schedule.next_interval(target)
+            due_at += interval
+            now = loop.time()
+            if due_at < now:
+                due_at = now + interval - ((now - due_at) % interval)
+            await asyncio.sleep(due_at - now)
@@ -1,26 +1,153 @@
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from twilio.base.exceptions import TwilioException, TwilioRestException
+from twilio.http.http_client import TwilioHttpClient
 from twilio.rest import Client
 
+from slot_info.dispatch import SendResult
+from slot_info.rate_limiter import RateLimiter
+
+# a local stand-in for the Twilio API, for example http://127.0.0.1:8768
+twilio_api = os.getenv('SLOTINFO_TWILIO_API')
+
+
+class WhatsAppNotifier:
+    """
+    Sends WhatsApp messages through Twilio with one client, built once over a keep-alive connection pool.
+    A message is sent to many recipients concurrently, at most messages_per_second overall, 429 and 5xx
+    answers being retried with backoff. Every send returns a SendResult with the status of the message and
+    how long it took.
+    """
+
+    def __init__(self, account_sid, auth_token, from_number, recipients=(), api_url=None, max_workers=8,
+                 messages_per_second=10, timeout=10, max_retries=3):
+        self.from_number = from_number
+        self.recipients = [str(recipient) for recipient in recipients]
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        http_client = TwilioHttpClient(pool_connections=True, timeout=timeout)
+        http_client.session.mount('https://', HTTPAdapter(pool_maxsize=max_workers))
+        http_client.session.mount('http://', HTTPAdapter(pool_maxsize=max_workers))
+        self.client = Client(account_sid, auth_token, http_client=http_client)
+        api_url = twilio_api if api_url is None else api_url
+        if api_url:
+            self.client.api.base_url = api_url.rstrip("/")
+        self.rate_limiter = RateLimiter(messages_per_second * 300, burst=messages_per_second)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    # Your Account Sid and Auth Token from twilio.com/console
+    # and set the environment variables. See http://twil.io/secure
+    @classmethod
+    def from_env(cls, **kwargs):
+        """
+        Notifier of TWILIO_ACCOUNT_SID sending from FROM_MOBILE_NUMBER to the comma separated numbers of
+        TO_MOBILE_NUMBER
+        """
+        account_sid = os.getenv('TWILIO_ACCOUNT_SID')
+        auth_token = os.getenv('TWILIO_AUTH_TOKEN')
+        from_mobile_number = os.getenv('FROM_MOBILE_NUMBER')
+        to_mobile_numbers = os.getenv('TO_MOBILE_NUMBER', "").split(",")
+
+        if account_sid is None or auth_token is None:
+            raise ValueError("Please set TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN as env variables")
+
+        if from_mobile_number is None:
+            raise ValueError("Please set FROM_MOBILE_NUMBER and TO_MOBILE_NUMBER as env variables")
+
+        return cls(account_sid, auth_token, from_mobile_number,
+                   [number.strip() for number in to_mobile_numbers if number.strip()], **kwargs)
+
+    def send(self, message, to_mobile_number):
+        """
+        Sends message to one number and returns its SendResult
+        """
+        to_mobile_number = str(to_mobile_number)
+        started = time.perf_counter()
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                sent = self.client.messages.create(from_='whatsapp:{0}'.format(self.from_number),
+                                                   body=message,
+                                                   to='whatsapp:{0}'.format(to_mobile_number))
+                self.rate_limiter.record(200)
+                return SendResult(to_mobile_number, True, sent.status, time.perf_counter() - started)
+            except TwilioRestException as rest_error:
+                status, error = rest_error.status, rest_error.msg
+                self.rate_limiter.record(status)
+            except (TwilioException, requests.RequestException) as send_error:
+                status, error = None, repr(send_error)
+            retriable = status is None or status == 429 or status >= 500
+            if not retriable or attempt >= self.max_retries:
+                return SendResult(to_mobile_number, False, status, time.perf_counter() - started, error)
+            time.sleep(0.5 * (2 ** attempt))
+            attempt += 1
+
+    def broadcast(self, message, recipients=None):
+        """
+        Sends message to every number of recipients, all the recipients of the notifier by default, and returns
+        the SendResult of every number in the same order
+        """
+        recipients = self.recipients if recipients is None else [str(recipient) for recipient in recipients]
+        if not recipients:
+            raise ValueError("Please set FROM_MOBILE_NUMBER and TO_MOBILE_NUMBER as env variables")
+        if len(recipients) == 1:
+            return [self.send(message, recipients[0])]
+        futures = []
+        try:
+            for recipient in recipients:
+                futures.append(self._pool().submit(self.send, message, recipient))
+        except RuntimeError:
+            # no new threads can be started once the interpreter is shutting down, the rest is sent from here
+            return [future.result() for future in futures] + \
+                [self.send(message, recipient) for recipient in recipients[len(futures):]]
+        return [future.result() for future in futures]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+        self.client.http_client.session.close()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="whatsapp")
+            return self._executor
+
 
-# Your Account Sid and Auth Token from twilio.com/console
-# and set the environment variables. See http://twil.io/secure
-def send_whatsapp_message(message):
-    account_sid = os.getenv('TWILIO_ACCOUNT_SID')
-    auth_token = os.getenv('TWILIO_AUTH_TOKEN')
-    from_mobile_number = os.getenv('FROM_MOBILE_NUMBER')
-    to_mobile_number = os.getenv('TO_MOBILE_NUMBER')
+_notifier = None
+_notifier_lock = threading.Lock()
 
-    if account_sid is None or auth_token is None:
-        raise ValueError("Please set TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN as env variables")
 
-    if from_mobile_number is None or to_mobile_number is None:
-        raise ValueError("Please set FROM_MOBILE_NUMBER and TO_MOBILE_NUMBER as env variables")
+def default_notifier():
+    global _notifier
+    with _notifier_lock:
+        if _notifier is None:
+            _notifier = WhatsAppNotifier.from_env()
+        return _notifier
 
-    client = Client(account_sid, auth_token)
 
-    message = client.messages \
-        .create(
-        from_='whatsapp:{0}'.format(from_mobile_number),
-        body=message,
-        to='whatsapp:{0}'.format(to_mobile_number))
-    print(message.sid)
+def send_whatsapp_message(message, to_mobile_number=None):
+    """
+    Sends the message to to_mobile_number, or to every number of TO_MOBILE_NUMBER, prints the status of every
+    number and returns the results of the numbers it could not be sent to. When there is a single number a
+    failure is raised instead.
+    """
+    results = default_notifier().broadcast(message, None if to_mobile_number is None else [to_mobile_number])
+    for result in results:
+        if result.ok:
+            print("WhatsApp message to " + result.recipient + ": " + str(result.status) + " in " +
+                  str(round(result.latency, 3)) + "s")
+    failed = [result for result in results if not result.ok]
+    if len(results) == 1 and failed:
+        if failed[0].status is not None and 400 <= failed[0].status < 500 and failed[0].status != 429:
+            # a wrong number or credentials, retrying will not help
+            raise ValueError("Twilio refused the message: " + str(failed[0].error))
+        raise RuntimeError("WhatsApp message not sent: " + str(failed[0].error))
+    return failed
@@ -0,0 +1,12 @@
+import os
+import shutil
+import tempfile
+
+# set before slot_info is imported, the state directory is read once at import time
+state_dir = tempfile.mkdtemp(prefix="slotinfo-tests-")
+os.environ['SLOTINFO_HOME'] = state_dir
+os.environ['SLOTINFO_DEDUP'] = "memory"
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(state_dir, ignore_errors=True)
@@ -0,0 +1,137 @@
+import json
+import random
+
+import pytest
+
+import slot_info.check_available_slots as check
+from slot_info.dedup import MemoryDedupStore
+from slot_info.diff import SnapshotStore
+from slot_info.pincodes import PincodeMap
+from slot_info.replay import ReplayServer, SyntheticCalendar, synthetic_centers
+from slot_info.session_requests import ChangeTracker
+from slot_info.watch import WatchTarget, plan_targets
+
+
+class Dispatched:
+    def __init__(self):
+        self.parts = []
+
+    def dispatch(self, parts, notify_on, recipient=None):
+        self.parts.extend((notify_on, recipient, part) for part in parts)
+        return parts
+
+
+@pytest.fixture
+def cowin(monkeypatch):
+    server = ReplayServer(SyntheticCalendar(70, seed=4)).start()
+    monkeypatch.setattr(check, "BASE_API", server.url)
+    monkeypatch.setattr(check.session_requests, "rate_limiter", None)
+    monkeypatch.setattr(check.session_requests.single_flight, "ttl", 0)
+    monkeypatch.setattr(check, "dedup_store", MemoryDedupStore())
+    monkeypatch.setattr(check, "snapshots", SnapshotStore())
+    monkeypatch.setattr(check, "response_digests", ChangeTracker())
+    monkeypatch.setattr(check, "history", None)
+    monkeypatch.setattr(check, "pincode_map", PincodeMap(path=""))
+    monkeypatch.setattr(check, "dispatcher", Dispatched())
+    yield server
+    server.stop()
+
+
+def synthetic_sessions(variant, date="10-05-2021"):
+    return [(center, session) for center in synthetic_centers(70, date, random.Random(4 + variant))
+            for session in center['sessions']]
+
+
+def expected_names(variant, age, previous=()):
+    return sorted(set(center['name'] for center, session in synthetic_sessions(variant)
+                      if session['min_age_limit'] == age and session['available_capacity'] > 0 and
+                      session['session_id'] not in previous))
+
+
+def notified_names(dispatched):
+    return sorted(set(line[len("Name : "):] for _, _, part in dispatched.parts for line in part.split("\n")
+                      if line.startswith("Name : ")))
+
+
+def test_calendar_target_notifies_opened_sessions_once(cowin):
+    target = WatchTarget.from_dict({"district_id": "363", "date": "10-05-2021", "next7days": True,
+                                    "notify_on": "telegram", "age_filter": ["18"], "interval": 5})
+    assert check.check_target(target)
+    assert cowin.requests == 1
+    assert notified_names(check.dispatcher) == expected_names(0, 18)
+    assert all(notify_on == "telegram" and recipient is None for notify_on, recipient, _ in check.dispatcher.parts)
+
+    # the next poll gets other capacities, only sessions that were not available before are sent
+    first_ids = set(session['session_id'] for _, session in synthetic_sessions(0)
+                    if session['min_age_limit'] == 18 and session['available_capacity'] > 0)
+    check.dispatcher.parts = []
+    assert check.check_target(target)
+    assert notified_names(check.dispatcher) == expected_names(1, 18, first_ids)
+
+
+def test_targets_of_one_location_share_a_request(cowin):
+    targets = [WatchTarget.from_dict({"district_id": "363", "date": "10-05-2021", "next7days": True,
+                                      "notify_on": "telegram", "age_filter": [age], "interval": 5,
+                                      "recipient": recipient})
+               for age, recipient in (("18", "a"), ("45", "b"), ("18", "c"))]
+    planned = plan_targets(targets, lambda pin_code: None)
+    assert len(planned) == 1
+    assert check.check_target(planned[0])
+    assert cowin.requests == 1
+    by_recipient = {}
+    for _, recipient, part in check.dispatcher.parts:
+        by_recipient.setdefault(recipient, []).append(part)
+    assert by_recipient["a"] == by_recipient["c"]
+    assert by_recipient["a"] != by_recipient["b"]
+
+
+def test_unchanged_response_is_not_processed_again(cowin, monkeypatch):
+    monkeypatch.setattr(cowin.responder, "variants", 1)
+    target = WatchTarget.from_dict({"district_id": "363", "date": "10-05-2021", "notify_on": "telegram",
+                                    "interval": 5})
+    assert check.check_target(target)
+    assert not check.check_target(target)
+    assert cowin.requests == 2
+
+
+def test_errors_are_reported_without_raising(cowin, monkeypatch, capsys):
+    monkeypatch.setattr(cowin, "error_rate", 1.0)
+    target = WatchTarget.from_dict({"pin_code": "411001", "date": "10-05-2021", "notify_on": "telegram",
+                                    "interval": 5})
+    assert not check.check_target(target)
+    assert "503" in capsys.readouterr().out
+
+
+def test_one_shot_check_sends_to_every_chat_before_returning(cowin, monkeypatch, tmp_path):
+    from slot_info import telegram
+    from slot_info.dispatch import Dispatcher
+    from slot_info.replay import MessagingServer
+
+    messaging = MessagingServer().start()
+    notifier = telegram.TelegramNotifier("123:token", ["1", "2"], api_url=messaging.url)
+    monkeypatch.setattr(telegram, "_notifier", notifier)
+    monkeypatch.setattr(check, "dispatcher", Dispatcher(check.send_message,
+                                                        spool_path=str(tmp_path / "dead_letter.jsonl")))
+    try:
+        check.check_once({"district_id": "363", "date": "10-05-2021", "notify_on": "telegram"}, next7days=True)
+    finally:
+        notifier.close()
+        messaging.stop()
+    assert messaging.sent_to("1") and messaging.sent_to("1") == messaging.sent_to("2")
+    assert not (tmp_path / "dead_letter.jsonl").exists()
+
+
+def test_session_reopening_after_an_empty_response_is_notified_again(cowin, monkeypatch):
+    session = {"session_id": "s-1", "date": "10-05-2021", "available_capacity": 5, "available_capacity_dose1": 5,
+               "available_capacity_dose2": 0, "min_age_limit": 18, "vaccine": "COVISHIELD", "slots": []}
+    center = {"center_id": 1, "name": "Center 1", "pincode": 411001, "fee_type": "Free"}
+    bodies = iter([{"sessions": [dict(session, **center)]}, {"sessions": []},
+                   {"sessions": [dict(session, **center)]}])
+    monkeypatch.setattr(cowin, "responder", lambda path, params: (200, json.dumps(next(bodies)).encode("utf-8")))
+    monkeypatch.setattr(check, "dedup_store", MemoryDedupStore(ttl=0))
+    target = WatchTarget.from_dict({"pin_code": "411001", "date": "10-05-2021", "notify_on": "telegram",
+                                    "interval": 5})
+    for _ in range(3):
+        check.check_target(target)
+    assert notified_names(check.dispatcher) == ["Center 1"]
+    assert len(check.dispatcher.parts) == 2
@@ -0,0 +1,94 @@
+import threading
+import time
+
+import pytest
+
+from slot_info.coalesce import SingleFlight
+
+
+def test_concurrent_calls_share_one_fetch():
+    single_flight = SingleFlight(ttl=0)
+    calls = []
+    started = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return "body"
+
+    results = []
+    owner = threading.Thread(target=lambda: results.append(single_flight.do("key", fetch)))
+    owner.start()
+    started.wait()
+    waiters = [threading.Thread(target=lambda: results.append(single_flight.do("key", fetch))) for _ in range(5)]
+    for waiter in waiters:
+        waiter.start()
+    for thread in [owner] + waiters:
+        thread.join()
+    assert results == ["body"] * 6
+    assert len(calls) == 1
+    assert single_flight.stats() == {"hits": 0, "misses": 1, "shared": 5}
+
+
+def test_results_are_memoized_for_ttl():
+    single_flight = SingleFlight(ttl=0.2)
+    values = iter(range(10))
+    assert single_flight.do("key", lambda: next(values)) == 0
+    assert single_flight.do("key", lambda: next(values)) == 0
+    assert single_flight.do("other", lambda: next(values)) == 1
+    time.sleep(0.25)
+    assert single_flight.do("key", lambda: next(values)) == 2
+    assert single_flight.stats()['hits'] == 1
+
+
+def test_errors_reach_every_caller_and_are_not_memoized():
+    single_flight = SingleFlight(ttl=10)
+    started = threading.Event()
+
+    def failing():
+        started.set()
+        time.sleep(0.1)
+        raise RuntimeError("down")
+
+    errors = []
+
+    def call():
+        try:
+            single_flight.do("key", failing)
+        except RuntimeError as error:
+            errors.append(error)
+
+    owner = threading.Thread(target=call)
+    owner.start()
+    started.wait()
+    waiter = threading.Thread(target=call)
+    waiter.start()
+    owner.join()
+    waiter.join()
+    assert len(errors) == 2
+    assert single_flight.do("key", lambda: "body") == "body"
+
+
+def test_memo_is_pruned_at_max_size():
+    single_flight = SingleFlight(ttl=0.05, max_size=3)
+    for number in range(3):
+        single_flight.do(number, lambda: number)
+    time.sleep(0.1)
+    single_flight.do("new", lambda: "new")
+    assert list(single_flight._memo) == ["new"]
+
+
+def test_fetch_errors_propagate_to_the_owner():
+    with pytest.raises(ValueError):
+        SingleFlight().do("key", lambda: int("x"))
+
+
+def test_expired_results_are_not_kept():
+    single_flight = SingleFlight(ttl=0.05)
+    single_flight.do("key", lambda: "body")
+    single_flight.do("other", lambda: "body")
+    time.sleep(0.1)
+    assert single_flight.do("key", lambda: "fresh") == "fresh"
+    # other is dropped along the way although it was never asked for again
+    assert list(single_flight._memo) == ["key"]
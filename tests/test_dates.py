@@ -0,0 +1,55 @@
+import random
+from datetime import timedelta
+
+import pytest
+
+from slot_info.dates import date_range, format_date, parse_date, plan_windows, window_dates
+
+
+def covered(windows):
+    return set(date for window in windows for date in window_dates(window))
+
+
+def test_long_range_is_split_into_consecutive_windows():
+    assert plan_windows([("10-05-2021", "25-05-2021")]) == ["10-05-2021", "17-05-2021", "24-05-2021"]
+
+
+def test_overlapping_and_adjacent_ranges_share_windows():
+    ranges = [("10-05-2021", "12-05-2021"), ("11-05-2021", "14-05-2021"), ("15-05-2021", "16-05-2021")]
+    assert plan_windows(ranges) == ["10-05-2021"]
+
+
+def test_disjoint_ranges_get_their_own_windows():
+    assert plan_windows([("20-05-2021", "21-05-2021"), ("10-05-2021", "10-05-2021")]) == \
+        ["10-05-2021", "20-05-2021"]
+
+
+def runs(dates):
+    days = sorted(parse_date(date) for date in dates)
+    lengths = [1]
+    for previous, day in zip(days, days[1:]):
+        if day - previous == timedelta(days=1):
+            lengths[-1] += 1
+        else:
+            lengths.append(1)
+    return lengths
+
+
+def test_random_ranges_are_covered_with_the_fewest_windows_per_run_of_dates():
+    rng = random.Random(7)
+    start = parse_date("01-05-2021")
+    for _ in range(200):
+        ranges = []
+        for _ in range(rng.randint(1, 6)):
+            first = start + timedelta(days=rng.randint(0, 40))
+            ranges.append((format_date(first), format_date(first + timedelta(days=rng.randint(0, 15)))))
+        windows = plan_windows(ranges)
+        wanted = set(date for first, last in ranges for date in date_range(first, last))
+        assert wanted <= covered(windows)
+        assert all(window in wanted for window in windows)
+        assert len(windows) == sum((length + 6) // 7 for length in runs(wanted))
+
+
+def test_invalid_date_is_rejected():
+    with pytest.raises(ValueError):
+        plan_windows([("2021-05-10", "12-05-2021")])
@@ -0,0 +1,55 @@
+import pytest
+
+from slot_info import dedup
+from slot_info.dedup import SqliteDedupStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(dedup.time, "time", clock)
+    return clock
+
+
+def test_key_is_added_once_within_ttl(tmp_path, clock):
+    store = SqliteDedupStore(str(tmp_path / "dedup.sqlite3"), ttl=60)
+    assert store.add("telegram:|s-1")
+    assert not store.add("telegram:|s-1")
+    assert "telegram:|s-1" in store
+    clock.now += 59
+    assert not store.add("telegram:|s-1")
+    clock.now += 2
+    assert "telegram:|s-1" not in store
+    assert store.add("telegram:|s-1")
+    store.close()
+
+
+def test_store_is_shared_through_the_database(tmp_path, clock):
+    path = str(tmp_path / "dedup.sqlite3")
+    first, second = SqliteDedupStore(path), SqliteDedupStore(path)
+    assert first.add("key")
+    assert not second.add("key")
+    first.close()
+    second.close()
+
+
+def test_expired_and_oldest_keys_are_evicted(tmp_path, clock):
+    store = SqliteDedupStore(str(tmp_path / "dedup.sqlite3"), ttl=100, max_size=3)
+    store.evict_every = 1
+    for number in range(5):
+        store.add("key " + str(number))
+        clock.now += 1
+    rows = store.connection.execute("SELECT key FROM seen ORDER BY expires_at").fetchall()
+    assert [row[0] for row in rows] == ["key 2", "key 3", "key 4"]
+    clock.now += 100
+    store.add("new")
+    assert store.connection.execute("SELECT key FROM seen").fetchall() == [("new",)]
+    store.close()
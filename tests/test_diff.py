@@ -0,0 +1,41 @@
+from slot_info.diff import SnapshotStore
+from slot_info.models import Center, Session
+
+center = Center(1, "Center", 411001)
+
+
+def session(session_id, capacity):
+    return Session(session_id, center, "10-05-2021", capacity, capacity, 0, 18, "COVISHIELD")
+
+
+def test_first_poll_opens_every_session():
+    delta = SnapshotStore().diff("scope", [session("a", 1), session("b", 2)])
+    assert [s.session_id for s in delta.opened] == ["a", "b"]
+    assert len(delta) == 2
+
+
+def test_changes_against_the_previous_poll():
+    snapshots = SnapshotStore()
+    snapshots.diff("scope", [session("a", 5), session("b", 5), session("c", 5)])
+    delta = snapshots.diff("scope", [session("a", 5), session("b", 8), session("c", 2), session("d", 1)])
+    assert [s.session_id for s in delta.opened] == ["d"]
+    assert [(s.session_id, previous) for s, previous in delta.increased] == [("b", 5)]
+    assert [(s.session_id, previous) for s, previous in delta.decreased] == [("c", 5)]
+    assert delta.closed == []
+    delta = snapshots.diff("scope", [session("a", 5)])
+    assert sorted((s.session_id, previous) for s, previous in delta.closed) == [("b", 8), ("c", 2), ("d", 1)]
+
+
+def test_unchanged_poll_is_empty():
+    snapshots = SnapshotStore()
+    snapshots.diff("scope", [session("a", 5)])
+    assert not snapshots.diff("scope", [session("a", 5)])
+
+
+def test_scopes_are_diffed_separately_and_can_be_forgotten():
+    snapshots = SnapshotStore()
+    snapshots.diff("first", [session("a", 5)])
+    assert snapshots.diff("second", [session("a", 5)]).opened
+    assert not snapshots.diff("first", [session("a", 5)])
+    snapshots.forget("first")
+    assert snapshots.diff("first", [session("a", 5)]).opened
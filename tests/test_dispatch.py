@@ -0,0 +1,79 @@
+import json
+import threading
+import time
+
+from slot_info.dispatch import Dispatcher, SendResult, chunk_messages, escaped_length
+
+
+def test_parts_are_packed_in_order_within_the_limit():
+    parts = ["a" * 40, "b" * 40, "c" * 10, "d" * 90]
+    messages = chunk_messages(parts, 100)
+    assert messages == ["a" * 40 + "\n\n" + "b" * 40 + "\n\n" + "c" * 10, "d" * 90]
+
+
+def test_long_part_is_split():
+    messages = chunk_messages(["x" * 5, "y" * 250, "z" * 5], 100)
+    assert all(len(message) <= 100 for message in messages)
+    assert messages == ["x" * 5, "y" * 100, "y" * 100, "y" * 50 + "\n\n" + "z" * 5]
+
+
+def test_no_parts_no_messages():
+    assert chunk_messages([], 100) == []
+    assert chunk_messages(["", ""], 100) == []
+
+
+def spooled(path):
+    with open(path) as spool:
+        return [json.loads(line) for line in spool]
+
+
+def test_failed_recipients_are_spooled_once(tmp_path):
+    calls = []
+
+    def send(message, notify_on, recipient=None):
+        calls.append((message, recipient))
+        if recipient == "down":
+            raise RuntimeError("unreachable")
+        return [SendResult("b", False, 500)]
+
+    dispatcher = Dispatcher(send, spool_path=str(tmp_path / "dead_letter.jsonl"))
+    dispatcher.enqueue("first", "telegram")
+    dispatcher.enqueue("second", "telegram", "down")
+    assert dispatcher.close() == 0
+    assert len(calls) == 2
+    assert sorted((entry['message'], entry['recipient']) for entry in spooled(dispatcher.spool_path)) == \
+        [("first", "b"), ("second", "down")]
+    # replayed messages are sent again and the ones that fail are spooled again
+    assert dispatcher.replay() == 2
+    dispatcher.close()
+    assert len(calls) == 4
+    assert len(spooled(dispatcher.spool_path)) == 2
+
+
+def test_close_spools_what_is_left_after_its_deadline(tmp_path):
+    release = threading.Event()
+
+    def send(message, notify_on, recipient=None):
+        release.wait(5)
+
+    dispatcher = Dispatcher(send, workers=1, spool_path=str(tmp_path / "dead_letter.jsonl"))
+    for number in range(3):
+        dispatcher.enqueue("message " + str(number), "telegram")
+    started = time.monotonic()
+    assert dispatcher.close(timeout=0.2) == 3
+    assert time.monotonic() - started < 1
+    release.set()
+    time.sleep(0.1)
+    # the message that was being sent is not spooled a second time when the send ends
+    assert sorted(entry['message'] for entry in spooled(dispatcher.spool_path)) == \
+        ["message 0", "message 1", "message 2"]
+
+
+def test_telegram_messages_fit_once_escaped():
+    from slot_info.telegram import escape_markdown
+
+    parts = ["Name : Center_" + str(number) + " *[A]*\n" + "x" * 150 for number in range(100)] + ["_" * 5000]
+    messages = chunk_messages(parts, 4096, length=escaped_length)
+    assert all(len(escape_markdown(message)) <= 4096 for message in messages)
+    assert "\n\n".join(messages[:-3]) == "\n\n".join(parts[:-1])
+    assert "".join(messages[-3:]) == "_" * 5000
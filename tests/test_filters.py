@@ -0,0 +1,57 @@
+import random
+
+from slot_info.filters import SessionFilter, SubscriberIndex
+from slot_info.models import Center, Session
+
+dates = ["10-05-2021", "11-05-2021", "12-05-2021"]
+slots = ["09:00AM-11:00AM", "11:00AM-01:00PM", "01:00PM-03:00PM", "03:00PM-06:00PM"]
+
+
+class Subscriber:
+    def __init__(self, session_filter):
+        self.session_filter = session_filter
+
+
+def random_filter(rng):
+    return SessionFilter(age_filter=rng.sample(["18", "45"], rng.randint(0, 2)),
+                         vaccine_types=rng.sample(["covishield", "covaxin", "sputnik v"], rng.randint(0, 2)),
+                         dose_number=rng.sample(["1", "2"], rng.randint(0, 2)),
+                         fee_types=rng.sample(["free", "paid"], rng.randint(0, 1)),
+                         slot_time=rng.choice([None, None, "09:00-12:00", "15:00-18:00"]),
+                         min_capacity=rng.choice([1, 1, 5]),
+                         dates=rng.sample(dates, rng.choice([0, 0, 2])))
+
+
+def random_session(rng, index):
+    dose1, dose2 = rng.choice([0, 0, 3, 10]), rng.choice([0, 2, 8])
+    center = Center(index, "Center " + str(index), 411000 + index, "Pune", rng.choice(["Free", "Paid"]))
+    return Session("s-" + str(index), center, rng.choice(dates), dose1 + dose2, dose1, dose2,
+                   rng.choice([18, 45]), rng.choice(["COVISHIELD", "Covaxin", "SPUTNIK V", "ZYCOV-D"]),
+                   tuple(rng.sample(slots, rng.randint(0, 2))))
+
+
+def test_match_is_the_brute_force_filter():
+    rng = random.Random(3)
+    subscribers = [Subscriber(random_filter(rng)) for _ in range(300)]
+    index = SubscriberIndex(subscribers)
+    assert len(index) < len(subscribers)
+    for number in range(2000):
+        session = random_session(rng, number)
+        assert sorted(index.match(session)) == \
+            [i for i, session_filter in enumerate(index.filters) if session_filter(session)]
+
+
+def test_identical_filters_are_grouped():
+    first, second = Subscriber(SessionFilter(["18"], ["covaxin"])), Subscriber(SessionFilter(["18"], ["COVAXIN"]))
+    other = Subscriber(SessionFilter(["45"]))
+    index = SubscriberIndex([first, other, second])
+    assert index.groups == [[first, second], [other]]
+
+
+def test_partition_keeps_groups_without_sessions():
+    rng = random.Random(5)
+    sessions = [random_session(rng, number) for number in range(100)]
+    index = SubscriberIndex([Subscriber(SessionFilter()), Subscriber(SessionFilter(min_capacity=1000))])
+    (_, _, matched), (_, _, unmatched) = index.partition(sessions)
+    assert matched == [session for session in sessions if session.available_capacity > 0]
+    assert unmatched == []
@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+from slot_info.replay import MessagingServer
+
+
+@pytest.fixture
+def messaging():
+    server = MessagingServer(latency=0.01, refused=["bad"], seed=1).start()
+    yield server
+    server.stop()
+
+
+def test_whatsapp_broadcast_reaches_every_number(messaging):
+    pytest.importorskip("twilio")
+    from slot_info.whatsapp import WhatsAppNotifier
+
+    numbers = ["+9190000" + str(index).zfill(5) for index in range(100)]
+    notifier = WhatsAppNotifier("AC" + "0" * 32, "token", "+14155238886", numbers, api_url=messaging.url,
+                                max_workers=8, messages_per_second=20)
+    try:
+        started = time.monotonic()
+        results = notifier.broadcast("Slots open")
+        elapsed = time.monotonic() - started
+    finally:
+        notifier.close()
+    assert [result.recipient for result in results] == numbers
+    assert all(result.ok and result.status == "queued" for result in results)
+    assert sorted(recipient for _, recipient, _ in messaging.messages) == numbers
+    # 20 messages go out at once, the other 80 at 20 per second
+    assert 3.5 < elapsed < 10
+
+
+def test_whatsapp_refused_number_is_not_retried(messaging):
+    pytest.importorskip("twilio")
+    from slot_info.whatsapp import WhatsAppNotifier
+
+    notifier = WhatsAppNotifier("AC" + "0" * 32, "token", "+14155238886", api_url=messaging.url)
+    try:
+        good, bad = notifier.broadcast("Slots open", ["+919000000001", "bad"])
+    finally:
+        notifier.close()
+    assert good.ok and not bad.ok
+    assert bad.status == 400
+    assert messaging.requests == 2
+
+
+def test_telegram_broadcast_retries_throttled_chats(messaging):
+    from slot_info.telegram import TelegramNotifier
+
+    messaging.error_rate = 0.2
+    messaging.retry_after = 0
+    chats = [str(100 + index) for index in range(20)]
+    notifier = TelegramNotifier("123:token", api_url=messaging.url, max_workers=4)
+    try:
+        results = notifier.broadcast("Slots *open* at [center]", chats + ["bad"])
+    finally:
+        notifier.close()
+    assert [result.recipient for result in results] == chats + ["bad"]
+    assert all(result.ok for result in results[:-1])
+    assert results[-1].status == 400 and not results[-1].ok
+    assert messaging.errors > 1
+    for chat in chats:
+        assert messaging.sent_to(chat) == ["Slots \\*open\\* at \\[center]"]
@@ -0,0 +1,27 @@
+from slot_info.shard import HashRing, shard_key, shard_targets
+from slot_info.watch import WatchTarget
+
+
+def target(**location):
+    return WatchTarget.from_dict(dict(location, date="10-05-2021", notify_on="telegram", interval=5))
+
+
+def test_every_target_is_in_exactly_one_shard():
+    targets = [target(district_id=300 + number) for number in range(50)] + \
+        [target(pin_code=411000 + number) for number in range(50)]
+    shards = [shard_targets(targets, (index, 4)) for index in range(4)]
+    assert sorted(id(t) for shard in shards for t in shard) == sorted(id(t) for t in targets)
+    assert all(shards)
+
+
+def test_pin_codes_are_sharded_by_pin_code():
+    assert shard_key(target(pin_code="411001")) == "pincode:411001"
+    assert shard_key(target(district_id=363)) == "district:363"
+
+
+def test_adding_a_shard_only_moves_keys_to_it():
+    keys = ["district:" + str(number) for number in range(1000)]
+    before, after = HashRing(4), HashRing(5)
+    moved = [key for key in keys if before.shard_for(key) != after.shard_for(key)]
+    assert all(after.shard_for(key) == 4 for key in moved)
+    assert 100 < len(moved) < 300